@@ -0,0 +1,51 @@
+import timeit
+
+import numpy as np
+
+from mcl_toolbox.env.generic_mouselab import RESET_MODES, GenericMouselabEnv
+from mcl_toolbox.global_vars import features, structure
+
+"""
+Benchmarks the reset of the environment between simulations
+python3 benchmarks/env_reset.py
+"""
+
+
+def run_episode(env, actions):
+    env.reset()
+    for _ in range(env.num_trials):
+        for action in actions:
+            env.step(action)
+
+
+if __name__ == "__main__":
+    exp_name = "v1.0"
+    num_trials = 35
+    repeats = 20
+
+    pipeline = [structure.exp_pipelines[exp_name][0]] * num_trials
+    feature_list = features.implemented
+    actions = [3, 1, 4, 9, 0]
+
+    for trial_backend in ["node", "array"]:
+        for reset_mode in RESET_MODES:
+            np.random.seed(0)
+            env = GenericMouselabEnv(
+                num_trials,
+                pipeline,
+                trial_backend=trial_backend,
+                reset_mode=reset_mode,
+            )
+            env.attach_features(feature_list, None)
+            run_episode(env, actions)
+            reset_time = min(timeit.repeat(env.reset, number=repeats, repeat=5))
+            episode_time = min(
+                timeit.repeat(
+                    lambda: run_episode(env, actions), number=1, repeat=5
+                )
+            )
+            print(
+                f"{trial_backend} backend, {reset_mode} reset: "
+                f"{1000 * reset_time / repeats:.2f} ms per reset, "
+                f"{1000 * episode_time:.2f} ms per simulation of {num_trials} trials"
+            )
@@ -0,0 +1,49 @@
+import time
+
+import numpy as np
+
+from mcl_toolbox.env.feature_plan import FeatureCache, FeaturePlan
+from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.global_vars import features, structure
+from mcl_toolbox.utils.sequence_utils import compute_trial_features
+
+"""
+Benchmarks the feature matrices of the same click sequences computed repeatedly
+(as in the optimization iterations of a fit) with and without a FeatureCache
+python3 benchmarks/feature_cache.py
+"""
+
+
+def compute_features(pipeline, ground_truths, click_sequences, feature_plan):
+    for ground_truth, clicks in zip(ground_truths, click_sequences):
+        compute_trial_features(
+            pipeline, list(ground_truth), clicks, feature_plan, None
+        )
+
+
+if __name__ == "__main__":
+    exp_name = "v1.0"
+    num_trials = 35
+    repeats = 10
+
+    pipeline = [structure.exp_pipelines[exp_name][0]] * num_trials
+    np.random.seed(0)
+    ground_truths = GenericMouselabEnv(num_trials, pipeline).ground_truth
+    rng = np.random.default_rng(0)
+    click_sequences = [
+        list(rng.permutation(np.arange(1, 13))[: rng.integers(0, 13)]) + [0]
+        for _ in range(num_trials)
+    ]
+
+    for name, cache in [("no cache", None), ("cache", FeatureCache())]:
+        feature_plan = FeaturePlan(features.microscope, cache=cache)
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            compute_features(pipeline, ground_truths, click_sequences, feature_plan)
+        run_time = time.perf_counter() - start_time
+        print(
+            f"{name}: {1000 * run_time / repeats:.2f} ms per evaluation of "
+            f"{num_trials} trials"
+        )
+        if cache is not None:
+            print(cache.info())
@@ -0,0 +1,41 @@
+import timeit
+
+import numpy as np
+
+from mcl_toolbox.env.ground_truth import iter_ground_truths, sample_ground_truths
+from mcl_toolbox.env.modified_mouselab import TrialSequence
+from mcl_toolbox.global_vars import structure
+
+"""
+Benchmarks sampling ground truths node by node in a TrialSequence per trial
+and in batches
+python3 benchmarks/ground_truth.py
+"""
+
+
+def sample_node_by_node(pipeline, num_samples):
+    return [TrialSequence(1, pipeline).ground_truth[0] for _ in range(num_samples)]
+
+
+def sample_in_chunks(pipeline, num_samples):
+    for _ in iter_ground_truths(pipeline[0], num_samples, chunk_size=10000):
+        pass
+
+
+if __name__ == "__main__":
+    exp_name = "v1.0"
+    pipeline = [structure.exp_pipelines[exp_name][0]]
+    np.random.seed(0)
+
+    for num_samples in [1000, 100000]:
+        for name, run in [
+            ("sequence per trial", sample_node_by_node),
+            ("batched", lambda pipeline, n: sample_ground_truths(pipeline[0], n)),
+            ("chunked", sample_in_chunks),
+        ]:
+            if name == "sequence per trial" and num_samples > 1000:
+                continue
+            run_time = min(
+                timeit.repeat(lambda: run(pipeline, num_samples), number=1, repeat=3)
+            )
+            print(f"{name}: {num_samples} ground truths in {1000 * run_time:.2f} ms")
@@ -0,0 +1,44 @@
+"""
+Benchmarks the maximum of categorical distributions computed from the product
+of their supports and from their CDFs, and the value of information of a tree
+with 11 reward values per node
+python3 benchmarks/node_value.py
+"""
+
+import timeit
+
+from mcl_toolbox.env.mouselab import (MouselabEnv, exact_node_value_after_observe,
+                                      get_cache_info)
+from mcl_toolbox.utils.distributions import Categorical, categorical_max, cross
+
+
+def high_variance_reward(depth):
+    if depth > 0:
+        return Categorical([-100, -50, -20, -10, -5, 0, 5, 10, 20, 50, 100])
+    return 0.0
+
+
+def clear_caches():
+    exact_node_value_after_observe.cache_clear()
+    categorical_max.cache_clear()
+
+
+if __name__ == "__main__":
+    dists = (high_variance_reward(1),) * 4
+    for name, run in [
+        ("product of supports", lambda: cross(dists, max)),
+        ("CDF product", lambda: categorical_max.__wrapped__(dists)),
+    ]:
+        run_time = min(timeit.repeat(run, number=1, repeat=3))
+        print(f"{name}: max of 4 x 11 values in {1000 * run_time:.2f} ms")
+
+    env = MouselabEnv.new_symmetric([3, 3], high_variance_reward, seed=0)
+    for name, setup in [("uncached", clear_caches), ("cached", lambda: None)]:
+        run_time = min(
+            timeit.repeat(
+                lambda: env.vpi(env._state), setup=setup, number=1, repeat=3
+            )
+        )
+        print(f"vpi of a 3-3 tree, {name}: {1000 * run_time:.2f} ms")
+    for name, info in get_cache_info().items():
+        print(name, info)
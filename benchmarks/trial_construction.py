@@ -0,0 +1,68 @@
+import timeit
+import tracemalloc
+
+from mcl_toolbox.env.array_mouselab import TRIAL_BACKENDS
+from mcl_toolbox.env.modified_mouselab import TrialSequence
+from mcl_toolbox.global_vars import features, structure
+
+"""
+Benchmarks the construction of trial sequences and the evaluation of features
+python3 benchmarks/trial_construction.py
+"""
+
+
+def construct_sequence(pipeline, num_trials=35, trial_class=None):
+    return TrialSequence(num_trials, pipeline, trial_class=trial_class)
+
+
+def evaluate_features(sequence, feature_list):
+    for trial in sequence.trial_sequence:
+        for node in trial.node_map.values():
+            node.compute_termination_feature_values(feature_list)
+
+
+if __name__ == "__main__":
+    exp_name = "v1.0"
+    num_trials = 35
+    repeats = 30
+
+    pipeline = [structure.exp_pipelines[exp_name][0]] * num_trials
+    feature_list = features.implemented
+
+    for trial_backend, trial_class in TRIAL_BACKENDS.items():
+        print(f"Trial backend: {trial_backend}")
+        construction_time = min(
+            timeit.repeat(
+                lambda: construct_sequence(pipeline, num_trials, trial_class),
+                number=repeats,
+                repeat=5,
+            )
+        )
+        print(
+            f"Construction of {num_trials} trials: "
+            f"{1000 * construction_time / repeats:.2f} ms per sequence"
+        )
+
+        tracemalloc.start()
+        sequences = [
+            construct_sequence(pipeline, num_trials, trial_class)
+            for _ in range(repeats)
+        ]
+        current_memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"Memory of {num_trials} trials: "
+            f"{current_memory / repeats / 1024:.1f} KiB per sequence"
+        )
+
+        evaluation_time = min(
+            timeit.repeat(
+                lambda: evaluate_features(sequences[0], feature_list),
+                number=1,
+                repeat=5,
+            )
+        )
+        print(
+            f"Feature evaluation of {num_trials} trials: "
+            f"{1000 * evaluation_time:.2f} ms per sequence"
+        )
@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+
+from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.env.vector_mouselab import VectorMouselabEnv
+from mcl_toolbox.global_vars import features, structure
+
+"""
+Benchmarks simulations of random click sequences run one after the other in
+GenericMouselabEnv and in lockstep in VectorMouselabEnv
+python3 benchmarks/vector_env.py
+"""
+
+
+def random_actions(available_actions, rng):
+    # Terminate with probability 1 / 4, click a random unobserved node otherwise
+    actions = np.zeros(len(available_actions), dtype=int)
+    for env_num, available in enumerate(available_actions):
+        clicks = np.flatnonzero(available[1:]) + 1
+        if len(clicks) and rng.random() > 0.25:
+            actions[env_num] = rng.choice(clicks)
+    return actions
+
+
+def run_sequential(num_simulations, num_trials, pipeline, ground_truth, rng):
+    env = GenericMouselabEnv(num_trials, pipeline, ground_truth=ground_truth)
+    env.attach_features(features.implemented, None)
+    for _ in range(num_simulations):
+        env.reset()
+        for _ in range(num_trials):
+            done = False
+            while not done:
+                env.get_feature_state()
+                available = np.zeros(env.num_nodes, dtype=bool)
+                available[env.get_available_actions()] = True
+                available[0] = True
+                action = random_actions([available], rng)[0]
+                _, _, done, _ = env.step(action)
+            env.get_next_trial()
+
+
+def run_lockstep(num_simulations, num_trials, pipeline, ground_truth, rng):
+    env = VectorMouselabEnv(num_simulations, num_trials, pipeline, ground_truth)
+    env.attach_features(features.implemented, None)
+    while env.active.any():
+        env.step(random_actions(env.get_available_actions(), rng))
+
+
+if __name__ == "__main__":
+    exp_name = "v1.0"
+    num_trials = 35
+
+    pipeline = [structure.exp_pipelines[exp_name][0]] * num_trials
+    np.random.seed(0)
+    ground_truth = GenericMouselabEnv(num_trials, pipeline).ground_truth
+
+    for num_simulations in [30, 300]:
+        for name, run in [("sequential", run_sequential), ("lockstep", run_lockstep)]:
+            rng = np.random.default_rng(0)
+            start_time = time.perf_counter()
+            run(num_simulations, num_trials, pipeline, ground_truth, rng)
+            run_time = time.perf_counter() - start_time
+            print(
+                f"{name}: {num_simulations} simulations of {num_trials} trials "
+                f"in {run_time:.2f} s"
+            )
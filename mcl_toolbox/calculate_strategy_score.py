@@ -2,7 +2,8 @@ import sys
 from collections import defaultdict
 
 import numpy as np
-from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.env.ground_truth import iter_ground_truths
+from mcl_toolbox.env.modified_mouselab import TrialSequence
 from mcl_toolbox.utils.planning_strategies import strategy_dict
 from mcl_toolbox.global_vars import structure
 
@@ -65,19 +66,22 @@ for strategy in range(0, 89):
     scores = []
     gts = []
     number_of_clicks = []
-    for _ in range(num_simulations):
-        pipeline = exp_pipelines[exp_num]
-        env = GenericMouselabEnv(num_trials=1, pipeline=pipeline)
-        gts.append(tuple(env.ground_truth[0]))
-        clicks = strategy_dict[strategy + 1](
-            env.present_trial
-        )  # gets the click sequence
-        number_of_clicks.append(len(clicks))
-        score = (
-            env.present_trial.node_map[0].calculate_max_expected_return()
-            - (len(clicks) - 1) * click_cost
-        )  # len(clicks) is always 13
-        scores.append(score)
+    pipeline = exp_pipelines[exp_num]
+    # Only the ground truths are needed, so sample them in chunks instead of
+    # creating an environment per simulation
+    for ground_truths in iter_ground_truths(pipeline[0], num_simulations):
+        for ground_truth in ground_truths.tolist():
+            trial = TrialSequence(
+                num_trials=1, pipeline=pipeline, ground_truth=[ground_truth]
+            ).trial_sequence[0]
+            gts.append(tuple(ground_truth))
+            clicks = strategy_dict[strategy + 1](trial)  # gets the click sequence
+            number_of_clicks.append(len(clicks))
+            score = (
+                trial.node_map[0].calculate_max_expected_return()
+                - (len(clicks) - 1) * click_cost
+            )  # len(clicks) is always 13
+            scores.append(score)
 
     print("Score", np.mean(scores))
     print("Clicks", np.mean(number_of_clicks))
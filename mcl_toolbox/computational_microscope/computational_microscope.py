@@ -5,6 +5,7 @@ import numpy as np
 from hyperopt import fmin, hp, tpe
 from hyperopt.fmin import generate_trials_to_calculate
 from joblib import load
+from mcl_toolbox.env.array_mouselab import get_trial_class
 from mcl_toolbox.env.modified_mouselab import TrialSequence
 from mcl_toolbox.utils.learning_utils import (construct_repeated_pipeline,
                                               construct_reward_function,
@@ -29,8 +30,14 @@ class ComputationalMicroscope:
         strategy_weights,
         features,
         normalized_features=True,
+        trial_backend="node",
     ):
+        """
+        :param trial_backend: Trial implementation the strategies are applied
+                              on, "node" or "array" (see GenericMouselabEnv)
+        """
         self.pipeline = pipeline
+        self.trial_class = get_trial_class(trial_backend)
         self.strategy_space = strategy_space
         self.strategy_weights = strategy_weights
         self.num_strategies = len(self.strategy_space)
@@ -48,18 +55,20 @@ class ComputationalMicroscope:
         self.strategy_T = strategy_T
 
     def get_trial_log_likelihood(
-        self, trial, trial_features, click_sequence, strategy_index
+        self, trial, trial_features, click_sequence, strategy_index, reset=True
     ):
         weights = np.append(self.strategy_weights[strategy_index], 1 / self.strategy_T)
         log_likelihood = compute_trial_feature_log_likelihood(
-            trial, trial_features, click_sequence, weights, inv_t=True
+            trial, trial_features, click_sequence, weights, inv_t=True, reset=reset
         )
         return log_likelihood
 
     def compute_trials_likelihood(self, click_sequences, envs):
         num_trials = len(click_sequences)
         log_likelihoods = []
-        trials = TrialSequence(num_trials, self.pipeline, envs)
+        trials = TrialSequence(
+            num_trials, self.pipeline, envs, trial_class=self.trial_class
+        )
         for trial_num in range(num_trials):
             trial = trials.trial_sequence[trial_num]
             click_sequence = click_sequences[trial_num]
@@ -70,14 +79,18 @@ class ComputationalMicroscope:
                 self.features,
                 self.normalized_features,
             )
-            log_likelihoods.append(
-                [
+            # Every strategy replays the clicks from the unobserved trial
+            trial.reset_observations()
+            token = trial.snapshot()
+            strategy_log_likelihoods = []
+            for i in range(self.num_strategies):
+                strategy_log_likelihoods.append(
                     self.get_trial_log_likelihood(
-                        trial, trial_features, click_sequence, i
+                        trial, trial_features, click_sequence, i, reset=False
                     )
-                    for i in range(self.num_strategies)
-                ]
-            )
+                )
+                trial.restore(token)
+            log_likelihoods.append(strategy_log_likelihoods)
         return log_likelihoods
 
     def viterbi(self, T, L, prior=None):
@@ -1,14 +1,14 @@
 import sys
 
-from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.env.ground_truth import sample_pipeline_ground_truths
 from mcl_toolbox.utils.learning_utils import (create_dir, pickle_load,
                                               pickle_save)
 
 
 def gen_envs(pipeline):
-    num_simulations = len(pipeline)
-    env = GenericMouselabEnv(num_simulations, pipeline)
-    E = env.ground_truth
+    E = sample_pipeline_ground_truths(pipeline)
+    for gt in E:
+        gt[0] = 0.0
     return E
 
 
@@ -0,0 +1,396 @@
+from functools import wraps
+
+import numpy as np
+
+from mcl_toolbox.env.modified_mouselab import IndexedNodeSet, Node, Trial
+
+""" This file defines an array backed version of the trial representation in
+    modified_mouselab. Values, observation flags, depths, parents and the
+    path membership of every node are kept in flat NumPy arrays so that the
+    features can be computed without walking the Node object graph. The
+    Node objects are kept as thin views so that the planning strategies and
+    the learners can use the same API as before.
+"""
+
+
+def state_cached(func):
+    """Caches the result of a trial method until the observation state changes"""
+
+    @wraps(func)
+    def wrapper(self):
+        cache = self.state_cache
+        if func.__name__ not in cache:
+            cache[func.__name__] = func(self)
+        return cache[func.__name__]
+
+    return wrapper
+
+
+class ArrayTrial(Trial):
+    """Trial whose node state is stored in NumPy arrays indexed by node label.
+
+    Attributes:
+        values: ground truth value of each node
+        observed_mask: whether each node has been observed
+        depths: depth of each node (root is 0)
+        parents: parent label of each node (root is -1)
+        expected_values: expected value of each node (root is 0)
+        path_matrix: (num_paths x num_nodes) path membership matrix,
+                     path i corresponds to branch i + 1 in branch_map
+        path_nodes: (num_paths x max_depth + 1) labels on each path, root first
+    """
+
+    vectorized_features = True
+
+    def __init__(
+        self,
+        ground_truth,
+        structure_map,
+        max_depth=None,
+        reward_function=None,
+        template=None,
+    ):
+        super().__init__(
+            ground_truth,
+            structure_map,
+            max_depth=max_depth,
+            reward_function=reward_function,
+            template=template,
+        )
+        self.construct_arrays()
+
+    def new_node(self):
+        return ArrayNode(self)
+
+    def construct_trial(self, ground_truth, parent_map):
+        # The observation flags are read by the nodes while they are created
+        self.observed_mask = np.zeros(len(parent_map), dtype=bool)
+        self.state_cache = {}
+        super().construct_trial(ground_truth, parent_map)
+
+    def construct_arrays(self):
+        template = self.template
+        nodes = [self.node_map[node_num] for node_num in range(self.num_nodes)]
+        self.values = np.array([node.value for node in nodes], dtype=float)
+        self.expected_values = np.array(
+            [0.0] + [node.expected_value for node in nodes[1:]], dtype=float
+        )
+        # The topology is shared with the other trials of the same tree
+        self.depths = template.depths
+        self.parents = template.parents
+        self.is_leaf_mask = template.is_leaf_mask
+        self.path_nodes = template.path_nodes
+        self.path_matrix = template.path_matrix
+        self.node_paths = template.node_paths
+        self.successor_matrix = template.successor_matrix
+        self.ancestor_matrix = template.ancestor_matrix
+        self.children_matrix = template.children_matrix
+        self.sibling_matrix = template.sibling_matrix
+
+        self.variances = np.zeros(self.num_nodes)
+        self.uncertainties = np.zeros(self.num_nodes)
+        for node_num in range(1, self.num_nodes):
+            self.variances[node_num] = self.variance_by_depth[self.depths[node_num]]
+            self.uncertainties[node_num] = self.uncertainty_by_depth[
+                self.depths[node_num]
+            ]
+        self.max_dist_value = super().get_max_dist_value()
+
+    def set_observed(self, node_num, observed):
+        self.observed_mask[node_num] = observed
+        if observed:
+            self.observed_bits |= 1 << node_num
+        else:
+            self.observed_bits &= ~(1 << node_num)
+        self.state_cache.clear()
+
+    def reset_observations(self):
+        self.observed_mask[:] = False
+        self.observed_bits = 0
+        self.state_cache.clear()
+        self.compute_path_expected_values()
+        self.previous_observed = None
+        self.observed_nodes = IndexedNodeSet()
+        self.unobserved_nodes = IndexedNodeSet(self.node_map.values())
+
+    def get_max_dist_value(self):
+        return self.max_dist_value
+
+    def get_node_values(self):
+        """Values of the nodes as they are currently known (0 if unobserved)"""
+        return np.where(self.observed_mask, self.values, 0.0)
+
+    @state_cached
+    def get_path_expected_value_array(self):
+        """Expected value of each path, indexed by path number - 1.
+        The values are summed in path order, as in Trial.get_path_expected_value"""
+        node_values = np.where(self.observed_mask, self.values, self.expected_values)
+        path_values = node_values[self.path_nodes[:, 0]]
+        for depth in range(1, self.path_nodes.shape[1]):
+            path_values = path_values + node_values[self.path_nodes[:, depth]]
+        return path_values
+
+    def get_path_expected_values(self):
+        path_values = self.get_path_expected_value_array().tolist()
+        return {
+            path_num: path_value
+            for path_num, path_value in enumerate(path_values, start=1)
+        }
+
+    @state_cached
+    def get_largest_value_observed_array(self):
+        observed_values = np.where(self.observed_mask, self.values, -9999)
+        max_path_values = observed_values[self.path_nodes].max(axis=1)
+        max_path_values[max_path_values == -9999] = 0
+        return max_path_values
+
+    def largest_value_observed(self):
+        max_path_values = self.get_largest_value_observed_array().tolist()
+        return {
+            path_num: max_value
+            for path_num, max_value in enumerate(max_path_values, start=1)
+        }
+
+    def max_over_node_paths(self, path_values):
+        """Maximum of the given path values over the paths through each node"""
+        return np.where(self.path_matrix, path_values[:, None], -np.inf).max(axis=0)
+
+    def min_over_node_paths(self, path_values):
+        """Minimum of the given path values over the paths through each node"""
+        return np.where(self.path_matrix, path_values[:, None], np.inf).min(axis=0)
+
+    def count_observed(self, relation_matrix):
+        """Number of observed nodes in each row of the relation matrix"""
+        return np.count_nonzero(relation_matrix & self.observed_mask, axis=1)
+
+    def max_observed(self, relation_matrix):
+        """Largest observed value in each row of the relation matrix, 0 if none"""
+        related_values = np.where(
+            relation_matrix & self.observed_mask, self.values, -np.inf
+        ).max(axis=1)
+        related_values[np.isinf(related_values)] = 0
+        return related_values
+
+    @state_cached
+    def get_observed_successor_counts(self):
+        return self.count_observed(self.successor_matrix)
+
+    @state_cached
+    def get_observed_ancestor_counts(self):
+        return self.count_observed(self.ancestor_matrix)
+
+    @state_cached
+    def get_observed_children_counts(self):
+        return self.count_observed(self.children_matrix)
+
+    @state_cached
+    def get_observed_sibling_counts(self):
+        return self.count_observed(self.sibling_matrix)
+
+    @state_cached
+    def get_observed_depth_counts(self):
+        depth_counts = np.bincount(
+            self.depths[self.observed_mask], minlength=self.max_depth + 1
+        )
+        return depth_counts[self.depths]
+
+    @state_cached
+    def get_max_successor_values(self):
+        return self.max_observed(self.successor_matrix)
+
+    @state_cached
+    def get_max_children_values(self):
+        return self.max_observed(self.children_matrix)
+
+    @state_cached
+    def get_max_expected_return(self):
+        return self.get_path_expected_value_array().max()
+
+    @state_cached
+    def get_best_expected_values(self):
+        return self.max_over_node_paths(self.get_path_expected_value_array())
+
+    @state_cached
+    def get_best_largest_values(self):
+        return self.max_over_node_paths(self.get_largest_value_observed_array())
+
+    @state_cached
+    def get_most_promising_mask(self):
+        path_values = self.get_path_expected_value_array()
+        best_paths = path_values == path_values.max()
+        return self.path_matrix[best_paths].any(axis=0)
+
+    @state_cached
+    def get_second_promising_mask(self):
+        path_values = self.get_path_expected_value_array()
+        sorted_values = np.unique(path_values)
+        if len(sorted_values) < 2:
+            return np.zeros(self.num_nodes, dtype=bool)
+        second_paths = path_values == sorted_values[-2]
+        return self.path_matrix[second_paths].any(axis=0)
+
+    @state_cached
+    def get_branch_observed_counts(self):
+        path_counts = np.count_nonzero(self.path_matrix & self.observed_mask, axis=1)
+        return self.min_over_node_paths(path_counts)
+
+    @state_cached
+    def get_soft_pruning_values(self):
+        observed_values = np.where(self.observed_mask, self.values, np.inf)
+        node_losses = self.min_over_node_paths(
+            observed_values[self.path_nodes].min(axis=1)
+        )
+        node_losses[np.isinf(node_losses)] = 0
+        return node_losses
+
+    @state_cached
+    def get_max_path_uncertainties(self):
+        variances = np.where(self.observed_mask, 0, self.variances)[self.path_nodes]
+        total_uncertainty = variances[:, 0]
+        for depth in range(1, variances.shape[1]):
+            total_uncertainty = total_uncertainty + variances[:, depth]
+        return np.sqrt(self.max_over_node_paths(total_uncertainty))
+
+    def is_positive_observed(self):
+        if np.any(self.observed_mask & (self.values > 0)):
+            return -1
+        return 0
+
+    def termination_positive(self):
+        if np.any(self.observed_mask & (self.values > 0)):
+            return 0
+        return -1
+
+    def all_roots_observed(self):
+        if np.all(self.observed_mask[self.depths == 1]):
+            return -1
+        return 0
+
+    def termination_roots_observed(self):
+        if np.all(self.observed_mask[self.depths == 1]):
+            return 0
+        return -1
+
+    def all_leaf_nodes_observed(self):
+        if np.all(self.observed_mask[self.depths == self.max_depth]):
+            return -1
+        return 0
+
+    def termination_leaves_observed(self):
+        if np.all(self.observed_mask[self.depths == self.max_depth]):
+            return 0
+        return -1
+
+
+class ArrayNode(Node):
+    """Node view on an ArrayTrial. The observation flag is stored in the trial
+    arrays and the features are computed from the trial's relation matrices."""
+
+    __slots__ = ()
+
+    @property
+    def observed(self):
+        return self.trial.observed_mask[self.label]
+
+    @observed.setter
+    def observed(self, observed):
+        self.trial.set_observed(self.label, observed)
+
+    def _observed_values(self, relation_matrix):
+        trial = self.trial
+        mask = relation_matrix[self.label] & trial.observed_mask
+        return trial.values[mask]
+
+    def get_observed_ancestor_count(self):
+        return self.trial.get_observed_ancestor_counts()[self.label]
+
+    def get_observed_successor_count(self):
+        return self.trial.get_observed_successor_counts()[self.label]
+
+    def get_max_successor_value(self):
+        return self.trial.get_max_successor_values()[self.label]
+
+    def get_immediate_successor_count(self):
+        return self.trial.get_observed_children_counts()[self.label]
+
+    def get_max_immediate_successor(self):
+        return self.trial.get_max_children_values()[self.label]
+
+    def get_observed_siblings_count(self):
+        return self.trial.get_observed_sibling_counts()[self.label]
+
+    def get_observed_same_depth_count(self):
+        return self.trial.get_observed_depth_counts()[self.label]
+
+    def get_level_observed_std(self):
+        trial = self.trial
+        mask = (trial.depths == trial.depths[self.label]) & trial.observed_mask
+        if not mask.any():
+            return 0
+        return np.std(trial.values[mask])
+
+    def is_leaf_and_positive_ancestor(self):
+        if self.children:
+            return 0
+        if np.any(self._observed_values(self.trial.ancestor_matrix) > 0):
+            return 1
+        return 0
+
+    def is_successor_highest_leaf(self):
+        if not self.children:
+            return 0
+        max_value = self.trial.get_max_dist_value()
+        if np.any(self._observed_values(self.trial.successor_matrix) >= max_value):
+            return 1
+        return 0
+
+    def total_successor_uncertainty(self):
+        trial = self.trial
+        successors = trial.successor_matrix[self.label]
+        stds = np.where(trial.observed_mask[successors], 0, trial.uncertainties[successors])
+        # Summed one by one, as in Node.total_successor_uncertainty
+        return sum(stds.tolist())
+
+    def count_observed_node_branch(self):
+        return self.trial.get_branch_observed_counts()[self.label]
+
+    def soft_pruning(self):
+        return self.trial.get_soft_pruning_values()[self.label]
+
+    def max_path_uncertainty(self):
+        return self.trial.get_max_path_uncertainties()[self.label]
+
+    def calculate_best_expected_value(self):
+        return self.trial.get_best_expected_values()[self.label]
+
+    def calculate_max_expected_return(self):
+        return self.trial.get_max_expected_return()
+
+    def best_largest_value_observed(self):
+        return self.trial.get_best_largest_values()[self.label]
+
+    def soft_satisficing(self):
+        return -self.trial.get_max_expected_return()
+
+    def on_most_promising_path(self):
+        if self.trial.get_most_promising_mask()[self.label]:
+            return 1
+        return 0
+
+    def on_second_promising_path(self):
+        if self.trial.get_second_promising_mask()[self.label]:
+            return 1
+        return 0
+
+
+TRIAL_BACKENDS = {"node": Trial, "array": ArrayTrial}
+
+
+def get_trial_class(trial_backend):
+    """Trial implementation of a backend name ("node" or "array")"""
+    if trial_backend not in TRIAL_BACKENDS:
+        raise ValueError(
+            f"Unknown trial backend {trial_backend}, "
+            f"choose one of {list(TRIAL_BACKENDS.keys())}"
+        )
+    return TRIAL_BACKENDS[trial_backend]
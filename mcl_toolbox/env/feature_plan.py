@@ -0,0 +1,442 @@
+from collections import OrderedDict
+from operator import methodcaller
+
+import numpy as np
+
+from mcl_toolbox.utils.learning_utils import (
+    get_normalization_key,
+    get_normalization_vectors,
+    normalize_feature_values,
+)
+
+"""
+Computes the feature values of all the nodes of a trial at once.
+A FeaturePlan is compiled from a list of features and evaluates it on a trial,
+returning the (num_nodes x num_features) matrix that compute_current_features
+used to build node by node. On trials that keep their state in arrays
+(array_mouselab.ArrayTrial) every feature column is computed with NumPy
+operations over the tree arrays, other trials are evaluated node by node.
+The normalization of the feature values is applied to the whole matrix.
+The feature names are resolved to callables when the plan is compiled, so a
+plan built once per feature list does no string work when it is evaluated.
+get_cached_feature_plan keeps the plans compiled for each feature list and
+normalization.
+A plan can be given a FeatureCache, which keeps the feature matrices of the
+trial states it evaluated (see Trial.get_state_key) so that states revisited
+by other strategies, simulations or fits are not evaluated again.
+"""
+
+# Features that are evaluated for every node, including the root
+FEATURES_REGARDLESS_TERMINAL = [
+    "max_expected_return",
+    "constant",
+    "return_if_terminating",
+    "num_clicks",
+]
+
+# Features that depend on the clicks of the previous trials of the sequence
+SEQUENCE_FEATURES = ["click_count", "level_count", "branch_count", "trial_level_std"]
+
+
+def observed_height(trial):
+    observed_children = trial.children_matrix & trial.observed_mask
+    heights = np.zeros(trial.num_nodes, dtype=int)
+    for _ in range(trial.max_depth):
+        heights = np.where(observed_children, heights + 1, 0).max(axis=1)
+    return heights
+
+
+def previous_successor(trial):
+    previous_node = trial.previous_observed
+    if not previous_node:
+        return np.zeros(trial.num_nodes, dtype=int)
+    return trial.successor_matrix[:, previous_node.label]
+
+
+def previous_successor_negative(trial):
+    previous_node = trial.previous_observed
+    if not previous_node or not previous_node.value < 0:
+        return np.zeros(trial.num_nodes, dtype=int)
+    return trial.successor_matrix[:, previous_node.label]
+
+
+def successor_highest(trial):
+    highest = trial.observed_mask & (trial.values >= trial.get_max_dist_value())
+    return ~trial.is_leaf_mask & (trial.successor_matrix & highest).any(axis=1)
+
+
+def leaf_positive_ancestor(trial):
+    positive = trial.observed_mask & (trial.values > 0)
+    return trial.is_leaf_mask & (trial.ancestor_matrix & positive).any(axis=1)
+
+
+def parent_value(trial):
+    parents = trial.parents
+    return np.where(
+        trial.observed_mask[parents],
+        trial.values[parents],
+        trial.expected_values[parents],
+    )
+
+
+def successor_uncertainty(trial):
+    # Summed in the order of Node.get_successor_nodes (ascending labels)
+    uncertainties = np.where(trial.observed_mask, 0, trial.uncertainties)
+    total_uncertainty = np.zeros(trial.num_nodes)
+    for node_num in range(1, trial.num_nodes):
+        total_uncertainty = total_uncertainty + np.where(
+            trial.successor_matrix[:, node_num], uncertainties[node_num], 0
+        )
+    return total_uncertainty
+
+
+def level_observed_std(trial):
+    level_stds = np.zeros(trial.max_depth + 1)
+    for depth in range(1, trial.max_depth + 1):
+        level_values = trial.values[trial.observed_mask & (trial.depths == depth)]
+        if len(level_values) != 0:
+            level_stds[depth] = np.std(level_values.tolist())
+    return level_stds[trial.depths]
+
+
+def get_click_counts(trial):
+    return trial.sequence.node_click_count[: trial.num_nodes]
+
+
+def level_count(trial):
+    click_counts = get_click_counts(trial)
+    level_counts = np.zeros(trial.max_depth + 1, dtype=int)
+    np.add.at(level_counts, trial.depths, click_counts)
+    return level_counts[trial.depths]
+
+
+def branch_count(trial):
+    path_counts = get_click_counts(trial)[trial.path_nodes].sum(axis=1)
+    return trial.max_over_node_paths(path_counts)
+
+
+def trial_level_std(trial):
+    return trial.sequence.get_level_stds()[trial.depths]
+
+
+# Vectorized versions of the node features in Node.feature_registry. Each
+# function returns the values of the feature for all the nodes of an
+# array backed trial, the root entry is ignored.
+COLUMN_FUNCTIONS = {
+    "siblings_count": lambda trial: trial.get_observed_sibling_counts(),
+    "depth_count": lambda trial: trial.get_observed_depth_counts(),
+    "ancestor_count": lambda trial: trial.get_observed_ancestor_counts(),
+    "successor_count": lambda trial: trial.get_observed_successor_counts(),
+    "sq_successor_count": lambda trial: trial.get_observed_successor_counts() ** 2,
+    "is_leaf": lambda trial: trial.is_leaf_mask,
+    "depth": lambda trial: trial.depths,
+    "max_successor": lambda trial: trial.get_max_successor_values(),
+    "parent_value": parent_value,
+    "max_immediate_successor": lambda trial: trial.get_max_children_values(),
+    "immediate_successor_count": lambda trial: trial.get_observed_children_counts(),
+    "previous_observed_successor": previous_successor,
+    "is_successor_highest": successor_highest,
+    "parent_observed": lambda trial: trial.observed_mask[trial.parents],
+    "observed_height": observed_height,
+    "is_pos_ancestor_leaf": leaf_positive_ancestor,
+    "is_root": lambda trial: trial.parents == 0,
+    "is_previous_successor_negative": previous_successor_negative,
+    "uncertainty": lambda trial: trial.uncertainties,
+    "best_expected": lambda trial: trial.get_best_expected_values(),
+    "best_largest": lambda trial: trial.get_best_largest_values(),
+    "max_uncertainty": lambda trial: trial.get_max_path_uncertainties(),
+    "most_promising": lambda trial: trial.get_most_promising_mask(),
+    "second_most_promising": lambda trial: trial.get_second_promising_mask(),
+    "click_count": get_click_counts,
+    "level_count": level_count,
+    "branch_count": branch_count,
+    "soft_pruning": lambda trial: trial.get_soft_pruning_values(),
+    "count_observed_node_branch": lambda trial: trial.get_branch_observed_counts(),
+    "get_level_observed_std": level_observed_std,
+    "successor_uncertainty": successor_uncertainty,
+    "num_clicks_adaptive": lambda trial: 0,
+    "num_clicks": lambda trial: trial.get_num_clicks(),
+    "max_expected_return": lambda trial: trial.get_max_expected_return(),
+    "trial_level_std": trial_level_std,
+    "soft_satisficing": lambda trial: -trial.get_max_expected_return(),
+    "constant": lambda trial: 1,
+    "planning": lambda trial: 1,
+    "termination_constant": lambda trial: 1,
+    "value": lambda trial: np.where(trial.observed_mask, trial.values, 0),
+    "is_observed": lambda trial: trial.observed_mask,
+    # Node.max_expected_if_terminal is 0 for the non-root nodes
+    "return_if_terminating": lambda trial: 0,
+}
+
+
+def hard_pruning_column(threshold):
+    def hard_pruning(trial):
+        return np.where(trial.get_soft_pruning_values() <= threshold, -1, 0)
+
+    return hard_pruning
+
+
+def constant_column(value):
+    def constant(trial):
+        return value
+
+    return constant
+
+
+def hard_satisficing_value(threshold):
+    def hard_satisficing(node):
+        return node.trial.hard_satisficing(threshold)
+
+    return hard_satisficing
+
+
+def missing_feature(feature):
+    def missing(node):
+        raise KeyError(feature)
+
+    return missing
+
+
+class FeatureCache:
+    """
+    Bounded LRU cache of feature matrices, keyed by the FeaturePlan and the
+    state key of the trial. A cache can be shared between plans.
+    """
+
+    def __init__(self, maxsize=100000):
+        """
+        :param maxsize: maximum number of feature matrices kept
+        """
+        if maxsize < 1:
+            raise ValueError("The size of the cache must be positive")
+        self.maxsize = maxsize
+        self.matrices = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def get(self, key):
+        """Copy of the feature matrix of the key, None if it isn't cached"""
+        feature_values = self.matrices.get(key)
+        if feature_values is None:
+            self.misses += 1
+            return None
+        self.matrices.move_to_end(key)
+        self.hits += 1
+        return feature_values.copy()
+
+    def put(self, key, feature_values):
+        self.matrices[key] = feature_values.copy()
+        self.matrices.move_to_end(key)
+        while len(self.matrices) > self.maxsize:
+            self.matrices.popitem(last=False)
+
+    def clear(self):
+        self.matrices.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.matrices),
+            "maxsize": self.maxsize,
+        }
+
+
+class FeaturePlan:
+    """
+    Feature list compiled for the evaluation of all the nodes of a trial.
+    The values are identical to the ones of Node.compute_termination_feature_values,
+    normalized as in learning_utils.get_normalized_feature_values.
+    """
+
+    def __init__(self, features, normalized_features=None, cache=None):
+        """
+        :param features: list of feature names
+        :param normalized_features: (max, min) feature values used for normalization
+        :param cache: FeatureCache of the feature matrices of the evaluated trials
+        """
+        self.features = list(features)
+        self.normalized_features = normalized_features
+        self.num_features = len(self.features)
+        self.cache = cache
+        self.sequence_dependent = any(
+            feature in SEQUENCE_FEATURES for feature in self.features
+        )
+        self.compile_normalization()
+        self.column_functions = None
+        self.node_functions = {}
+
+    def __getstate__(self):
+        # The compiled functions are closures, they are compiled again when needed
+        state = self.__dict__.copy()
+        state["column_functions"] = None
+        state["node_functions"] = {}
+        # The cache keys hold the trees and reward functions of the trials
+        if self.cache is not None:
+            state["cache"] = FeatureCache(self.cache.maxsize)
+        return state
+
+    def compile_normalization(self):
+        if not self.normalized_features:
+            self.normalization_vectors = None
+            return
+        self.normalization_vectors = get_normalization_vectors(
+            self.features, self.normalized_features
+        )
+
+    def compile_columns(self, node_class):
+        """Functions that compute the feature columns of the non-root nodes"""
+        termination_features = node_class.termination_registry
+        self.column_functions = []
+        for feature in self.features:
+            if feature[:2] == "hp":
+                column_function = hard_pruning_column(float(feature[3:]))
+            elif feature[:2] == "hs":
+                column_function = constant_column(-1)
+            elif (
+                feature in termination_features
+                and feature != "soft_satisficing"
+                and feature not in FEATURES_REGARDLESS_TERMINAL
+            ):
+                column_function = constant_column(-1)
+            else:
+                column_function = COLUMN_FUNCTIONS[feature]
+            self.column_functions.append(column_function)
+
+    def compile_nodes(self, node_class):
+        """Functions that compute the features of the root and of the other
+        nodes, resolved as in Node.compute_termination_feature_values"""
+        feature_registry = node_class.feature_registry
+        termination_registry = node_class.termination_registry
+        root_functions = []
+        node_functions = []
+        for feature in self.features:
+            if feature[:2] == "hp":
+                root_function = constant_column(0)
+                node_function = methodcaller("hard_pruning", float(feature[3:]))
+            elif feature[:2] == "hs":
+                root_function = hard_satisficing_value(float(feature[3:]))
+                node_function = constant_column(-1)
+            elif feature == "num_clicks_adaptive":
+                root_function = node_function = constant_column(0)
+            elif feature == "soft_satisficing":
+                root_function = constant_column(0)
+                node_function = feature_registry[feature]
+            elif feature in FEATURES_REGARDLESS_TERMINAL:
+                root_function = node_function = feature_registry[feature]
+            elif feature in termination_registry:
+                root_function = termination_registry[feature]
+                node_function = constant_column(-1)
+            else:
+                root_function = constant_column(0)
+                node_function = feature_registry.get(feature, missing_feature(feature))
+            root_functions.append(root_function)
+            node_functions.append(node_function)
+        return root_functions, node_functions
+
+    def compute_node_values(self, node, feature_indices=None):
+        """Feature values of a node before normalization, the same as
+        node.compute_termination_feature_values(features), optionally only
+        of the features with the given indices"""
+        node_class = type(node)
+        if node_class not in self.node_functions:
+            self.node_functions[node_class] = self.compile_nodes(node_class)
+        root_functions, node_functions = self.node_functions[node_class]
+        functions = root_functions if node.label == 0 else node_functions
+        if feature_indices is not None:
+            functions = [functions[index] for index in feature_indices]
+        return [function(node) for function in functions]
+
+    def normalize(self, feature_values, feature_indices=None):
+        """Normalizes the values of the features (in place), optionally only
+        of the features with the given indices"""
+        if self.normalization_vectors is None:
+            return feature_values
+        normalization_vectors = self.normalization_vectors
+        if feature_indices is not None:
+            normalization_vectors = [
+                vector[feature_indices] for vector in normalization_vectors
+            ]
+        return normalize_feature_values(feature_values, normalization_vectors)
+
+    def evaluate_node(self, node, feature_indices=None):
+        """Feature values of a single node, optionally only of the features
+        with the given indices"""
+        feature_values = np.array(
+            self.compute_node_values(node, feature_indices), dtype=float
+        )
+        return self.normalize(feature_values, feature_indices)
+
+    def get_cache_key(self, trial):
+        return self, trial.get_state_key(self.sequence_dependent)
+
+    def evaluate(self, trial):
+        """Feature values of all the nodes of the trial (num_nodes x num_features)"""
+        if self.cache is None:
+            return self.compute_feature_values(trial)
+        key = self.get_cache_key(trial)
+        feature_values = self.cache.get(key)
+        if feature_values is None:
+            feature_values = self.compute_feature_values(trial)
+            self.cache.put(key, feature_values)
+        return feature_values
+
+    def compute_feature_values(self, trial):
+        """Feature values of all the nodes of the trial, without the cache"""
+        num_nodes = trial.num_nodes
+        feature_values = np.zeros((num_nodes, self.num_features))
+        node_map = trial.node_map
+        if trial.vectorized_features:
+            if self.column_functions is None:
+                self.compile_columns(type(trial.root))
+            for index, column_function in enumerate(self.column_functions):
+                column = column_function(trial)
+                if isinstance(column, np.ndarray) and column.ndim:
+                    column = column[1:]
+                feature_values[1:, index] = column
+            feature_values[0] = self.compute_node_values(node_map[0])
+        else:
+            for node_num in range(num_nodes):
+                feature_values[node_num] = self.compute_node_values(node_map[node_num])
+        return self.normalize(feature_values)
+
+    def evaluate_nodes(self, trial, nodes):
+        """Feature values of the given nodes of the trial"""
+        if trial.vectorized_features or self.cache is not None:
+            labels = [node.label for node in nodes]
+            return self.evaluate(trial)[labels]
+        feature_values = np.zeros((len(nodes), self.num_features))
+        for i, node in enumerate(nodes):
+            feature_values[i] = self.compute_node_values(node)
+        return self.normalize(feature_values)
+
+
+# FeaturePlans compiled so far, see get_cached_feature_plan
+feature_plans = OrderedDict()
+feature_plans_size = 256
+
+
+def get_cached_feature_plan(features, normalized_features=None):
+    """
+    FeaturePlan of a feature list and normalization, compiled once and then
+    reused, or the features if they already are a FeaturePlan
+    :param features: list of feature names or a FeaturePlan
+    :param normalized_features: (max, min) feature values used for normalization
+    """
+    if isinstance(features, FeaturePlan):
+        return features
+    key = (tuple(features), get_normalization_key(features, normalized_features))
+    feature_plan = feature_plans.get(key)
+    if feature_plan is not None:
+        feature_plans.move_to_end(key)
+        return feature_plan
+    feature_plan = FeaturePlan(features, normalized_features)
+    feature_plans[key] = feature_plan
+    while len(feature_plans) > feature_plans_size:
+        feature_plans.popitem(last=False)
+    return feature_plan
@@ -0,0 +1,229 @@
+import numpy as np
+
+from mcl_toolbox.env.feature_plan import get_cached_feature_plan
+from mcl_toolbox.utils.learning_utils import get_normalized_feature_values
+
+"""
+Incremental computation of the feature state (num_nodes x num_features) of a trial.
+Observing a node only changes the features of the nodes related to it, so after
+a click only the affected entries of the previous feature state are recomputed.
+Trials with vectorized features (see feature_plan) are evaluated as a whole.
+"""
+
+# Which observations a feature of a (non-root) node depends on:
+#   static - no observation, the value is fixed for the trial
+#   self - the node itself
+#   ancestors - the ancestors of the node
+#   successors - the successors of the node
+#   siblings - the siblings of the node
+#   level - the nodes at the same depth
+#   branch - the nodes on the paths through the node
+#   previous - the previously observed node
+#   global - any node
+# The root row is always recomputed. Features that are not listed are
+# treated as global.
+FEATURE_SCOPES = {
+    "is_leaf": "static",
+    "depth": "static",
+    "is_root": "static",
+    "uncertainty": "static",
+    "constant": "static",
+    "planning": "static",
+    "termination_constant": "static",
+    "num_clicks_adaptive": "static",
+    "is_observed": "self",
+    "value": "self",
+    "click_count": "self",
+    "parent_observed": "ancestors",
+    "parent_value": "ancestors",
+    "ancestor_count": "ancestors",
+    "is_pos_ancestor_leaf": "ancestors",
+    "successor_count": "successors",
+    "sq_successor_count": "successors",
+    "max_successor": "successors",
+    "immediate_successor_count": "successors",
+    "max_immediate_successor": "successors",
+    "is_successor_highest": "successors",
+    "observed_height": "successors",
+    "successor_uncertainty": "successors",
+    "siblings_count": "siblings",
+    "depth_count": "level",
+    "get_level_observed_std": "level",
+    "level_count": "level",
+    "trial_level_std": "level",
+    "count_observed_node_branch": "branch",
+    "soft_pruning": "branch",
+    "max_uncertainty": "branch",
+    "best_expected": "branch",
+    "best_largest": "branch",
+    "branch_count": "branch",
+    "previous_observed_successor": "previous",
+    "is_previous_successor_negative": "previous",
+}
+
+
+def get_feature_scope(feature, termination_features):
+    if feature[:2] == "hp":
+        return "branch"
+    if feature[:2] == "hs" or feature in termination_features:
+        # Only evaluated at the root, the other nodes get a constant
+        if feature not in ["max_expected_return", "constant", "soft_satisficing"]:
+            return "static"
+    return FEATURE_SCOPES.get(feature, "global")
+
+
+def get_scope_nodes(trial):
+    """For every node, the nodes whose features of a given scope change
+    when that node is observed"""
+    node_map = trial.node_map
+    num_nodes = len(node_map)
+    successors = {
+        label: {node.label for node in node_map[label].get_successor_nodes()}
+        for label in range(num_nodes)
+    }
+    ancestors = {label: set() for label in range(num_nodes)}
+    for label, successor_labels in successors.items():
+        for successor in successor_labels:
+            ancestors[successor].add(label)
+    scope_nodes = {}
+    for label in range(1, num_nodes):
+        node = node_map[label]
+        level = trial.node_level_map[label]
+        scope_nodes[label] = {
+            "self": {label},
+            "ancestors": successors[label],
+            "successors": ancestors[label],
+            "siblings": {sibling.label for sibling in node.get_sibling_nodes()},
+            "level": {same_level.label for same_level in trial.level_map[level]},
+            "branch": ancestors[label] | successors[label] | {label},
+            "previous": ancestors[label],
+        }
+    return scope_nodes
+
+
+def compute_reference_features(trial, features, normalized_features):
+    """Feature state computed node by node, used to check the feature state"""
+    feature_values = np.zeros((trial.num_nodes, len(features)))
+    for node_num in range(trial.num_nodes):
+        node = trial.node_map[node_num]
+        feature_values[node_num] = node.compute_termination_feature_values(features)
+    return get_normalized_feature_values(feature_values, features, normalized_features)
+
+
+class IncrementalFeatureState:
+    """
+    Keeps the feature state of the present trial of an environment up to date.
+    The feature values are identical to the ones of compute_reference_features.
+    """
+
+    def __init__(self, features, normalized_features, check=False, feature_plan=None):
+        """
+        :param features: list of feature names
+        :param normalized_features: (max, min) feature values used for normalization
+        :param check: compare every incremental update with a full recomputation
+        :param feature_plan: FeaturePlan compiled from the features, if already available
+        """
+        self.features = features
+        self.normalized_features = normalized_features
+        if feature_plan is None:
+            feature_plan = get_cached_feature_plan(features, normalized_features)
+        self.feature_plan = feature_plan
+        self.check = check
+        self.trial = None
+        self.feature_state = None
+        self.scope_nodes_cache = {}
+        self.scope_features = None
+
+    def construct_scope_features(self, trial):
+        termination_features = trial.root.termination_registry
+        self.scope_features = {}
+        for index, feature in enumerate(self.features):
+            scope = get_feature_scope(feature, termination_features)
+            self.scope_features.setdefault(scope, []).append(index)
+
+    def get_scope_nodes(self, trial):
+        key = tuple(
+            trial.node_map[label].parent.label if label != 0 else -1
+            for label in range(len(trial.node_map))
+        )
+        if key not in self.scope_nodes_cache:
+            self.scope_nodes_cache[key] = get_scope_nodes(trial)
+        return self.scope_nodes_cache[key]
+
+    def compute(self, trial):
+        """Computes the feature state of all the nodes of the trial"""
+        if self.scope_features is None:
+            self.construct_scope_features(trial)
+        self.trial = trial
+        self.scope_nodes = self.get_scope_nodes(trial)
+        self.previous_observed = trial.previous_observed
+        self.num_observed = len(trial.observed_nodes)
+        self.feature_state = self.feature_plan.evaluate(trial)
+        if self.check:
+            self.check_feature_state()
+        return self.feature_state
+
+    def get_dirty_features(self, node_num):
+        """Maps the node numbers to the indices of the features that
+        change when node_num is observed"""
+        num_nodes = len(self.trial.node_map)
+        dirty_features = {0: list(range(len(self.features)))}
+        for scope, feature_indices in self.scope_features.items():
+            if scope == "static":
+                continue
+            if scope == "global":
+                nodes = range(1, num_nodes)
+            else:
+                nodes = self.scope_nodes[node_num][scope]
+                if scope == "previous" and self.previous_observed is not None:
+                    previous_num = self.previous_observed.label
+                    nodes = nodes | self.scope_nodes[previous_num][scope]
+            for node in nodes:
+                if node != 0:
+                    dirty_features.setdefault(node, []).extend(feature_indices)
+        return dirty_features
+
+    def update(self, trial, node_num):
+        """Updates the feature state after node_num has been observed in the trial"""
+        if (
+            trial is not self.trial
+            or node_num == 0
+            or len(trial.observed_nodes) != self.num_observed + 1
+            or trial.previous_observed is not trial.node_map[node_num]
+            or trial.vectorized_features
+        ):
+            return self.compute(trial)
+        cache = self.feature_plan.cache
+        feature_state = None
+        if cache is not None:
+            key = self.feature_plan.get_cache_key(trial)
+            feature_state = cache.get(key)
+        if feature_state is None:
+            feature_state = self.feature_state.copy()
+            for node, feature_indices in self.get_dirty_features(node_num).items():
+                feature_indices = sorted(feature_indices)
+                feature_state[node, feature_indices] = self.feature_plan.evaluate_node(
+                    trial.node_map[node], feature_indices
+                )
+            if cache is not None:
+                cache.put(key, feature_state)
+        self.feature_state = feature_state
+        self.previous_observed = trial.previous_observed
+        self.num_observed += 1
+        if self.check:
+            self.check_feature_state()
+        return self.feature_state
+
+    def check_feature_state(self):
+        full_feature_state = compute_reference_features(
+            self.trial, self.features, self.normalized_features
+        )
+        if full_feature_state.tobytes() != self.feature_state.tobytes():
+            mismatches = np.argwhere(full_feature_state != self.feature_state)
+            mismatched_features = sorted(
+                {self.features[feature] for _, feature in mismatches}
+            )
+            raise RuntimeError(
+                f"Feature state differs from the node by node computation "
+                f"for the features {mismatched_features}"
+            )
@@ -1,11 +1,28 @@
+from functools import partial
+
 import gym
 import numpy as np
 from gym import spaces
 
-from mcl_toolbox.env.modified_mouselab import TrialSequence, reward_val
+from mcl_toolbox.env.array_mouselab import TRIAL_BACKENDS, get_trial_class
+from mcl_toolbox.env.feature_plan import get_cached_feature_plan
+from mcl_toolbox.env.feature_state import IncrementalFeatureState
+from mcl_toolbox.env.modified_mouselab import (
+    TrialSequence,
+    get_termination_mers,
+    reward_val,
+)
+from mcl_toolbox.env.mouselab import (
+    get_click_cost,
+    get_click_reward,
+    get_cost_weights,
+)
 from mcl_toolbox.utils.distributions import Categorical
 from mcl_toolbox.utils.env_utils import get_num_actions
-from mcl_toolbox.utils.sequence_utils import compute_current_features
+from mcl_toolbox.utils.q_table import PipelineQFunction, QTable
+
+
+RESET_MODES = ["reuse", "rebuild", "resample"]
 
 
 class GenericMouselabEnv(gym.Env):
@@ -24,24 +41,55 @@ class GenericMouselabEnv(gym.Env):
         render_path="mouselab_renders",
         feedback="none",
         q_fn=None,
+        trial_backend="node",
+        check_feature_state=False,
+        reset_mode="reuse",
     ):
+        """
+        :param trial_backend: "node" represents each trial as a graph of Node objects,
+                              "array" stores the node state in NumPy arrays
+                              (see array_mouselab.ArrayTrial)
+        :param check_feature_state: compare the incrementally updated feature state
+                                    with a full recomputation after every step
+        :param reset_mode: what reset does with the trials.
+                           "reuse" clears the observations of the existing trials,
+                           "rebuild" constructs new trials with the same ground truth,
+                           "resample" constructs new trials with a new ground truth
+        :param q_fn: Q function of the metacognitive feedback, a q dictionary,
+                     a q_table.QTable, a q_table.PipelineQFunction or "lazy" to
+                     compute the Q values of the visited states on demand
+        """
         super(GenericMouselabEnv, self).__init__()
         self.pipeline = pipeline
         self.ground_truth = ground_truth
         self.num_trials = num_trials
         self.render_path = render_path
+        # Reward of a click at a depth, a partial so that the env can be pickled
+        cost_weight, depth_weight = get_cost_weights(cost)
+        self.cost = partial(
+            get_click_reward, cost_weight=cost_weight, depth_weight=depth_weight
+        )
         if isinstance(cost, list):
-            cost_weight, depth_weight = cost
-            self.cost = lambda depth: -(1 * cost_weight + depth * depth_weight)
             self.repeat_cost = -float("inf")
         else:  # should be a scalar
-            self.cost = lambda depth: -(1 * cost)
             self.repeat_cost = -cost * 10
         self.feedback = feedback
+        if isinstance(q_fn, str) and q_fn == "lazy":
+            # The Q values are solved with the click costs of the env
+            q_fn = PipelineQFunction(cost=get_click_cost(cost))
         self.q_fn = q_fn
+        get_trial_class(trial_backend)
+        self.trial_backend = trial_backend
+        if reset_mode not in RESET_MODES:
+            raise ValueError(
+                f"Unknown reset mode {reset_mode}, choose one of {RESET_MODES}"
+            )
+        self.reset_mode = reset_mode
+        self.check_feature_state = check_feature_state
         self.feature_state = None
         self.features = None
         self.normalized_features = None
+        self.incremental_feature_state = None
         if self.feedback == "meta" and self.q_fn is None:
             raise ValueError("Q-function is required to compute metacognitive feedback")
         self.construct_env()
@@ -58,8 +106,14 @@ class GenericMouselabEnv(gym.Env):
         self.construct_env()
 
     def construct_env(self):
+        # Observed nodes (as a bitmask) and max expected return at the
+        # termination of each trial
+        self.termination_records = {}
         self.trial_sequence = TrialSequence(
-            self.num_trials, self.pipeline, self.ground_truth
+            self.num_trials,
+            self.pipeline,
+            self.ground_truth,
+            trial_class=TRIAL_BACKENDS[self.trial_backend],
         )
         self.present_trial_num = 0
         self.trial_init()
@@ -81,7 +135,7 @@ class GenericMouselabEnv(gym.Env):
         self._compute_expected_values()
         self._construct_state()
         self.observed_action_list = []
-        self.num_actions = len(self.get_available_actions())
+        self.num_actions = len(self.get_available_action_array())
 
     def _construct_state(self):
         self._state = [0] + [
@@ -116,11 +170,32 @@ class GenericMouselabEnv(gym.Env):
             self.feature_state = self.construct_feature_state()
 
     def reset(self):
-        self.construct_env()
+        if self.reset_mode == "resample":
+            self.ground_truth = None
+            self.construct_env()
+        elif self.reset_mode == "reuse" and self.can_reuse_trials():
+            self.trial_sequence.reset_observations()
+            self.termination_records = {}
+            self.present_trial_num = 0
+            self.trial_init()
+        else:
+            self.construct_env()
         if self.features is not None:
             self.feature_state = self.construct_feature_state()
         return self._state
 
+    def can_reuse_trials(self):
+        """Whether the trials still match the ground truth and the pipeline"""
+        trial_sequence = self.trial_sequence
+        return (
+            trial_sequence.ground_truth is self.ground_truth
+            and trial_sequence.pipeline is self.pipeline
+            and trial_sequence.num_trials == self.num_trials
+            and isinstance(
+                trial_sequence.trial_sequence[0], TRIAL_BACKENDS[self.trial_backend]
+            )
+        )
+
     def step(self, action):
         info = {}
         reward = self.cost(self.present_trial.node_map[action].depth)
@@ -133,6 +208,10 @@ class GenericMouselabEnv(gym.Env):
             self.present_trial.node_map[action].observe()
         else:
             done = True
+            self.termination_records[self.present_trial_num] = (
+                self.present_trial.observed_bits,
+                self.present_trial.get_path_value_summary()[0],
+            )
             best_expected_path = self.present_trial.get_best_expected_path()
             info = best_expected_path[1:]
             reward = 0
@@ -141,7 +220,9 @@ class GenericMouselabEnv(gym.Env):
                 # self.present_trial.node_map[node].observe()
         self._state[action] = node_map[action].value
         if self.features is not None:
-            self.feature_state = self.construct_feature_state()
+            self.feature_state = self.incremental_feature_state.update(
+                self.present_trial, action
+            )
         return self._state, reward, done, info
 
     def render(self, dir_path=None):
@@ -155,31 +236,78 @@ class GenericMouselabEnv(gym.Env):
         return self.ground_truth
 
     def get_available_actions(self):
-        nodes = [n.label for n in self.present_trial.unobserved_nodes]
-        return nodes
+        """List of the unobserved nodes of the present trial (the root, 0, is
+        the termination action), the caller may modify it"""
+        return self.present_trial.unobserved_nodes.get_labels().tolist()
+
+    def get_available_action_array(self):
+        """Read-only array of the available actions, cached until the next click"""
+        return self.present_trial.unobserved_nodes.get_labels()
 
     def get_best_paths(self):
-        trial = self.present_trial
-        expected_path_values = trial.get_path_expected_values()
-        best_paths = [
-            k
-            for k, v in expected_path_values.items()
-            if v == max(expected_path_values.values())
-        ]
+        best_paths = self.present_trial.get_path_value_summary()[2]
         return set(best_paths)
 
+    def get_termination_mers(self, trial_actions):
+        """
+        Max expected return at the termination of each trial since the last
+        reset. The values recorded when the trials terminated are used if the
+        clicks match, the others are computed from the clicks.
+
+        Args:
+            trial_actions: clicks of each trial, ending with the termination action
+        """
+        mers = [None] * len(trial_actions)
+        for trial_num, actions in enumerate(trial_actions):
+            if trial_num not in self.termination_records:
+                continue
+            observed_bits, mer = self.termination_records[trial_num]
+            click_bits = sum(1 << action for action in set(actions[:-1]))
+            # Observing the root does not change the max expected return
+            if (observed_bits | 1) == (click_bits | 1):
+                mers[trial_num] = mer
+        missing_trials = [trial_num for trial_num, mer in enumerate(mers) if mer is None]
+        if missing_trials:
+            missing_mers = get_termination_mers(
+                [self.ground_truth[trial_num] for trial_num in missing_trials],
+                [trial_actions[trial_num] for trial_num in missing_trials],
+                [self.pipeline[trial_num] for trial_num in missing_trials],
+            )
+            for trial_num, mer in zip(missing_trials, missing_mers):
+                mers[trial_num] = mer
+        return mers
+
     def get_action_feedback(self, taken_path):
         delay = self.present_trial.get_action_feedback(taken_path)
         return delay
 
     def get_metacognitive_feedback(self, action):
+        if isinstance(self.q_fn, QTable):
+            # One row of Q values per state, indexed by the env actions
+            q_values = self.q_fn.get_q_values(
+                self.q_fn.encode_trial(
+                    self.present_trial.ground_truth, self.present_trial.observed_bits
+                )
+            )
+            qs = q_values[
+                [self.env_action(a) for a in self.get_available_actions()]
+            ]
+            if np.isnan(qs).any():
+                raise KeyError("The Q table doesn't contain an available action")
+            mcfb_delay = 2 + float(qs.max() - q_values[self.env_action(action)])
+            if mcfb_delay == 2:
+                mcfb_delay = 0
+            return mcfb_delay
+        q_fn = self.q_fn
+        if isinstance(q_fn, PipelineQFunction):
+            q_fn = q_fn.get_q_fn(self.pipeline[self.present_trial_num])
         present_state = self.get_state()
         available_actions = self.get_available_actions()
         qs = []
         for a in available_actions:
-            qs.append(self.q_fn[(present_state, self.env_action(a))])
+            qs.append(q_fn[(present_state, self.env_action(a))])
         max_q = max(qs)
-        mcfb_delay = 2 + max_q - self.q_fn[(present_state, self.env_action(action))]
+        mcfb_delay = 2 + max_q - q_fn[(present_state, self.env_action(action))]
         if mcfb_delay == 2:
             mcfb_delay = 0
         return mcfb_delay
@@ -209,9 +337,7 @@ class GenericMouselabEnv(gym.Env):
         return tuple(state)
 
     def construct_feature_state(self):
-        self.feature_state = compute_current_features(
-            self.present_trial, self.features, self.normalized_features
-        )
+        self.feature_state = self.incremental_feature_state.compute(self.present_trial)
         return self.feature_state
 
     def get_feature_state(self):
@@ -224,7 +350,7 @@ class GenericMouselabEnv(gym.Env):
         return self.feature_state
 
     def env_action(self, a):
-        branching = self.pipeline[0][0]
+        branching = self.pipeline[self.present_trial_num][0]
         num_nodes = get_num_actions(branching)
         if a == 0:
             return num_nodes
@@ -238,9 +364,22 @@ class GenericMouselabEnv(gym.Env):
         return term_reward
 
     # How would you run say transfer task easily?
-    def attach_features(self, features, normalized_features):
-        self.features = features
-        self.normalized_features = normalized_features
+    def attach_features(self, features, normalized_features=None):
+        """
+        Args:
+            features: list of feature names or a compiled FeaturePlan, in which
+                case the normalization of the plan is used
+            normalized_features: (max, min) feature values used for normalization
+        """
+        feature_plan = get_cached_feature_plan(features, normalized_features)
+        self.features = feature_plan.features
+        self.normalized_features = feature_plan.normalized_features
+        self.incremental_feature_state = IncrementalFeatureState(
+            self.features,
+            self.normalized_features,
+            check=self.check_feature_state,
+            feature_plan=feature_plan,
+        )
 
 
 class ModStateGenericMouselabEnv(GenericMouselabEnv):
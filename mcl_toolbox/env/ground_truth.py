@@ -0,0 +1,189 @@
+import numpy as np
+
+from mcl_toolbox.env.tree_template import get_tree_template
+from mcl_toolbox.utils.distributions import Categorical, Normal, PointMass
+
+"""
+Batched sampling of ground truths.
+The values of N trials with the same branching and reward function are drawn
+as an (N x num_nodes) array with one NumPy call per distribution family. Nodes
+are drawn in label order, one trial after the other, so that with the global
+NumPy random state the values are the same as the ones drawn node by node by
+distributions.sample when all the nodes of the tree share a family. Other
+distributions fall back to their own sample method, node by node.
+"""
+
+
+def get_random_state(random_state=None):
+    """
+    Get the random number generator to draw samples with
+
+    Args:
+        random_state: None for the global NumPy random state, a seed or a
+            np.random.Generator/np.random.RandomState
+
+    Returns:
+        Object with random and standard_normal methods
+    """
+    if random_state is None:
+        return np.random
+    if isinstance(random_state, (np.random.Generator, np.random.RandomState)):
+        return random_state
+    return np.random.default_rng(random_state)
+
+
+def get_depth_distributions(pipeline_entry):
+    branching, reward_function = pipeline_entry
+    template = get_tree_template(tuple(branching))
+    return template, [
+        reward_function(depth) for depth in range(template.max_depth + 1)
+    ]
+
+
+def draw_ground_truths(template, node_distributions, num_samples, rng):
+    """
+    Draw the node values of num_samples trials
+
+    Args:
+        template: TreeTemplate of the trials
+        node_distributions: Distribution (or constant) of each depth
+        num_samples: Number of trials
+        rng: Object returned by get_random_state
+
+    Returns:
+        Array of shape (num_samples, num_nodes) with 0 at the root
+    """
+    depths = template.depths
+    categorical, normal, constant, other = [], [], [], []
+    for node_num in range(1, template.num_nodes):
+        dist = node_distributions[depths[node_num]]
+        if isinstance(dist, PointMass) or not hasattr(dist, "sample"):
+            constant.append(node_num)
+        elif isinstance(dist, Categorical):
+            categorical.append(node_num)
+        elif isinstance(dist, Normal):
+            normal.append(node_num)
+        else:
+            other.append(node_num)
+
+    if normal or other:
+        dtype = float
+    else:
+        dtype = np.result_type(
+            np.int64,
+            *[
+                np.asarray(getattr(dist, "vals", dist)).dtype
+                for dist in node_distributions[1:]
+            ],
+        )
+    ground_truths = np.zeros((num_samples, template.num_nodes), dtype=dtype)
+    for node_num in constant:
+        dist = node_distributions[depths[node_num]]
+        ground_truths[:, node_num] = dist.vals[0] if hasattr(dist, "vals") else dist
+
+    if categorical:
+        # Same inverse CDF lookup as Categorical.sample
+        uniforms = rng.random((num_samples, len(categorical)))
+        for depth in np.unique(depths[categorical]):
+            vals, _, cdf = node_distributions[depth].get_arrays()
+            columns = np.flatnonzero(depths[categorical] == depth)
+            indices = cdf.searchsorted(uniforms[:, columns], side="right")
+            ground_truths[:, np.asarray(categorical)[columns]] = vals[indices]
+    if normal:
+        z = rng.standard_normal((num_samples, len(normal)))
+        for depth in np.unique(depths[normal]):
+            dist = node_distributions[depth]
+            columns = np.flatnonzero(depths[normal] == depth)
+            ground_truths[:, np.asarray(normal)[columns]] = (
+                dist.mu + dist.sigma * z[:, columns]
+            )
+    # Other distributions are sampled node by node with their own sample method
+    for sample_num in range(num_samples):
+        for node_num in other:
+            ground_truths[sample_num, node_num] = node_distributions[
+                depths[node_num]
+            ].sample()
+    return ground_truths
+
+
+def sample_ground_truths(pipeline_entry, num_samples, random_state=None):
+    """
+    Sample the ground truths of trials of a pipeline entry
+
+    Args:
+        pipeline_entry: (branching, reward function) tuple
+        num_samples: Number of trials to sample
+        random_state: None for the global NumPy random state, a seed or a
+            np.random.Generator/np.random.RandomState
+
+    Returns:
+        Array of shape (num_samples, num_nodes) with 0 at the root
+    """
+    template, node_distributions = get_depth_distributions(pipeline_entry)
+    return draw_ground_truths(
+        template, node_distributions, num_samples, get_random_state(random_state)
+    )
+
+
+def iter_ground_truths(
+    pipeline_entry, num_samples, chunk_size=10000, random_state=None
+):
+    """
+    Sample the ground truths of trials of a pipeline entry in chunks, so that
+    a large number of trials doesn't have to be held in memory at once.
+    The concatenated chunks are the same as the output of sample_ground_truths
+    with the same random state.
+
+    Args:
+        pipeline_entry: (branching, reward function) tuple
+        num_samples: Number of trials to sample
+        chunk_size: Maximum number of trials per chunk
+        random_state: None for the global NumPy random state, a seed or a
+            np.random.Generator/np.random.RandomState
+
+    Yields:
+        Arrays of shape (<= chunk_size, num_nodes) with 0 at the root
+    """
+    if chunk_size < 1:
+        raise ValueError("The chunk size must be positive")
+    template, node_distributions = get_depth_distributions(pipeline_entry)
+    rng = get_random_state(random_state)
+    for start in range(0, num_samples, chunk_size):
+        yield draw_ground_truths(
+            template, node_distributions, min(chunk_size, num_samples - start), rng
+        )
+
+
+def sample_pipeline_ground_truths(pipeline, random_state=None):
+    """
+    Sample the ground truth of each trial of a pipeline. Consecutive trials
+    with the same pipeline entry are sampled together.
+
+    Args:
+        pipeline: List of (branching, reward function) tuples, one per trial
+        random_state: None for the global NumPy random state, a seed or a
+            np.random.Generator/np.random.RandomState
+
+    Returns:
+        List of lists of node values, one per trial
+    """
+    rng = get_random_state(random_state)
+    ground_truths = []
+    start = 0
+    while start < len(pipeline):
+        branching, reward_function = pipeline[start]
+        end = start + 1
+        while (
+            end < len(pipeline)
+            and pipeline[end][1] is reward_function
+            and list(pipeline[end][0]) == list(branching)
+        ):
+            end += 1
+        template, node_distributions = get_depth_distributions(pipeline[start])
+        ground_truths.extend(
+            draw_ground_truths(
+                template, node_distributions, end - start, rng
+            ).tolist()
+        )
+        start = end
+    return ground_truths
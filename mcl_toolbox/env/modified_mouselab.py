@@ -1,14 +1,26 @@
+import copy
 import random
-from collections import defaultdict
-from functools import lru_cache
+from collections import Counter, defaultdict, namedtuple
+from functools import lru_cache, partial
+from operator import methodcaller
 from statistics import mean
 from typing import List
 
 import numpy as np
-from toolz import get
 
+from mcl_toolbox.env.feature_plan import get_cached_feature_plan
+from mcl_toolbox.env.ground_truth import sample_pipeline_ground_truths
+from mcl_toolbox.env.tree_template import (
+    TreeTemplate,
+    approx_max,
+    approx_min,
+    construct_structure_map,
+    get_expected_node_values,
+    get_tree_template,
+    get_trial_depth_summary,
+    popcount,
+)
 from mcl_toolbox.utils import distributions
-from mcl_toolbox.utils.learning_utils import get_normalized_feature_values
 
 """ This file defines the node, trial and trial sequence class for the
     feature based representation of the Mouselab-MDP. This assumes that
@@ -80,44 +92,170 @@ def normal_reward_val(depth):
     return 0.0
 
 
-def approx_max(dist, position=0):
-    if hasattr(dist, "mu"):
-        if position == 0:
-            return dist.mu + 2 * dist.sigma
-        else:
-            return dist.mu + dist.sigma
-    else:
-        if position == 0:
-            return max(dist.vals)
-        else:
-            return sorted(dist.vals)[-(position + 1)]
+def compute_max_expected_returns(values, observed, expected_values, path_nodes):
+    """
+    Max expected return of many trials of the same tree at once. The path
+    values are summed in path order, as in Trial.get_path_expected_value.
 
+    Args:
+        values: (num_trials x num_nodes) values of the nodes
+        observed: (num_trials x num_nodes) whether each node is observed
+        expected_values: expected values of the unobserved nodes, per trial
+                         or shared by all trials (the root is 0)
+        path_nodes: (num_paths x max_depth + 1) labels on each path
 
-def approx_min(dist, position=0):
-    if hasattr(dist, "mu"):
-        if position == 0:
-            return dist.mu - 2 * dist.sigma
-        else:
-            return dist.mu - dist.sigma
-    return sorted(dist.vals)[position]
+    Returns:
+        (num_trials) array of max expected returns
+    """
+    node_values = np.where(observed, values, expected_values)
+    path_values = node_values[:, path_nodes[:, 0]]
+    for depth in range(1, path_nodes.shape[1]):
+        path_values = path_values + node_values[:, path_nodes[:, depth]]
+    return path_values.max(axis=1)
 
 
 def get_termination_mers(envs, trial_actions, pipeline):
-    mers = []
-    for i, (env, actions) in enumerate(zip(envs, trial_actions)):
-        trial = TrialSequence(1, [pipeline[i]], ground_truth=[env]).trial_sequence[0]
-        for action in actions[:-1]:
-            trial.node_map[action].observe()
-        mers.append(trial.node_map[1].calculate_max_expected_return())
-    return mers
+    """
+    Max expected return at the termination of each trial, computed from
+    the node values and the clicks without replaying them.
+
+    Args:
+        envs: node values of each trial
+        trial_actions: clicks of each trial, ending with the termination action
+        pipeline: (branching, reward function) of each trial
+
+    Returns:
+        List of the max expected returns
+    """
+    num_trials = min(len(envs), len(trial_actions))
+    mers = np.zeros(num_trials)
+    trials_by_tree = defaultdict(list)
+    for trial_num in range(num_trials):
+        trials_by_tree[tuple(pipeline[trial_num][0])].append(trial_num)
+    for branching, trial_nums in trials_by_tree.items():
+        template = get_tree_template(branching)
+        values = np.array([envs[trial_num] for trial_num in trial_nums], dtype=float)
+        values[:, 0] = 0.0
+        observed = np.zeros(values.shape, dtype=bool)
+        for row, trial_num in enumerate(trial_nums):
+            observed[row, list(trial_actions[trial_num][:-1])] = True
+        expected_values = np.array(
+            [
+                get_expected_node_values(pipeline[trial_num][1], template)
+                for trial_num in trial_nums
+            ]
+        )
+        mers[trial_nums] = compute_max_expected_returns(
+            values, observed, expected_values, template.path_nodes
+        )
+    return mers.tolist()
+
+
+# Observation state of a trial, see Trial.snapshot
+TrialSnapshot = namedtuple(
+    "TrialSnapshot", ["observed_nodes", "unobserved_nodes", "previous_observed"]
+)
+
+
+class IndexedNodeSet:
+    """
+    Insertion ordered set of the nodes of a trial, used for the observed and
+    unobserved nodes. Appending, removing and membership tests are O(1), and
+    it iterates, indexes and compares like the list it replaces: removing a
+    node keeps the order of the others and appending adds it at the end.
+    The list of the nodes and the array of their labels are cached until the
+    set changes.
+    """
+
+    __slots__ = ("nodes", "node_list", "labels")
+
+    def __init__(self, nodes=()):
+        self.nodes = dict.fromkeys(nodes)
+        self.node_list = None
+        self.labels = None
+
+    def append(self, node):
+        self.nodes[node] = None
+        self.node_list = None
+        self.labels = None
+
+    def remove(self, node):
+        try:
+            del self.nodes[node]
+        except KeyError:
+            raise ValueError(f"Node {node.label} is not in the set")
+        self.node_list = None
+        self.labels = None
+
+    def to_list(self):
+        """Cached list of the nodes, must not be modified"""
+        if self.node_list is None:
+            self.node_list = list(self.nodes)
+        return self.node_list
+
+    def get_labels(self):
+        """Cached read-only array of the labels of the nodes, in order"""
+        if self.labels is None:
+            self.labels = np.fromiter(
+                (node.label for node in self.nodes), dtype=int, count=len(self.nodes)
+            )
+            self.labels.flags.writeable = False
+        return self.labels
+
+    def copy(self):
+        return list(self.nodes)
+
+    def index(self, node):
+        return self.to_list().index(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        # Iterates over the nodes at the time of the call, like a copy
+        return iter(self.to_list())
+
+    def __reversed__(self):
+        return reversed(self.to_list())
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __eq__(self, other):
+        if isinstance(other, IndexedNodeSet):
+            return self.to_list() == other.to_list()
+        if isinstance(other, (list, tuple)):
+            return self.to_list() == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"IndexedNodeSet({self.to_list()!r})"
 
 
 class TrialSequence:
     def __init__(
-        self, num_trials: int, pipeline: dict, ground_truth: List[List[float]] = None
+        self,
+        num_trials: int,
+        pipeline: dict,
+        ground_truth: List[List[float]] = None,
+        trial_class=None,
     ) -> None:
+        """
+        Args:
+            num_trials: number of trials in the sequence
+            pipeline: list of (branching, reward function) tuples, one per trial
+            ground_truth: node values of each trial, sampled from the pipeline if None
+            trial_class: Trial implementation used for each trial, defaults to the
+                         Node object graph (Trial). See array_mouselab.ArrayTrial.
+        """
         self.num_trials = num_trials
         self.pipeline = pipeline
+        self.trial_class = trial_class if trial_class is not None else Trial
         if not ground_truth:
             self._construct_ground_truth()
         else:
@@ -130,82 +268,51 @@ class TrialSequence:
             gt[0] = 0.0
         self.trial_sequence = []
         self._construct_trials()
-        # THINK ABOUT THIS AND FIX IT
-        self.node_click_count = {i: 0 for i in range(100)}
-        self.observed_node_values = defaultdict(list)
+        self.construct_statistics()
 
     def _construct_ground_truth(self):
         """
         Construct ground truth from reward distribution
-        (Used Fred's code from mouselab_utils.py)
         """
-        self.ground_truth = []
-
-        def gen_trial_gt(trial_num):
-            tree = []
-            init = []
-            branching = self.pipeline[trial_num][0]
-            reward_function = self.pipeline[trial_num][1]
-
-            def expand(d):
-                nonlocal init, tree
-                my_idx = len(init)
-                init.append(reward_function(d))
-                children = []
-                tree.append(children)
-                for _ in range(get(d, branching, 0)):
-                    child_idx = expand(d + 1)
-                    children.append(child_idx)
-                return my_idx
-
-            expand(0)
-            dist = (0, *init[1:])
-            return list(map(distributions.sample, dist))
-
-        for trial_num in range(self.num_trials):
-            gt = gen_trial_gt(trial_num)
-            self.ground_truth.append(gt)
+        self.ground_truth = sample_pipeline_ground_truths(
+            self.pipeline[: self.num_trials]
+        )
 
     def _construct_structure_map(self, branching):
-        """
-        Construct the structure map from which the trial representation will be created.
-        Assumes symmetric structure.
-
-        Returns:
-                dict -- Keys are node numbers and parents are values.
-        """
-        structure_map = {0: None}
-        branching_len = len(branching)
-        curr_index = 1
-
-        def construct_map(curr_parent, branching_index):
-            if branching_index == branching_len:
-                return
-            nonlocal curr_index, structure_map
-            for _ in range(branching[branching_index]):
-                present_node = curr_index
-                structure_map[curr_index] = curr_parent
-                curr_index += 1
-                construct_map(present_node, branching_index + 1)
-
-        construct_map(0, 0)
-        return structure_map
+        return construct_structure_map(branching)
 
     def _construct_trials(self):
         values = self.ground_truth
         for trial_num in range(self.num_trials):
             branching = self.pipeline[trial_num][0]
             reward_function = self.pipeline[trial_num][1]
-            structure_map = self._construct_structure_map(branching)
-            trial = Trial(
+            template = get_tree_template(tuple(branching))
+            trial = self.trial_class(
                 values[trial_num],
-                structure_map,
+                template.structure_map,
                 max_depth=len(branching),
                 reward_function=reward_function,
+                template=template,
             )
             trial.sequence = self
             self.trial_sequence.append(trial)
 
+    def construct_statistics(self):
+        """
+        Click statistics over the trials of the sequence: the number of clicks
+        on each node and the running count, mean and sum of squared
+        deviations from the mean (Welford) of the observed values at each
+        level, sized from the largest tree. The multiset of observed values
+        at each level is kept as well to key the statistics exactly
+        """
+        num_nodes = max((trial.num_nodes for trial in self.trial_sequence), default=1)
+        max_depth = max((trial.max_depth for trial in self.trial_sequence), default=0)
+        self.node_click_count = np.zeros(num_nodes, dtype=int)
+        self.level_value_counts = np.zeros(max_depth + 1, dtype=int)
+        self.level_value_means = np.zeros(max_depth + 1)
+        self.level_value_m2s = np.zeros(max_depth + 1)
+        self.level_values = [Counter() for _ in range(max_depth + 1)]
+
     def increment_count(self, click):
         self.node_click_count[click] += 1
 
@@ -213,55 +320,153 @@ class TrialSequence:
         self.node_click_count[click] -= 1
 
     def get_click_count(self, click):
-        return self.node_click_count[click]
+        return int(self.node_click_count[click])
 
     def reset_count(self):
-        for k in self.node_click_count.keys():
-            self.node_click_count[k] = 0
+        self.node_click_count[:] = 0
+
+    def add_observed_value(self, level, value):
+        self.level_values[level][value] += 1
+        self.level_value_counts[level] += 1
+        delta = value - self.level_value_means[level]
+        self.level_value_means[level] += delta / self.level_value_counts[level]
+        self.level_value_m2s[level] += delta * (value - self.level_value_means[level])
+
+    def remove_observed_value(self, level, value):
+        values = self.level_values[level]
+        values[value] -= 1
+        if not values[value]:
+            del values[value]
+        self.level_value_counts[level] -= 1
+        count = self.level_value_counts[level]
+        if count == 0:
+            self.level_value_means[level] = 0
+            self.level_value_m2s[level] = 0
+            return
+        delta = value - self.level_value_means[level]
+        self.level_value_means[level] -= delta / count
+        self.level_value_m2s[level] -= delta * (value - self.level_value_means[level])
+
+    def reset_observed_values(self):
+        self.level_value_counts[:] = 0
+        self.level_value_means[:] = 0
+        self.level_value_m2s[:] = 0
+        for values in self.level_values:
+            values.clear()
+
+    def get_level_std(self, level):
+        """Standard deviation of the values observed at the level, 0 if none"""
+        count = self.level_value_counts[level]
+        if count == 0:
+            return 0
+        return np.sqrt(max(self.level_value_m2s[level] / count, 0))
+
+    def get_level_stds(self):
+        """Standard deviations of the values observed at each level"""
+        variances = self.level_value_m2s / np.maximum(self.level_value_counts, 1)
+        return np.sqrt(np.maximum(variances, 0))
 
     def reset_sequence(self):
         self._construct_trials()
         self.reset_count()
-        self.observed_node_values = defaultdict(list)
+        self.reset_observed_values()
+
+    def get_statistics_key(self, num_nodes):
+        """Hashable key of the click statistics of the first num_nodes nodes"""
+        # Removing a value doesn't exactly undo adding it in the running
+        # means and M2s, so the key uses the multisets of observed values
+        return (
+            self.node_click_count[:num_nodes].tobytes(),
+            tuple(frozenset(values.items()) for values in self.level_values),
+        )
+
+    def fork_statistics(self):
+        """Shallow copy of the sequence with its own click statistics"""
+        sequence = copy.copy(self)
+        sequence.node_click_count = self.node_click_count.copy()
+        sequence.level_value_counts = self.level_value_counts.copy()
+        sequence.level_value_means = self.level_value_means.copy()
+        sequence.level_value_m2s = self.level_value_m2s.copy()
+        sequence.level_values = [values.copy() for values in self.level_values]
+        return sequence
+
+    def reset_observations(self):
+        """Clears the observations of all the trials and the click statistics,
+        keeping the trials"""
+        for trial in self.trial_sequence:
+            if trial.observed_nodes or trial.previous_observed is not None:
+                trial.reset_observations()
+            trial.construct_level_map()
+        self.reset_count()
+        self.reset_observed_values()
 
 
 class Trial:
+    # Whether FeaturePlan can compute the features of all nodes with array operations
+    vectorized_features = False
+
     def __init__(
-        self, ground_truth, structure_map, max_depth=None, reward_function=None
+        self,
+        ground_truth,
+        structure_map,
+        max_depth=None,
+        reward_function=None,
+        template=None,
     ):
+        """
+        Args:
+            ground_truth: values of the nodes
+            structure_map: parent of each node
+            max_depth: depth of the tree
+            reward_function: reward distribution at each depth
+            template: TreeTemplate of the structure map, shared with the other
+                      trials of the same tree (see tree_template.get_tree_template)
+        """
         self.sequence = None
-        self.construct_trial(ground_truth, structure_map)
+        if template is None:
+            template = TreeTemplate(structure_map)
+        self.template = template
+        self.construct_trial(ground_truth, template.structure_map)
         self.previous_observed = None
+        self.max_depth = template.max_depth
         if max_depth:
             self.max_depth = max_depth
         if reward_function:
             self.reward_function = reward_function
-        self.node_level_map = {}
-        self.level_map = {d: [] for d in range(1, self.max_depth + 1)}
-        self.construct_node_maps(self.root, 0)
+        self.depth_summary = self.get_depth_summary()
+        self.node_level_map = template.node_level_map
+        self.construct_level_map()
+        for label, depth in template.node_level_map.items():
+            self.node_map[label].depth = depth
         self.init_expectations()
         self.path_map = {}
-        self.branch_map = {}  # Nodes lying on the branch
-        self.reverse_branch_map = {}  # Branches passing through the node
-        self.construct_branch_maps()
-        self.observed_nodes = []
-        self.unobserved_nodes = list(self.node_map.values())
+        self.branch_map = template.branch_map  # Nodes lying on the branch
+        # Branches passing through the node
+        self.reverse_branch_map = template.reverse_branch_map
+        self.compute_path_expected_values()
+        self.observed_nodes = IndexedNodeSet()
+        self.unobserved_nodes = IndexedNodeSet(self.node_map.values())
         self.num_nodes = len(self.node_map)
-        self.max_values_by_depth = {
-            d: approx_max(self.reward_function(d)) for d in range(1, self.max_depth + 1)
-        }
-        self.min_values_by_depth = {
-            d: approx_min(self.reward_function(d)) for d in range(1, self.max_depth + 1)
-        }
-        self.variance_by_depth = {
-            d: self.reward_function(d).var() for d in range(1, self.max_depth + 1)
-        }
-        self.uncertainty_by_depth = {
-            d: self.reward_function(d).std() for d in range(1, self.max_depth + 1)
+        self.max_values_by_depth = self.depth_summary.max_values_by_depth
+        self.min_values_by_depth = self.depth_summary.min_values_by_depth
+        self.variance_by_depth = self.depth_summary.variance_by_depth
+        self.uncertainty_by_depth = self.depth_summary.uncertainty_by_depth
+
+    def construct_level_map(self):
+        # Strategies shuffle the lists of the level map in place
+        self.level_map = {
+            d: [self.node_map[label] for label in self.template.level_labels.get(d, [])]
+            for d in range(1, self.max_depth + 1)
         }
 
+    def get_depth_summary(self):
+        return get_trial_depth_summary(self.reward_function, self.max_depth)
+
+    def new_node(self):
+        return Node(self)
+
     def create_node_label(self, label, parent):
-        node = Node(self)
+        node = self.new_node()
         node.label = label
         if parent is not None:
             parent.children.append(node)
@@ -273,6 +478,9 @@ class Trial:
         return node
 
     def construct_trial(self, ground_truth, parent_map):
+        # Bit i is set if node i is observed
+        self.observed_bits = 0
+        self.ground_truth_key = None
         node_map = {}
         ground_truth[0] = 0.0
         for k, v in parent_map.items():
@@ -285,47 +493,139 @@ class Trial:
         self.root = node_map[0]
         self.ground_truth = ground_truth
 
-    def construct_node_maps(self, root, current_level):
-        for child in root.children:
-            self.level_map[current_level + 1].append(child)
-            self.node_level_map[child.label] = current_level + 1
-            child.depth = current_level + 1
-        for child in root.children:
-            self.construct_node_maps(child, current_level + 1)
+    def get_ground_truth_key(self):
+        """Hashable key of the tree, reward function and node values"""
+        if self.ground_truth_key is None:
+            self.ground_truth_key = (
+                self.template,
+                self.max_depth,
+                getattr(self, "reward_function", None),
+                tuple(self.ground_truth),
+            )
+        return self.ground_truth_key
+
+    def get_state_key(self, sequence_statistics=False):
+        """
+        Hashable key of the observation state of the trial. Trials with the
+        same key have the same feature values.
+
+        Args:
+            sequence_statistics: include the click statistics of the sequence,
+                needed for the features that depend on the previous trials
+
+        Returns:
+            (ground truth key, observed bitmask, previously observed node) tuple,
+            followed by the statistics key of the sequence if requested
+        """
+        previous_observed = self.previous_observed
+        key = (
+            self.get_ground_truth_key(),
+            self.observed_bits,
+            previous_observed.label if previous_observed else -1,
+        )
+        if sequence_statistics and self.sequence:
+            key += (self.sequence.get_statistics_key(self.num_nodes),)
+        return key
 
     def init_expectations(self):
+        expected_values = self.depth_summary.expected_values
         for node in self.node_map.values():
             if node.label != 0:
-                node.expected_value = self.reward_function(node.depth).expectation()
-
-    def construct_branch_maps(self):
-        path_num = 1
-
-        def get_tree_path(root, present_path):
-            nonlocal path_num
-            present_path.append(root.label)
-            if not root.children:
-                self.branch_map[path_num] = tuple(present_path)
-                for node_num in present_path:
-                    if node_num not in self.reverse_branch_map:
-                        self.reverse_branch_map[node_num] = [path_num]
-                    else:
-                        self.reverse_branch_map[node_num].append(path_num)
-                present_path = []
-                path_num += 1
-            else:
-                for child in root.children:
-                    get_tree_path(child, present_path[:])
-
-        get_tree_path(self.root, [])
+                node.expected_value = expected_values[node.depth]
 
     def reset_observations(self):
         num_nodes = len(self.node_map)
         for node_num in range(num_nodes):
             self.node_map[node_num].observed = False
+        self.observed_bits = 0
+        self.compute_path_expected_values()
         self.previous_observed = None
-        self.observed_nodes = []
-        self.unobserved_nodes = list(self.node_map.values())
+        self.observed_nodes = IndexedNodeSet()
+        self.unobserved_nodes = IndexedNodeSet(self.node_map.values())
+
+    def snapshot(self):
+        """Token of the current observation state, see restore"""
+        return TrialSnapshot(
+            tuple(self.observed_nodes),
+            tuple(self.unobserved_nodes),
+            self.previous_observed,
+        )
+
+    def restore(self, token):
+        """
+        Restores the observation state of a snapshot. Only the nodes whose
+        observation changed since the snapshot are undone or redone, the
+        click counts and observed node values of the sequence are restored
+        with them.
+
+        Args:
+            token: TrialSnapshot returned by snapshot
+        """
+        observed_nodes = token.observed_nodes
+        num_kept = 0
+        for node, snapshot_node in zip(self.observed_nodes, observed_nodes):
+            if node is not snapshot_node:
+                break
+            num_kept += 1
+        for node in reversed(self.observed_nodes[num_kept:]):
+            self.undo_observation(node)
+        for node in observed_nodes[num_kept:]:
+            node.observe()
+        self.observed_nodes = IndexedNodeSet(observed_nodes)
+        self.unobserved_nodes = IndexedNodeSet(token.unobserved_nodes)
+        self.previous_observed = token.previous_observed
+
+    def undo_observation(self, node):
+        """Unobserves the node, removing the value it added to the sequence"""
+        self.set_observed(node.label, False)
+        self.update_path_expected_values(node.label)
+        self.observed_nodes.remove(node)
+        self.unobserved_nodes.append(node)
+        if self.sequence:
+            self.sequence.decrement_count(node.label)
+            if node is not self.root:
+                self.sequence.remove_observed_value(
+                    self.node_level_map[node.label], node.value
+                )
+
+    def fork(self):
+        """
+        Copy of the trial with the same observations that can be observed
+        independently. The tree structure, node values and reward summaries
+        are shared, the sequence (if any) is copied with its own click
+        statistics.
+        """
+        trial = self.__class__(
+            self.ground_truth,
+            self.template.structure_map,
+            max_depth=self.max_depth,
+            reward_function=self.reward_function,
+            template=self.template,
+        )
+        node_map = trial.node_map
+        for node in self.observed_nodes:
+            trial.set_observed(node.label, True)
+        trial.observed_nodes = IndexedNodeSet(
+            node_map[node.label] for node in self.observed_nodes
+        )
+        trial.unobserved_nodes = IndexedNodeSet(
+            node_map[node.label] for node in self.unobserved_nodes
+        )
+        if self.previous_observed is not None:
+            trial.previous_observed = node_map[self.previous_observed.label]
+        trial.level_map = {
+            depth: [node_map[node.label] for node in nodes]
+            for depth, nodes in self.level_map.items()
+        }
+        trial.expected_path_values = dict(self.expected_path_values)
+        trial.path_value_paths = {
+            value: set(paths) for value, paths in self.path_value_paths.items()
+        }
+        trial.best_path_value = self.best_path_value
+        trial.second_path_value = self.second_path_value
+        if self.sequence:
+            trial.sequence = self.sequence.fork_statistics()
+        return trial
 
     def get_action_feedback(self, taken_path):
         path_sums = {}
@@ -341,16 +641,11 @@ class Trial:
         else:
             return 2 + max_branch_sum - max_taken_sum
 
-    def get_node_feature_values(self, nodes, features, normalized_features):
-        num_features = len(features)
-        feature_values = np.zeros((len(nodes), num_features))
-        for i, node in enumerate(nodes):
-            feature_values[i] = node.compute_termination_feature_values(features)
-            if normalized_features:
-                feature_values[i] = get_normalized_feature_values(
-                    feature_values[i], features, normalized_features
-                )
-        return feature_values
+    def get_node_feature_values(self, nodes, features, normalized_features=None):
+        """Feature values of the given nodes, the features are a list of
+        feature names or a compiled FeaturePlan"""
+        feature_plan = get_cached_feature_plan(features, normalized_features)
+        return feature_plan.evaluate_nodes(self, nodes)
 
     def get_leaf_nodes(self):
         leaf_nodes = []
@@ -362,8 +657,16 @@ class Trial:
     def set_previous_node(self, node):
         self.previous_observed = node
 
+    def set_observed(self, node_num, observed):
+        self.node_map[node_num].observed = observed
+        if observed:
+            self.observed_bits |= 1 << node_num
+        else:
+            self.observed_bits &= ~(1 << node_num)
+
     def unobserve(self, node_num):
-        self.node_map[node_num].observed = False
+        self.set_observed(node_num, False)
+        self.update_path_expected_values(node_num)
         node = self.node_map[node_num]
         self.observed_nodes.remove(node)
         self.unobserved_nodes.append(node)
@@ -371,9 +674,7 @@ class Trial:
         if len(self.observed_nodes) > 0:
             self.previous_observed = self.observed_nodes[-1]
         self.sequence.decrement_count(node_num)
-        self.sequence.observed_node_values[self.node_level_map[node_num]].remove(
-            node.value
-        )
+        self.sequence.remove_observed_value(self.node_level_map[node_num], node.value)
 
     def get_max_dist_value(self):
         max_values = list(self.max_values_by_depth.values())
@@ -476,8 +777,7 @@ class Trial:
         return 0
 
     def hard_satisficing(self, aspiration_level):
-        expected_path_values = self.get_path_expected_values()
-        max_expected_value = max(expected_path_values.values())
+        max_expected_value = self.get_path_value_summary()[0]
         if max_expected_value >= aspiration_level:
             return 0
         return -1
@@ -500,22 +800,100 @@ class Trial:
             max_path_values[i] = max_value
         return max_path_values
 
+    def get_path_expected_value(self, path_num):
+        ev = 0
+        for node_num in self.branch_map[path_num]:
+            node = self.node_map[node_num]
+            if node.observed:
+                ev += node.value
+            else:
+                if node_num != 0:
+                    # Verify this
+                    ev += node.expected_value
+        return ev
+
+    def compute_path_expected_values(self):
+        """Computes the cached expected values of all the paths and their
+        summary (see get_path_value_summary)"""
+        self.expected_path_values = {
+            path_num: self.get_path_expected_value(path_num)
+            for path_num in range(1, len(self.branch_map) + 1)
+        }
+        # Paths with each expected value
+        self.path_value_paths = {}
+        for path_num, value in self.expected_path_values.items():
+            self.path_value_paths.setdefault(value, set()).add(path_num)
+        self.best_path_value = max(self.path_value_paths)
+        self.second_path_value = self.get_largest_path_value_below(
+            self.best_path_value
+        )
+
+    def get_largest_path_value_below(self, value):
+        """Largest path expected value below value, None if there is none"""
+        return max(
+            (other for other in self.path_value_paths if other < value),
+            default=None,
+        )
+
+    def update_path_expected_value(self, path_num, value):
+        """
+        Sets the expected value of a path and updates the best and second
+        best values. The other path values are only scanned when the best or
+        second best value loses its last path.
+        """
+        old_value = self.expected_path_values[path_num]
+        if value == old_value:
+            return
+        self.expected_path_values[path_num] = value
+        value_paths = self.path_value_paths
+        old_paths = value_paths[old_value]
+        old_paths.discard(path_num)
+        if not old_paths:
+            del value_paths[old_value]
+        value_paths.setdefault(value, set()).add(path_num)
+        best_value = self.best_path_value
+        second_value = self.second_path_value
+        if value > best_value:
+            self.best_path_value = value
+            if best_value in value_paths:
+                self.second_path_value = best_value
+        elif best_value not in value_paths:
+            # The path was the only best path and its value decreased
+            if second_value is None or value > second_value:
+                self.best_path_value = value
+            else:
+                self.best_path_value = second_value
+                self.second_path_value = self.get_largest_path_value_below(
+                    second_value
+                )
+        elif value < best_value and (second_value is None or value > second_value):
+            self.second_path_value = value
+        elif old_value == second_value and second_value not in value_paths:
+            self.second_path_value = self.get_largest_path_value_below(best_value)
+
+    def update_path_expected_values(self, node_num):
+        """Updates the cached expected values of the paths through the node
+        after it has been observed or unobserved"""
+        for path_num in self.reverse_branch_map[node_num]:
+            self.update_path_expected_value(
+                path_num, self.get_path_expected_value(path_num)
+            )
+
     def get_path_expected_values(self):
-        num_branches = len(self.branch_map)
-        expected_path_values = {}
-        for i in range(1, num_branches + 1):
-            path = self.branch_map[i]
-            ev = 0
-            for node_num in path:
-                node = self.node_map[node_num]
-                if node.observed:
-                    ev += node.value
-                else:
-                    if node_num != 0:
-                        # Verify this
-                        ev += node.expected_value
-            expected_path_values[i] = ev
-        return expected_path_values
+        return dict(self.expected_path_values)
+
+    def get_path_value_summary(self):
+        """
+        Returns:
+            The largest path expected value, the second largest distinct value
+            (None if all paths have the same value) and the set of paths with
+            the largest value, which must not be modified
+        """
+        return (
+            self.best_path_value,
+            self.second_path_value,
+            self.path_value_paths[self.best_path_value],
+        )
 
     def get_path_expected_values_information(self, level_values):
         num_branches = len(self.branch_map)
@@ -714,98 +1092,137 @@ class Trial:
         return taken_path, reward
 
 
+def _trial_feature(method_name):
+    """Feature callable that evaluates a method of the node's trial"""
+
+    def trial_feature(node):
+        return getattr(node.trial, method_name)()
+
+    return trial_feature
+
+
 class Node:
-    def __init__(self, trial):
+    __slots__ = (
+        "trial",
+        "label",
+        "observed",
+        "value",
+        "parent",
+        "children",
+        "depth",
+        "root",
+        "tree",
+        "expected_value",
+    )
+
+    # Feature callables take the node as their only argument. They are shared
+    # by all nodes instead of being bound to every node on construction.
+    feature_registry = {
+        "siblings_count": methodcaller("get_observed_siblings_count"),
+        "depth_count": methodcaller("get_observed_same_depth_count"),
+        "ancestor_count": methodcaller("get_observed_ancestor_count"),
+        "successor_count": methodcaller("get_observed_successor_count"),
+        "is_leaf": methodcaller("is_leaf"),
+        "depth": methodcaller("get_depth_node"),
+        "max_successor": methodcaller("get_max_successor_value"),
+        "parent_value": methodcaller("get_parent_value"),
+        "max_immediate_successor": methodcaller("get_max_immediate_successor"),
+        "immediate_successor_count": methodcaller("get_immediate_successor_count"),
+        "previous_observed_successor": methodcaller("is_previous_successor"),
+        "is_successor_highest": methodcaller("is_successor_highest_leaf"),
+        "parent_observed": methodcaller("is_parent_observed"),
+        "is_max_path_observed": _trial_feature("is_max_path_observed"),
+        "observed_height": methodcaller("get_observed_height"),
+        "are_max_paths_observed": _trial_feature("are_max_paths_observed"),
+        "is_previous_max": _trial_feature("is_previous_max"),
+        "is_positive_observed": _trial_feature("is_positive_observed"),
+        "all_roots_observed": _trial_feature("all_roots_observed"),
+        "all_leaf_nodes_observed": _trial_feature("all_leaf_nodes_observed"),
+        "immediate_termination": _trial_feature("immediate_termination"),
+        "is_pos_ancestor_leaf": methodcaller("is_leaf_and_positive_ancestor"),
+        "positive_root_leaves_termination": _trial_feature("positive_root_leaves_termination"),
+        "single_path_completion": _trial_feature("single_path_completion_termination"),
+        "is_root": methodcaller("is_root"),
+        "is_previous_successor_negative": methodcaller("is_previous_observed_successor_negative"),
+        "sq_successor_count": methodcaller("sq_successor_count"),
+        "uncertainty": methodcaller("get_uncertainty"),
+        "best_expected": methodcaller("calculate_best_expected_value"),
+        "best_largest": methodcaller("best_largest_value_observed"),
+        "max_uncertainty": methodcaller("max_path_uncertainty"),
+        "most_promising": methodcaller("on_most_promising_path"),
+        "second_most_promising": methodcaller("on_second_promising_path"),
+        "click_count": methodcaller("get_seq_click_count"),
+        "level_count": methodcaller("get_level_count"),
+        "branch_count": methodcaller("get_branch_count"),
+        "soft_pruning": methodcaller("soft_pruning"),
+        "first_observed": _trial_feature("first_node_observed"),
+        "count_observed_node_branch": methodcaller("count_observed_node_branch"),
+        "get_level_observed_std": methodcaller("get_level_observed_std"),
+        "successor_uncertainty": methodcaller("total_successor_uncertainty"),
+        "num_clicks_adaptive": _trial_feature("get_num_clicks"),
+        "num_clicks": _trial_feature("get_num_clicks"),
+        "max_expected_return": methodcaller("calculate_max_expected_return"),
+        "trial_level_std": methodcaller("get_trial_level_std"),
+        "soft_satisficing": methodcaller("soft_satisficing"),
+        "constant": methodcaller("constant_feature"),
+        "planning": methodcaller("constant_feature"),
+        "termination_constant": methodcaller("term_feature"),
+        "value": methodcaller("get_value"),
+        "is_observed": methodcaller("is_observed"),
+        "return_if_terminating": methodcaller("max_expected_if_terminal"),
+    }
+
+    termination_registry = {
+        "is_max_path_observed": _trial_feature("termination_max_observed"),
+        "are_max_paths_observed": _trial_feature("termination_max_paths_observed"),
+        "is_previous_max": _trial_feature("termination_previous_max"),
+        "is_positive_observed": _trial_feature("termination_positive"),
+        "all_roots_observed": _trial_feature("termination_roots_observed"),
+        "all_leaf_nodes_observed": _trial_feature("termination_leaves_observed"),
+        "immediate_termination": _trial_feature("immediate_termination"),
+        "positive_root_leaves_termination": _trial_feature("termination_postive_root_leaves"),
+        "single_path_completion": _trial_feature("termination_single_path"),
+        "first_observed": _trial_feature("termination_first_node"),
+        "max_expected_return": methodcaller("calculate_max_expected_return"),
+        "soft_satisficing": _trial_feature("soft_satisficing"),
+        "constant": methodcaller("constant_feature"),
+    }
 
+    def __init__(self, trial):
+        self.trial = trial
+        self.label = 0
         self.observed = False
         self.value = None
         self.parent = None
         self.children = []
         self.depth = 0  # Will be initialized when a trial is created
-        self.label = 0
-        self.trial = trial
-        self.feature_function_map = {
-            "siblings_count": self.get_observed_siblings_count,
-            "depth_count": self.get_observed_same_depth_count,
-            "ancestor_count": self.get_observed_ancestor_count,
-            "successor_count": self.get_observed_successor_count,
-            "is_leaf": self.is_leaf,
-            "depth": self.get_depth_node,
-            "max_successor": self.get_max_successor_value,
-            "parent_value": self.get_parent_value,
-            "max_immediate_successor": self.get_max_immediate_successor,
-            "immediate_successor_count": self.get_immediate_successor_count,
-            "previous_observed_successor": self.is_previous_successor,
-            "is_successor_highest": self.is_successor_highest_leaf,
-            "parent_observed": self.is_parent_observed,
-            "is_max_path_observed": self.trial.is_max_path_observed,
-            "observed_height": self.get_observed_height,
-            "are_max_paths_observed": self.trial.are_max_paths_observed,
-            "is_previous_max": self.trial.is_previous_max,
-            "is_positive_observed": self.trial.is_positive_observed,
-            "all_roots_observed": self.trial.all_roots_observed,
-            "all_leaf_nodes_observed": self.trial.all_leaf_nodes_observed,
-            "immediate_termination": self.trial.immediate_termination,
-            "is_pos_ancestor_leaf": self.is_leaf_and_positive_ancestor,
-            "positive_root_leaves_termination": self.trial.positive_root_leaves_termination,
-            "single_path_completion": self.trial.single_path_completion_termination,
-            "is_root": self.is_root,
-            "is_previous_successor_negative": self.is_previous_observed_successor_negative,
-            "sq_successor_count": self.sq_successor_count,
-            "uncertainty": self.get_uncertainty,
-            "best_expected": self.calculate_best_expected_value,
-            "best_largest": self.best_largest_value_observed,
-            "max_uncertainty": self.max_path_uncertainty,
-            "most_promising": self.on_most_promising_path,
-            "second_most_promising": self.on_second_promising_path,
-            "click_count": self.get_seq_click_count,
-            "level_count": self.get_level_count,
-            "branch_count": self.get_branch_count,
-            "soft_pruning": self.soft_pruning,
-            "first_observed": self.trial.first_node_observed,
-            "count_observed_node_branch": self.count_observed_node_branch,
-            "get_level_observed_std": self.get_level_observed_std,
-            "successor_uncertainty": self.total_successor_uncertainty,
-            "num_clicks_adaptive": self.trial.get_num_clicks,
-            "num_clicks": self.trial.get_num_clicks,
-            "max_expected_return": self.calculate_max_expected_return,
-            "trial_level_std": self.get_trial_level_std,
-            "soft_satisficing": self.soft_satisficing,
-            "constant": self.constant_feature,
-            "planning": self.constant_feature,
-            "termination_constant": self.term_feature,
-            "value": self.get_value,
-            "is_observed": self.is_observed,
-            "return_if_terminating": self.max_expected_if_terminal,
+
+    @property
+    def feature_function_map(self):
+        return {
+            feature: partial(function, self)
+            for feature, function in self.feature_registry.items()
         }
 
-        self.termination_map = {
-            "is_max_path_observed": self.trial.termination_max_observed,
-            "are_max_paths_observed": self.trial.termination_max_paths_observed,
-            "is_previous_max": self.trial.termination_previous_max,
-            "is_positive_observed": self.trial.termination_positive,
-            "all_roots_observed": self.trial.termination_roots_observed,
-            "all_leaf_nodes_observed": self.trial.termination_leaves_observed,
-            "immediate_termination": self.trial.immediate_termination,
-            "positive_root_leaves_termination": self.trial.termination_postive_root_leaves,
-            "single_path_completion": self.trial.termination_single_path,
-            "first_observed": self.trial.termination_first_node,
-            "max_expected_return": self.calculate_max_expected_return,
-            "soft_satisficing": self.trial.soft_satisficing,
-            "constant": self.constant_feature,
+    @property
+    def termination_map(self):
+        return {
+            feature: partial(function, self)
+            for feature, function in self.termination_registry.items()
         }
 
     def observe(self):
-        self.observed = True
+        self.trial.set_observed(self.label, True)
+        self.trial.update_path_expected_values(self.label)
         self.trial.set_previous_node(self)
         self.trial.observed_nodes.append(self)
         self.trial.unobserved_nodes.remove(self)
         if self.trial.sequence:
             self.trial.sequence.increment_count(self.label)
             if not self.root == self:
-                self.trial.sequence.observed_node_values[
-                    self.trial.node_level_map[self.label]
-                ].append(self.value)
+                self.trial.sequence.add_observed_value(
+                    self.trial.node_level_map[self.label], self.value
+                )
 
     def is_root(self):
         if self.parent is self.root:
@@ -818,14 +1235,10 @@ class Node:
         return 0
 
     def get_ancestor_nodes(self):
-        if self.label == 0:
-            return []
-        ancestor_list = []
-        node = self.parent
-        while node.label != 0:
-            ancestor_list.append(node)
-            node = node.parent
-        return ancestor_list
+        node_map = self.trial.node_map
+        return [
+            node_map[label] for label in self.trial.template.ancestor_labels[self.label]
+        ]
 
     def term_feature(self):
         if self.root == self:
@@ -869,7 +1282,8 @@ class Node:
         return max(ancestor_list)
 
     def get_observed_ancestor_count(self):
-        return len(self.get_observed_ancestor_node_values())
+        trial = self.trial
+        return popcount(trial.observed_bits & trial.template.ancestor_bits[self.label])
 
     def is_leaf_and_positive_ancestor(self):
         if not self.is_leaf():
@@ -889,18 +1303,10 @@ class Node:
         return len(unobserved_nodes)
 
     def get_successor_nodes(self):
-        def get_successors(node):
-            node_list = []
-            children = node.children
-            if not children:
-                return []
-            for child in children:
-                node_list.append(child)
-                successors = get_successors(child)
-                node_list += successors
-            return node_list
-
-        return get_successors(self)
+        node_map = self.trial.node_map
+        return [
+            node_map[label] for label in self.trial.template.successor_labels[self.label]
+        ]
 
     def get_successor_node_values(self):
         successor_list = self.get_successor_nodes()
@@ -926,7 +1332,8 @@ class Node:
         return max(successor_list)
 
     def get_observed_successor_count(self):
-        return len(self.get_observed_successor_node_values())
+        trial = self.trial
+        return popcount(trial.observed_bits & trial.template.successor_bits[self.label])
 
     def sq_successor_count(self):
         return self.get_observed_successor_count() ** 2
@@ -940,8 +1347,8 @@ class Node:
         return children_list
 
     def get_immediate_successor_count(self):
-        immediate_successors = self.get_immediate_successors()
-        return len(immediate_successors)
+        trial = self.trial
+        return popcount(trial.observed_bits & trial.template.children_bits[self.label])
 
     def get_max_immediate_successor(self):
         immediate_successors = self.get_immediate_successors()
@@ -951,12 +1358,10 @@ class Node:
         return max(node_value_list)
 
     def get_sibling_nodes(self):
-        if not self.parent:
-            return []
-        if self.parent:
-            node_list = self.parent.children.copy()
-            node_list.remove(self)
-            return node_list
+        node_map = self.trial.node_map
+        return [
+            node_map[label] for label in self.trial.template.sibling_labels[self.label]
+        ]
 
     def get_observed_siblings(self):
         sibling_nodes = self.get_sibling_nodes()
@@ -966,7 +1371,8 @@ class Node:
             return [node for node in sibling_nodes if node.observed]
 
     def get_observed_siblings_count(self):
-        return len(self.get_observed_siblings())
+        trial = self.trial
+        return popcount(trial.observed_bits & trial.template.sibling_bits[self.label])
 
     def get_observed_same_depth_nodes(self):
         nodes_at_depth = self.trial.level_map[self.trial.node_level_map[self.label]]
@@ -977,7 +1383,8 @@ class Node:
         return node_list
 
     def get_observed_same_depth_count(self):
-        return len(self.get_observed_same_depth_nodes())
+        trial = self.trial
+        return popcount(trial.observed_bits & trial.template.level_bits[self.label])
 
     def is_parent_observed(self):
         if self.parent.observed:
@@ -986,49 +1393,36 @@ class Node:
             return 0
 
     def is_previous_successor(self):
-        if self.trial.previous_observed:
-            if self.trial.previous_observed in self.get_successor_nodes():
+        previous_node = self.trial.previous_observed
+        if previous_node:
+            if self.trial.template.successor_bits[self.label] >> previous_node.label & 1:
                 return 1
         return 0
 
     def is_previous_observed_successor_negative(self):
         previous_node = self.trial.previous_observed
         if previous_node:
-            successors = self.get_successor_nodes()
-            if previous_node.value < 0 and previous_node in successors:
+            successor_bits = self.trial.template.successor_bits[self.label]
+            if previous_node.value < 0 and successor_bits >> previous_node.label & 1:
                 return 1
         return 0
 
     def get_trial_level_std(self):
         trial = self.trial
-        observed_level_values = trial.sequence.observed_node_values[
-            trial.node_level_map[self.label]
-        ]
-        if len(observed_level_values) != 0:
-            return np.std(observed_level_values)
-        else:
-            return 0
+        return trial.sequence.get_level_std(trial.node_level_map[self.label])
 
     def get_seq_click_count(self):
         return self.trial.sequence.get_click_count(self.label)
 
     def get_level_count(self):
         trial = self.trial
-        nodes_at_same_level = trial.level_map[trial.node_level_map[self.label]]
-        level_count = sum([node.get_seq_click_count() for node in nodes_at_same_level])
-        return level_count
+        level_labels = trial.template.level_labels[trial.node_level_map[self.label]]
+        return int(trial.sequence.node_click_count[level_labels].sum())
 
     def get_branch_count(self):
-        trial = self.trial
-        branches = trial.reverse_branch_map[self.label]
-        branch_counts = []
-        for branch in branches:
-            node_list = trial.branch_map[branch]
-            branch_sum = sum(
-                [trial.node_map[node].get_seq_click_count() for node in node_list]
-            )
-            branch_counts.append(branch_sum)
-        return max(branch_counts)
+        template = self.trial.template
+        path_nodes = template.path_nodes[template.node_paths[self.label]]
+        return int(self.trial.sequence.node_click_count[path_nodes].sum(axis=1).max())
 
     def count_observed_node_branch(self):
         """What is the minimum of the number of observed nodes
@@ -1082,13 +1476,12 @@ class Node:
             return np.std([node.value for node in node_list])
 
     def calculate_best_expected_value(self):
-        expected_path_values = self.trial.get_path_expected_values()
+        expected_path_values = self.trial.expected_path_values
         node_paths = self.trial.reverse_branch_map[self.label]
         return max([expected_path_values[path] for path in node_paths])
 
     def calculate_max_expected_return(self):
-        expected_path_values = self.trial.get_path_expected_values()
-        return max(expected_path_values.values())
+        return self.trial.get_path_value_summary()[0]
 
     def best_largest_value_observed(self):
         largest_values = self.trial.largest_value_observed()
@@ -1102,8 +1495,7 @@ class Node:
         return 0
 
     def soft_satisficing(self):
-        expected_path_values = self.trial.get_path_expected_values()
-        max_expected_value = -max(list(expected_path_values.values()))
+        max_expected_value = -self.trial.get_path_value_summary()[0]
         return max_expected_value
 
     def get_parent_value(self):
@@ -1126,25 +1518,20 @@ class Node:
         return 0
 
     def on_most_promising_path(self):
-        expected_path_values = self.trial.get_path_expected_values()
         node_paths = self.trial.reverse_branch_map[self.label]
-        best_paths = [
-            k
-            for k, v in expected_path_values.items()
-            if v == max(expected_path_values.values())
-        ]
+        best_paths = self.trial.get_path_value_summary()[2]
         for node_path in node_paths:
             if node_path in best_paths:
                 return 1
         return 0
 
     def on_second_promising_path(self):
-        expected_path_values = self.trial.get_path_expected_values()
+        expected_path_values = self.trial.expected_path_values
         node_paths = self.trial.reverse_branch_map[self.label]
-        sorted_values = sorted(set(expected_path_values.values()), reverse=True)
+        second_value = self.trial.get_path_value_summary()[1]
         for node_path in node_paths:
-            if len(sorted_values) > 1:
-                if expected_path_values[node_path] == sorted_values[1]:
+            if second_value is not None:
+                if expected_path_values[node_path] == second_value:
                     return 1
         return 0
 
@@ -1250,7 +1637,7 @@ class Node:
         return 1
 
     def list_all_features(self):
-        lis = list(self.feature_function_map.keys())
+        lis = list(self.feature_registry.keys())
         lis.remove("first_observed")
         lis.remove("immediate_termination")
         max_value = self.trial.get_max_dist_value()
@@ -1272,7 +1659,7 @@ class Node:
                 and feature[:2] != "hs"
                 and feature != "num_clicks_adaptive"
             ):
-                evaluated_features.append(self.feature_function_map[feature]())
+                evaluated_features.append(self.feature_registry[feature](self))
             elif feature[:2] == "hp":
                 evaluated_features.append(self.hard_pruning(float(feature[3:])))
             elif feature[:2] == "hs":
@@ -1284,13 +1671,13 @@ class Node:
                             self.calculate_max_expected_return()
                             - adaptive_satisficing["a"]
                             + adaptive_satisficing["b"]
-                            * self.feature_function_map[feature]()
+                            * self.feature_registry[feature](self)
                         )
                         evaluated_features.append(
                             self.hard_satisficing(aspiration_level)
                         )
                     else:
-                        evaluated_features.append(self.feature_function_map[feature]())
+                        evaluated_features.append(self.feature_registry[feature](self))
         return evaluated_features
 
     def compute_termination_feature_values(self, features, adaptive_satisficing={}):
@@ -1325,17 +1712,17 @@ class Node:
                 # if we're not in a terminal state
                 if not (self == self.root):
                     # if the feature is only for terminal states, put the value to -1
-                    if feature in self.termination_map.keys():
+                    if feature in self.termination_registry:
                         # TODO why isn't this 0?
                         evaluated_features.append(-1)
                     # otherwise, evaluate from feature map
                     else:
-                        evaluated_features.append(self.feature_function_map[feature]())
+                        evaluated_features.append(self.feature_registry[feature](self))
                 # if we're in a terminal state
                 else:
                     # evaluate from termination map
-                    if feature in self.termination_map.keys():
-                        evaluated_features.append(self.termination_map[feature]())
+                    if feature in self.termination_registry:
+                        evaluated_features.append(self.termination_registry[feature](self))
                     else:
                         evaluated_features.append(0)
             # if hard pruned, pass through that function (same terminal logic)
@@ -1355,7 +1742,7 @@ class Node:
             elif feature == "soft_satisficing":
                 # TODO it seems this feature could just be in the first if (?)
                 if not self == self.root:
-                    evaluated_features.append(self.feature_function_map[feature]())
+                    evaluated_features.append(self.feature_registry[feature](self))
                 else:
                     evaluated_features.append(0)
             elif feature == "num_clicks_adaptive":
@@ -1368,7 +1755,7 @@ class Node:
                             - adaptive_satisficing["a"]
                             + (
                                 adaptive_satisficing["b"]
-                                * self.feature_function_map[feature]()
+                                * self.feature_registry[feature](self)
                             )
                         )
                         evaluated_features.append(-1 * as_value)
@@ -1377,5 +1764,5 @@ class Node:
                 else:
                     evaluated_features.append(0)
             elif feature in features_regardless_terminal:
-                evaluated_features.append(self.feature_function_map[feature]())
+                evaluated_features.append(self.feature_registry[feature](self))
         return evaluated_features
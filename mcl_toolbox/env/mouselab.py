@@ -1,4 +1,5 @@
 import random
+from functools import partial
 
 import gym
 import numpy as np
@@ -7,7 +8,8 @@ from gym import spaces
 from mouselab.envs.registry import registry
 from toolz import get, memoize
 
-from mcl_toolbox.utils.distributions import (PointMass, cmax, expectation,
+from mcl_toolbox.utils.distributions import (PointMass, categorical_max, cmax,
+                                             distribution_key, expectation,
                                              sample, smax)
 from mcl_toolbox.utils.graph_utils import (annotate_mdp_graph,
                                            graph_from_adjacency_list)
@@ -433,14 +435,59 @@ class MouselabEnv(gym.Env):
         return dot
 
     def to_obs_tree(self, state, node, obs=(), sort=True):
-        maybe_sort = sorted if sort else lambda x: x
+        """
+        Tree of (subjective reward, children) tuples below the node. With
+        sort, the children are in a canonical order (see distribution_key),
+        so that trees that only differ in the order of their subtrees share
+        the entries of the cache of exact_node_value_after_observe.
+        """
 
         def rec(n):
             subjective_reward = state[n] if n in obs else expectation(state[n])
-            children = tuple(maybe_sort(rec(c) for c in self.tree[n]))
-            return (subjective_reward, children)
+            children = [rec(c) for c in self.tree[n]]
+            if sort:
+                children.sort(key=lambda child: child[0])
+            key = (
+                distribution_key(subjective_reward),
+                tuple(child_key for child_key, _ in children),
+            )
+            return key, (subjective_reward, tuple(child for _, child in children))
+
+        return rec(node)[1]
+
 
-        return rec(node)
+def get_click_reward(depth, cost_weight=1, depth_weight=0):
+    """Reward of a click at a depth, cost_weight + depth * depth_weight"""
+    return -(1 * cost_weight + depth * depth_weight)
+
+
+def depth_click_cost(
+    node, last_action=None, graph=None, cost_weight=1, depth_weight=0
+):
+    """Cost function of a MouselabEnv with the click reward of get_click_reward"""
+    return get_click_reward(graph.nodes[node]["depth"], cost_weight, depth_weight)
+
+
+def get_cost_weights(cost):
+    """
+    (cost_weight, depth_weight) of the cost of a GenericMouselabEnv, a scalar
+    or a [cost_weight, depth_weight] list
+    """
+    if isinstance(cost, list):
+        cost_weight, depth_weight = cost
+        return cost_weight, depth_weight
+    return cost, 0
+
+
+def get_click_cost(cost):
+    """
+    MouselabEnv cost function of the cost of a GenericMouselabEnv, which can
+    be pickled
+    """
+    cost_weight, depth_weight = get_cost_weights(cost)
+    return partial(
+        depth_click_cost, cost_weight=cost_weight, depth_weight=depth_weight
+    )
 
 
 @lru_cache(SMALL_CACHE_SIZE)
@@ -459,3 +506,12 @@ def exact_node_value_after_observe(obs_tree):
     """
     children = tuple(exact_node_value_after_observe(c) + c[0] for c in obs_tree[1])
     return cmax(children, default=ZERO)
+
+
+def get_cache_info():
+    """Statistics of the caches of the distributions of node values"""
+    return {
+        "exact_node_value_after_observe": exact_node_value_after_observe.cache_info(),
+        "node_value_after_observe": node_value_after_observe.cache_info(),
+        "categorical_max": categorical_max.cache_info(),
+    }
@@ -0,0 +1,284 @@
+from functools import lru_cache
+
+import numpy as np
+
+from mcl_toolbox.utils.distributions import get_moments
+
+"""
+Structure shared by all the trials with the same tree.
+A TreeTemplate holds the topology of a tree (parents, depths, levels, paths and
+the relations between nodes) and a DepthSummary the per-depth summaries of a
+reward function. Both are immutable and cached, so that the trials of a
+sequence with a repeated branching only store their node values and
+observations. The dicts and arrays of a template are shared between trials
+and must not be modified.
+"""
+
+
+def approx_max(dist, position=0):
+    if hasattr(dist, "mu"):
+        if position == 0:
+            return dist.mu + 2 * dist.sigma
+        else:
+            return dist.mu + dist.sigma
+    else:
+        if position == 0:
+            return max(dist.vals)
+        else:
+            return sorted(dist.vals)[-(position + 1)]
+
+
+def approx_min(dist, position=0):
+    if hasattr(dist, "mu"):
+        if position == 0:
+            return dist.mu - 2 * dist.sigma
+        else:
+            return dist.mu - dist.sigma
+    return sorted(dist.vals)[position]
+
+
+def construct_structure_map(branching):
+    """
+    Construct the structure map from which the trial representation will be created.
+    Assumes symmetric structure.
+
+    Returns:
+            dict -- Keys are node numbers and parents are values.
+    """
+    structure_map = {0: None}
+    branching_len = len(branching)
+    curr_index = 1
+
+    def construct_map(curr_parent, branching_index):
+        if branching_index == branching_len:
+            return
+        nonlocal curr_index, structure_map
+        for _ in range(branching[branching_index]):
+            present_node = curr_index
+            structure_map[curr_index] = curr_parent
+            curr_index += 1
+            construct_map(present_node, branching_index + 1)
+
+    construct_map(0, 0)
+    return structure_map
+
+
+class TreeTemplate:
+    """
+    Topology of a tree given by a structure map (node number -> parent number).
+
+    Attributes:
+        children: child labels of each node, in order of creation
+        node_level_map: depth of each non-root node
+        level_labels: labels of the nodes at each depth (1 to max_depth)
+        branch_map: labels on each path (path numbers start at 1), root first
+        reverse_branch_map: path numbers passing through each node
+        parents, depths: parent (root is -1) and depth of each node
+        path_nodes: (num_paths x max_depth + 1) labels on each path
+        path_matrix: (num_paths x num_nodes) path membership matrix
+        successor_matrix: [i, j] is True if j lies below i in the tree
+        ancestor_matrix: [i, j] is True if j is a (non-root) ancestor of i
+        children_matrix, sibling_matrix: direct children and siblings
+        successor_labels, ancestor_labels, sibling_labels: labels of the
+            relatives of each node, in the order Node returns them
+        successor_bits, ancestor_bits, children_bits, sibling_bits, level_bits:
+            the same relations as bitmasks (bit i set for node i)
+    """
+
+    def __init__(self, structure_map):
+        self.structure_map = structure_map
+        self.num_nodes = len(structure_map)
+        self.children = {node_num: [] for node_num in structure_map}
+        for node_num, parent in structure_map.items():
+            if parent is not None:
+                self.children[parent].append(node_num)
+        self.construct_levels()
+        self.construct_branch_maps()
+        self.construct_arrays()
+        self.construct_relations()
+
+    def construct_levels(self):
+        self.node_level_map = {}
+        depths = {0: 0}
+
+        def construct_node_maps(node_num, current_level):
+            for child in self.children[node_num]:
+                depths[child] = current_level + 1
+            for child in self.children[node_num]:
+                construct_node_maps(child, current_level + 1)
+
+        construct_node_maps(0, 0)
+        self.max_depth = max(depths.values())
+        self.level_labels = {d: [] for d in range(1, self.max_depth + 1)}
+
+        def construct_level_labels(node_num):
+            for child in self.children[node_num]:
+                self.level_labels[depths[child]].append(child)
+                self.node_level_map[child] = depths[child]
+            for child in self.children[node_num]:
+                construct_level_labels(child)
+
+        construct_level_labels(0)
+        self.depths = np.array([depths[node_num] for node_num in range(self.num_nodes)])
+
+    def construct_branch_maps(self):
+        self.branch_map = {}
+        self.reverse_branch_map = {}
+        path_num = 1
+
+        def get_tree_path(node_num, present_path):
+            nonlocal path_num
+            present_path.append(node_num)
+            if not self.children[node_num]:
+                self.branch_map[path_num] = tuple(present_path)
+                for path_node in present_path:
+                    self.reverse_branch_map.setdefault(path_node, []).append(
+                        path_num
+                    )
+                path_num += 1
+            else:
+                for child in self.children[node_num]:
+                    get_tree_path(child, present_path[:])
+
+        get_tree_path(0, [])
+
+    def construct_arrays(self):
+        num_nodes = self.num_nodes
+        self.parents = np.array(
+            [
+                -1 if self.structure_map[node_num] is None
+                else self.structure_map[node_num]
+                for node_num in range(num_nodes)
+            ]
+        )
+        self.is_leaf_mask = np.array(
+            [not self.children[node_num] for node_num in range(num_nodes)]
+        )
+        num_paths = len(self.branch_map)
+        self.path_nodes = np.array(
+            [self.branch_map[path_num] for path_num in range(1, num_paths + 1)]
+        )
+        self.path_matrix = np.zeros((num_paths, num_nodes), dtype=bool)
+        for path_index, path in enumerate(self.path_nodes):
+            self.path_matrix[path_index, path] = True
+        self.node_paths = [
+            np.flatnonzero(self.path_matrix[:, node_num])
+            for node_num in range(num_nodes)
+        ]
+        self.successor_matrix = np.zeros((num_nodes, num_nodes), dtype=bool)
+        for node_num in range(1, num_nodes):
+            parent = self.parents[node_num]
+            while parent != -1:
+                self.successor_matrix[parent, node_num] = True
+                parent = self.parents[parent]
+        # The root is not counted as an ancestor by the node features
+        self.ancestor_matrix = self.successor_matrix.T.copy()
+        self.ancestor_matrix[:, 0] = False
+        self.children_matrix = self.parents[None, :] == np.arange(num_nodes)[:, None]
+        self.sibling_matrix = (self.parents[None, :] == self.parents[:, None]) & ~np.eye(
+            num_nodes, dtype=bool
+        )
+        self.sibling_matrix[0] = False
+        self.sibling_matrix[:, 0] = False
+        for array in [
+            self.depths,
+            self.parents,
+            self.is_leaf_mask,
+            self.path_nodes,
+            self.path_matrix,
+            self.successor_matrix,
+            self.ancestor_matrix,
+            self.children_matrix,
+            self.sibling_matrix,
+        ] + self.node_paths:
+            array.flags.writeable = False
+
+    def construct_relations(self):
+        def get_successors(node_num):
+            successors = []
+            for child in self.children[node_num]:
+                successors.append(child)
+                successors += get_successors(child)
+            return successors
+
+        self.successor_labels = {}
+        self.ancestor_labels = {}
+        self.sibling_labels = {}
+        for node_num, parent in self.structure_map.items():
+            self.successor_labels[node_num] = tuple(get_successors(node_num))
+            ancestors = []
+            while parent:
+                ancestors.append(parent)
+                parent = self.structure_map[parent]
+            self.ancestor_labels[node_num] = tuple(ancestors)
+            parent = self.structure_map[node_num]
+            self.sibling_labels[node_num] = (
+                ()
+                if parent is None
+                else tuple(child for child in self.children[parent] if child != node_num)
+            )
+        self.successor_bits = to_bits(self.successor_labels)
+        self.ancestor_bits = to_bits(self.ancestor_labels)
+        self.children_bits = to_bits(self.children)
+        self.sibling_bits = to_bits(self.sibling_labels)
+        level_bits = to_bits(self.level_labels)
+        self.level_bits = {
+            node_num: level_bits.get(depth, 1 << node_num)
+            for node_num, depth in enumerate(self.depths.tolist())
+        }
+
+
+def to_bits(relations):
+    """Bitmask of the labels related to each key"""
+    return {
+        key: sum(1 << label for label in labels) for key, labels in relations.items()
+    }
+
+
+def popcount(bits):
+    # int.bit_count needs Python 3.10
+    return bin(bits).count("1")
+
+
+class DepthSummary:
+    """Expected value, approximate maximum and minimum, variance and standard
+    deviation of the reward distribution at each depth"""
+
+    def __init__(self, reward_function, max_depth):
+        depths = range(1, max_depth + 1)
+        distributions = {d: reward_function(d) for d in depths}
+        expected_values, variances, stds = get_moments(distributions.values())
+        self.expected_values = dict(zip(depths, expected_values.tolist()))
+        self.max_values_by_depth = {d: approx_max(distributions[d]) for d in depths}
+        self.min_values_by_depth = {d: approx_min(distributions[d]) for d in depths}
+        self.variance_by_depth = dict(zip(depths, variances.tolist()))
+        self.uncertainty_by_depth = dict(zip(depths, stds.tolist()))
+
+
+@lru_cache(maxsize=None)
+def get_tree_template(branching):
+    """Template of the symmetric tree with the given branching (tuple)"""
+    return TreeTemplate(construct_structure_map(branching))
+
+
+@lru_cache(maxsize=128)
+def get_depth_summary(reward_function, max_depth):
+    return DepthSummary(reward_function, max_depth)
+
+
+def get_trial_depth_summary(reward_function, max_depth):
+    """DepthSummary of a reward function, cached if the function is hashable"""
+    try:
+        return get_depth_summary(reward_function, max_depth)
+    except TypeError:  # the reward function is not hashable
+        return get_depth_summary.__wrapped__(reward_function, max_depth)
+
+
+def get_expected_node_values(reward_function, template):
+    """Expected value of each node of the tree (the root is 0)"""
+    expected_values = get_trial_depth_summary(
+        reward_function, template.max_depth
+    ).expected_values
+    return np.array(
+        [0.0] + [expected_values[depth] for depth in template.depths[1:].tolist()]
+    )
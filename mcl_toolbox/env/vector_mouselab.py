@@ -0,0 +1,635 @@
+import numpy as np
+
+from mcl_toolbox.env.array_mouselab import state_cached
+from mcl_toolbox.env.feature_plan import (
+    FEATURES_REGARDLESS_TERMINAL,
+    get_cached_feature_plan,
+)
+from mcl_toolbox.env.ground_truth import sample_pipeline_ground_truths
+from mcl_toolbox.env.modified_mouselab import Node, reward_val
+from mcl_toolbox.env.tree_template import get_tree_template, get_trial_depth_summary
+
+"""
+Lockstep version of GenericMouselabEnv that runs many simulations at once.
+The trial sequences of all the environments are stored as batched arrays
+(num_envs x num_trials x num_nodes) and a step takes one action per
+environment. The feature states of all the environments are computed
+together with NumPy operations on the batch and match the ones of
+GenericMouselabEnv (up to floating point rounding of the standard deviations).
+All the trials of the pipeline must have the same branching.
+"""
+
+
+def masked_std(values, mask, axis=-1):
+    """Standard deviation of the values where mask is True, 0 if there are none"""
+    counts = np.count_nonzero(mask, axis=axis)
+    safe_counts = np.maximum(counts, 1)
+    means = np.where(mask, values, 0).sum(axis=axis) / safe_counts
+    deviations = np.where(mask, values - np.expand_dims(means, axis), 0)
+    stds = np.sqrt((deviations**2).sum(axis=axis) / safe_counts)
+    return np.where(counts > 0, stds, 0)
+
+
+# Batched versions of the feature columns in feature_plan.COLUMN_FUNCTIONS.
+# Each function returns the values of the feature for all the nodes of the
+# present trial of every environment (num_envs x num_nodes), the root
+# entries are ignored.
+BATCH_COLUMN_FUNCTIONS = {
+    "siblings_count": lambda env: env.count_observed(env.sibling_counts),
+    "depth_count": lambda env: env.count_observed(env.same_depth_counts),
+    "ancestor_count": lambda env: env.count_observed(env.ancestor_counts),
+    "successor_count": lambda env: env.count_observed(env.successor_counts),
+    "sq_successor_count": lambda env: env.count_observed(env.successor_counts) ** 2,
+    "is_leaf": lambda env: env.is_leaf_mask,
+    "depth": lambda env: env.depths,
+    "max_successor": lambda env: env.max_observed(env.successor_matrix),
+    "parent_value": lambda env: env.get_parent_values(),
+    "max_immediate_successor": lambda env: env.max_observed(env.children_matrix),
+    "immediate_successor_count": lambda env: env.count_observed(env.children_counts),
+    "previous_observed_successor": lambda env: env.get_previous_successor_mask(),
+    "is_successor_highest": lambda env: env.get_successor_highest_mask(),
+    "parent_observed": lambda env: env.observed[:, env.parents],
+    "observed_height": lambda env: env.get_observed_heights(),
+    "is_pos_ancestor_leaf": lambda env: env.get_leaf_positive_ancestor_mask(),
+    "is_root": lambda env: env.parents == 0,
+    "is_previous_successor_negative": lambda env: (
+        env.get_previous_successor_mask() & (env.get_previous_values() < 0)[:, None]
+    ),
+    "uncertainty": lambda env: env.get_uncertainties(),
+    "best_expected": lambda env: env.max_over_node_paths(env.get_path_expected_values()),
+    "best_largest": lambda env: env.max_over_node_paths(env.get_largest_observed_values()),
+    "max_uncertainty": lambda env: env.get_max_path_uncertainties(),
+    "most_promising": lambda env: env.get_most_promising_mask(),
+    "second_most_promising": lambda env: env.get_second_promising_mask(),
+    "click_count": lambda env: env.click_counts,
+    "level_count": lambda env: env.click_counts @ env.same_depth_counts.T,
+    "branch_count": lambda env: env.max_over_node_paths(
+        env.click_counts[:, env.path_nodes].sum(axis=2)
+    ),
+    "soft_pruning": lambda env: env.get_soft_pruning_values(),
+    "count_observed_node_branch": lambda env: env.min_over_node_paths(
+        env.observed[:, env.path_nodes].sum(axis=2)
+    ),
+    "get_level_observed_std": lambda env: env.get_level_observed_stds(),
+    "successor_uncertainty": lambda env: env.get_successor_uncertainties(),
+    "num_clicks_adaptive": lambda env: 0,
+    "num_clicks": lambda env: env.get_num_clicks()[:, None],
+    "max_expected_return": lambda env: env.get_max_expected_returns()[:, None],
+    "trial_level_std": lambda env: env.get_trial_level_stds(),
+    "soft_satisficing": lambda env: -env.get_max_expected_returns()[:, None],
+    "constant": lambda env: 1,
+    "planning": lambda env: 1,
+    "termination_constant": lambda env: 1,
+    "value": lambda env: np.where(env.observed, env.get_values(), 0),
+    "is_observed": lambda env: env.observed,
+    "return_if_terminating": lambda env: env.get_max_expected_returns()[:, None] * 0,
+}
+
+
+def hard_pruning_column(threshold):
+    def hard_pruning(env):
+        return np.where(env.get_soft_pruning_values() <= threshold, -1, 0)
+
+    return hard_pruning
+
+
+def hard_satisficing_root(threshold):
+    def hard_satisficing(env):
+        return np.where(env.get_max_expected_returns() >= threshold, 0, -1)
+
+    return hard_satisficing
+
+
+def constant_column(value):
+    def constant(env):
+        return value
+
+    return constant
+
+
+# Batched versions of the features of the root (Node.termination_registry),
+# one value per environment
+BATCH_ROOT_FUNCTIONS = {
+    "is_max_path_observed": lambda env: np.where(
+        (env.get_max_observed_mask() & env.get_path_observed_mask()).any(axis=1), 0, -1
+    ),
+    "are_max_paths_observed": lambda env: np.where(
+        env.get_leaves_observed()
+        | (env.get_max_observed_mask() & ~env.get_path_observed_mask()).any(axis=1),
+        -1,
+        0,
+    ),
+    "is_previous_max": lambda env: np.where(
+        (env.previous >= 0)
+        & (env.get_previous_values() >= env.get_max_dist_values()),
+        0,
+        -1,
+    ),
+    "is_positive_observed": lambda env: np.where(
+        (env.observed & (env.get_values() > 0)).any(axis=1), 0, -1
+    ),
+    "all_roots_observed": lambda env: np.where(
+        env.observed[:, env.depths == 1].all(axis=1), 0, -1
+    ),
+    "all_leaf_nodes_observed": lambda env: np.where(env.get_leaves_observed(), 0, -1),
+    "immediate_termination": lambda env: np.where(env.previous >= 0, 0, -1),
+    "first_observed": lambda env: np.where(env.previous >= 0, 0, -1),
+    "positive_root_leaves_termination": lambda env: env.get_positive_root_leaves(),
+    "single_path_completion": lambda env: env.get_single_path_completion(),
+    "max_expected_return": lambda env: env.get_max_expected_returns(),
+    "constant": lambda env: 1,
+    "num_clicks": lambda env: env.get_num_clicks(),
+    "return_if_terminating": lambda env: env.get_max_expected_returns() * 1,
+}
+
+
+class VectorMouselabEnv:
+    """
+    Runs num_envs copies of a Mouselab-MDP trial sequence in lockstep.
+    The environments either share the ground truth (the simulations of a
+    participant) or each have their own (the scoring of a strategy).
+    """
+
+    def __init__(
+        self,
+        num_envs,
+        num_trials=1,
+        pipeline=[([3, 1, 2], reward_val)],
+        ground_truth=None,
+        cost=1,
+        shared_ground_truth=True,
+    ):
+        """
+        :param num_envs: number of environments stepped together
+        :param ground_truth: node values of each trial. If the ground truth is
+                             shared, a single sequence of trials, otherwise
+                             one sequence per environment. Sampled from the
+                             pipeline if None.
+        :param shared_ground_truth: whether all environments have the same
+                                    ground truth
+        """
+        self.num_envs = num_envs
+        self.num_trials = num_trials
+        self.pipeline = pipeline
+        self.shared_ground_truth = shared_ground_truth
+        if isinstance(cost, list):
+            cost_weight, depth_weight = cost
+            self.cost = lambda depth: -(1 * cost_weight + depth * depth_weight)
+            self.repeat_cost = -float("inf")
+        else:  # should be a scalar
+            self.cost = lambda depth: -(1 * cost)
+            self.repeat_cost = -cost * 10
+        branchings = {tuple(pipeline[trial_num][0]) for trial_num in range(num_trials)}
+        if len(branchings) != 1:
+            raise ValueError(
+                "All the trials of a VectorMouselabEnv must have the same branching"
+            )
+        self.construct_tree(get_tree_template(branchings.pop()))
+        self.construct_ground_truth(ground_truth)
+        self.construct_reward_arrays()
+        self.features = None
+        self.normalized_features = None
+        self.feature_plan = None
+        self.reset()
+
+    @classmethod
+    def from_env(cls, env, num_envs):
+        """
+        Lockstep copies of a GenericMouselabEnv with its pipeline and click
+        costs. The copies share the ground truth of the env, unless the env
+        samples a new one at every reset.
+        """
+        if env.feedback in ["action", "meta"]:
+            raise ValueError(
+                f"VectorMouselabEnv doesn't support {env.feedback} feedback"
+            )
+        shared_ground_truth = env.reset_mode != "resample"
+        vector_env = cls(
+            num_envs,
+            num_trials=env.num_trials,
+            pipeline=env.pipeline,
+            ground_truth=env.ground_truth if shared_ground_truth else None,
+            shared_ground_truth=shared_ground_truth,
+        )
+        vector_env.cost = env.cost
+        vector_env.repeat_cost = env.repeat_cost
+        return vector_env
+
+    def construct_tree(self, template):
+        self.template = template
+        self.num_nodes = template.num_nodes
+        self.max_depth = template.max_depth
+        self.depths = template.depths
+        self.parents = template.parents
+        self.is_leaf_mask = template.is_leaf_mask
+        self.path_nodes = template.path_nodes
+        self.path_matrix = template.path_matrix
+        self.successor_matrix = template.successor_matrix
+        self.ancestor_matrix = template.ancestor_matrix
+        self.children_matrix = template.children_matrix
+        self.sibling_matrix = template.sibling_matrix
+        # Ancestors including the root, used by Node.check_path_observed
+        self.path_to_root_matrix = template.successor_matrix.T
+        self.level_matrix = self.depths[:, None] == self.depths[None, :]
+        # Relation matrices as integers, to count the observed nodes by a product
+        self.successor_counts = self.successor_matrix.astype(int)
+        self.ancestor_counts = self.ancestor_matrix.astype(int)
+        self.children_counts = self.children_matrix.astype(int)
+        self.sibling_counts = self.sibling_matrix.astype(int)
+        self.same_depth_counts = self.level_matrix.astype(int)
+        self.first_level = np.where(
+            self.depths == 1, np.arange(self.num_nodes), 0
+        )
+        for node_num in range(1, self.num_nodes):
+            if self.depths[node_num] > 1:
+                self.first_level[node_num] = self.first_level[self.parents[node_num]]
+
+    def construct_ground_truth(self, ground_truth):
+        shape = (self.num_trials, self.num_nodes)
+        if self.shared_ground_truth:
+            if not ground_truth:
+                ground_truth = sample_pipeline_ground_truths(
+                    self.pipeline[: self.num_trials]
+                )
+            self.ground_truth = ground_truth
+            values = np.array(ground_truth, dtype=float).reshape(shape)
+            values[:, 0] = 0.0
+            values.flags.writeable = False
+            self.values = np.broadcast_to(values, (self.num_envs,) + shape)
+        else:
+            if not ground_truth:
+                # The trials of all the environments are drawn in one batch,
+                # the same values as one sequence of trials per environment
+                trials = sample_pipeline_ground_truths(
+                    list(self.pipeline[: self.num_trials]) * self.num_envs
+                )
+                ground_truth = [
+                    trials[env_num * self.num_trials : (env_num + 1) * self.num_trials]
+                    for env_num in range(self.num_envs)
+                ]
+            if len(ground_truth) != self.num_envs:
+                raise ValueError(
+                    "The ground truth must contain one sequence of trials "
+                    "per environment"
+                )
+            self.ground_truth = ground_truth
+            self.values = np.array(ground_truth, dtype=float).reshape(
+                (self.num_envs,) + shape
+            )
+            self.values[:, :, 0] = 0.0
+
+    def construct_reward_arrays(self):
+        shape = (self.num_trials, self.num_nodes)
+        self.expected_values = np.zeros(shape)
+        self.variances = np.zeros(shape)
+        self.uncertainties = np.zeros(shape)
+        self.max_dist_values = np.zeros(self.num_trials)
+        depths = self.depths[1:]
+        for trial_num in range(self.num_trials):
+            reward_function = self.pipeline[trial_num][1]
+            summary = get_trial_depth_summary(reward_function, self.max_depth)
+            for node_num, depth in enumerate(depths, start=1):
+                self.expected_values[trial_num, node_num] = summary.expected_values[
+                    depth
+                ]
+                self.variances[trial_num, node_num] = summary.variance_by_depth[depth]
+                self.uncertainties[trial_num, node_num] = summary.uncertainty_by_depth[
+                    depth
+                ]
+            self.max_dist_values[trial_num] = max(summary.max_values_by_depth.values())
+
+    def reset(self):
+        """Starts the first trial of all the environments, keeping the ground truth"""
+        num_envs = self.num_envs
+        self.trial_nums = np.zeros(num_envs, dtype=int)
+        self.active = np.ones(num_envs, dtype=bool)
+        self.observed = np.zeros((num_envs, self.num_nodes), dtype=bool)
+        self.previous = np.full(num_envs, -1)
+        self.click_counts = np.zeros((num_envs, self.num_nodes), dtype=int)
+        self.observed_history = np.zeros(
+            (num_envs, self.num_trials, self.num_nodes), dtype=bool
+        )
+        self.state_cache = {}
+        return self.get_observation()
+
+    def attach_features(self, features, normalized_features=None):
+        """Compiles the features computed for the observations, raises a
+        ValueError if a feature has no batched implementation.
+        The features can also be given as a FeaturePlan, in which case the
+        normalization of the plan is used."""
+        feature_plan = get_cached_feature_plan(features, normalized_features)
+        features = feature_plan.features
+        termination_features = Node.termination_registry
+        column_functions = []
+        root_functions = []
+        for feature in features:
+            if feature[:2] == "hp":
+                column_function = hard_pruning_column(float(feature[3:]))
+                root_function = constant_column(0)
+            elif feature[:2] == "hs":
+                column_function = constant_column(-1)
+                root_function = hard_satisficing_root(float(feature[3:]))
+            elif feature == "soft_satisficing":
+                column_function = BATCH_COLUMN_FUNCTIONS[feature]
+                root_function = constant_column(0)
+            elif feature in FEATURES_REGARDLESS_TERMINAL:
+                column_function = BATCH_COLUMN_FUNCTIONS[feature]
+                root_function = BATCH_ROOT_FUNCTIONS[feature]
+            elif feature in termination_features:
+                column_function = constant_column(-1)
+                root_function = BATCH_ROOT_FUNCTIONS.get(feature)
+            else:
+                column_function = BATCH_COLUMN_FUNCTIONS.get(feature)
+                root_function = constant_column(0)
+            if column_function is None or root_function is None:
+                raise ValueError(
+                    f"Feature {feature} is not supported by VectorMouselabEnv"
+                )
+            column_functions.append(column_function)
+            root_functions.append(root_function)
+        self.features = features
+        self.normalized_features = feature_plan.normalized_features
+        self.feature_plan = feature_plan
+        self.column_functions = column_functions
+        self.root_functions = root_functions
+
+    def get_feature_state(self):
+        """Feature values of all the nodes of the present trial of every
+        environment (num_envs x num_nodes x num_features)"""
+        if self.features is None:
+            raise ValueError("Features need to be attached with attach_features method.")
+        feature_state = np.zeros((self.num_envs, self.num_nodes, len(self.features)))
+        for index, (column_function, root_function) in enumerate(
+            zip(self.column_functions, self.root_functions)
+        ):
+            column = column_function(self)
+            if isinstance(column, np.ndarray) and column.shape[-1] == self.num_nodes:
+                column = column[..., 1:]
+            feature_state[:, 1:, index] = column
+            feature_state[:, 0, index] = root_function(self)
+        return self.feature_plan.normalize(feature_state)
+
+    def get_state(self):
+        """Values of the nodes of the present trials, NaN if unobserved"""
+        state = np.where(self.observed, self.get_values(), np.nan)
+        state[:, 0] = 0
+        return state
+
+    def get_observation(self):
+        if self.features is not None:
+            return self.get_feature_state()
+        return self.get_state()
+
+    def get_available_actions(self):
+        """Mask of the actions that are available in each environment"""
+        available_actions = ~self.observed
+        available_actions[:, 0] = True
+        available_actions[~self.active] = False
+        return available_actions
+
+    def step(self, actions):
+        """
+        Takes one action in every environment. The environments whose trial
+        terminates start their next trial, the environments that completed
+        all their trials ignore the actions.
+
+        Returns:
+            The observations, the rewards, the mask of the environments whose
+            trial terminated and an info dict with the trial of each action,
+            the paths taken by the terminated trials (-1 otherwise) and their
+            max expected return at termination (NaN otherwise)
+        """
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise ValueError(f"Expected {self.num_envs} actions, got {actions.shape}")
+        envs = np.arange(self.num_envs)
+        trial_nums = self.trial_nums.copy()
+        rewards = np.zeros(self.num_envs)
+        repeated = self.active & (actions != 0) & self.observed[envs, actions]
+        clicks = self.active & (actions != 0) & ~repeated
+        done = self.active & (actions == 0)
+        rewards[repeated] = self.repeat_cost
+        click_envs = envs[clicks]
+        click_actions = actions[clicks]
+        rewards[clicks] = [self.cost(depth) for depth in self.depths[click_actions]]
+        taken_paths = np.full((self.num_envs, self.max_depth + 1), -1)
+        termination_mers = np.full(self.num_envs, np.nan)
+        if done.any():
+            termination_mers[done] = self.get_max_expected_returns()[done]
+            done_envs = envs[done]
+            taken_paths[done_envs] = self.choose_best_observed_paths(done_envs)
+            values = self.get_values()[done_envs]
+            for depth in range(self.max_depth + 1):
+                rewards[done_envs] += values[
+                    np.arange(len(done_envs)), taken_paths[done_envs, depth]
+                ]
+        self.observed[click_envs, click_actions] = True
+        self.observed_history[click_envs, trial_nums[click_envs], click_actions] = True
+        self.previous[click_envs] = click_actions
+        self.click_counts[click_envs, click_actions] += 1
+        self.start_next_trials(done)
+        info = {
+            "trial_nums": trial_nums,
+            "taken_paths": taken_paths,
+            "termination_mers": termination_mers,
+        }
+        return self.get_observation(), rewards, done, info
+
+    def choose_best_observed_paths(self, envs):
+        """Path with the largest sum of observed values in each of the given
+        environments, ties are broken at random (Trial.get_best_expected_path)"""
+        observed_values = np.where(self.observed, self.get_values(), 0)[envs]
+        path_values = observed_values[:, self.path_nodes[:, 0]]
+        for depth in range(1, self.max_depth + 1):
+            path_values = path_values + observed_values[:, self.path_nodes[:, depth]]
+        best_paths = path_values == path_values.max(axis=1, keepdims=True)
+        tie_breaks = np.where(best_paths, np.random.random(best_paths.shape), -1)
+        return self.path_nodes[tie_breaks.argmax(axis=1)]
+
+    def start_next_trials(self, done):
+        self.trial_nums[done] += 1
+        self.observed[done] = False
+        self.previous[done] = -1
+        self.active &= self.trial_nums < self.num_trials
+        self.state_cache = {}
+
+    def get_present_trials(self):
+        return np.minimum(self.trial_nums, self.num_trials - 1)
+
+    @state_cached
+    def get_values(self):
+        return self.values[np.arange(self.num_envs), self.get_present_trials()]
+
+    @state_cached
+    def get_uncertainties(self):
+        return self.uncertainties[self.get_present_trials()]
+
+    @state_cached
+    def get_max_dist_values(self):
+        return self.max_dist_values[self.get_present_trials()]
+
+    def get_previous_values(self):
+        previous_values = self.get_values()[
+            np.arange(self.num_envs), np.maximum(self.previous, 0)
+        ]
+        return np.where(self.previous >= 0, previous_values, 0)
+
+    def get_num_clicks(self):
+        return np.count_nonzero(self.observed, axis=1)
+
+    def count_observed(self, relation_counts):
+        """Number of observed nodes in each row of the relation matrix"""
+        return self.observed.astype(int) @ relation_counts.T
+
+    def max_observed(self, relation_matrix):
+        """Largest observed value in each row of the relation matrix, 0 if none"""
+        related = relation_matrix[None, :, :] & self.observed[:, None, :]
+        related_values = np.where(related, self.get_values()[:, None, :], -np.inf).max(
+            axis=2
+        )
+        related_values[np.isinf(related_values)] = 0
+        return related_values
+
+    def max_over_node_paths(self, path_values):
+        """Maximum of the given path values over the paths through each node"""
+        return np.where(self.path_matrix, path_values[:, :, None], -np.inf).max(axis=1)
+
+    def min_over_node_paths(self, path_values):
+        """Minimum of the given path values over the paths through each node"""
+        return np.where(self.path_matrix, path_values[:, :, None], np.inf).min(axis=1)
+
+    def get_parent_values(self):
+        parents = self.parents
+        expected_values = self.expected_values[self.get_present_trials()]
+        return np.where(
+            self.observed[:, parents],
+            self.get_values()[:, parents],
+            expected_values[:, parents],
+        )
+
+    def get_previous_successor_mask(self):
+        previous_mask = self.successor_matrix[:, np.maximum(self.previous, 0)].T
+        return previous_mask & (self.previous >= 0)[:, None]
+
+    def get_successor_highest_mask(self):
+        highest = self.observed & (
+            self.get_values() >= self.get_max_dist_values()[:, None]
+        )
+        return ~self.is_leaf_mask & (highest @ self.successor_counts.T > 0)
+
+    def get_leaf_positive_ancestor_mask(self):
+        positive = self.observed & (self.get_values() > 0)
+        return self.is_leaf_mask & (positive @ self.ancestor_counts.T > 0)
+
+    def get_observed_heights(self):
+        observed_children = (
+            self.children_matrix[None, :, :] & self.observed[:, None, :]
+        )
+        heights = np.zeros((self.num_envs, self.num_nodes), dtype=int)
+        for _ in range(self.max_depth):
+            heights = np.where(observed_children, heights[:, None, :] + 1, 0).max(
+                axis=2
+            )
+        return heights
+
+    @state_cached
+    def get_path_expected_values(self):
+        """Expected value of each path (num_envs x num_paths), summed in path order"""
+        expected_values = self.expected_values[self.get_present_trials()]
+        node_values = np.where(self.observed, self.get_values(), expected_values)
+        path_values = node_values[:, self.path_nodes[:, 0]]
+        for depth in range(1, self.max_depth + 1):
+            path_values = path_values + node_values[:, self.path_nodes[:, depth]]
+        return path_values
+
+    @state_cached
+    def get_max_expected_returns(self):
+        return self.get_path_expected_values().max(axis=1)
+
+    def get_largest_observed_values(self):
+        observed_values = np.where(self.observed, self.get_values(), -9999)
+        max_path_values = observed_values[:, self.path_nodes].max(axis=2)
+        max_path_values[max_path_values == -9999] = 0
+        return max_path_values
+
+    def get_most_promising_mask(self):
+        path_values = self.get_path_expected_values()
+        best_paths = path_values == self.get_max_expected_returns()[:, None]
+        return best_paths.astype(int) @ self.path_matrix.astype(int) > 0
+
+    def get_second_promising_mask(self):
+        path_values = self.get_path_expected_values()
+        best_values = self.get_max_expected_returns()[:, None]
+        second_values = np.where(path_values < best_values, path_values, -np.inf).max(
+            axis=1, keepdims=True
+        )
+        second_paths = (path_values == second_values) & ~np.isinf(second_values)
+        return second_paths.astype(int) @ self.path_matrix.astype(int) > 0
+
+    @state_cached
+    def get_soft_pruning_values(self):
+        observed_values = np.where(self.observed, self.get_values(), np.inf)
+        node_losses = self.min_over_node_paths(
+            observed_values[:, self.path_nodes].min(axis=2)
+        )
+        node_losses[np.isinf(node_losses)] = 0
+        return node_losses
+
+    def get_max_path_uncertainties(self):
+        variances = np.where(
+            self.observed, 0, self.variances[self.get_present_trials()]
+        )[:, self.path_nodes]
+        total_uncertainty = variances[:, :, 0]
+        for depth in range(1, self.max_depth + 1):
+            total_uncertainty = total_uncertainty + variances[:, :, depth]
+        return np.sqrt(self.max_over_node_paths(total_uncertainty))
+
+    def get_successor_uncertainties(self):
+        uncertainties = np.where(self.observed, 0, self.get_uncertainties())
+        return uncertainties @ self.successor_matrix.T.astype(float)
+
+    def get_level_observed_stds(self):
+        level_stds = np.zeros((self.num_envs, self.max_depth + 1))
+        values = self.get_values()
+        for depth in range(1, self.max_depth + 1):
+            level_mask = self.observed & (self.depths == depth)
+            level_stds[:, depth] = masked_std(values, level_mask)
+        return level_stds[:, self.depths]
+
+    def get_trial_level_stds(self):
+        """Standard deviation of the values observed at each depth in all the
+        trials of the sequence so far"""
+        level_stds = np.zeros((self.num_envs, self.max_depth + 1))
+        values = self.values.reshape(self.num_envs, -1)
+        observed = self.observed_history.reshape(self.num_envs, -1)
+        depths = np.tile(self.depths, self.num_trials)
+        for depth in range(1, self.max_depth + 1):
+            level_stds[:, depth] = masked_std(values, observed & (depths == depth))
+        return level_stds[:, self.depths]
+
+    def get_leaves_observed(self):
+        return self.observed[:, self.depths == self.max_depth].all(axis=1)
+
+    def get_max_observed_mask(self):
+        return self.observed & (
+            self.get_values() >= self.get_max_dist_values()[:, None]
+        )
+
+    def get_path_observed_mask(self):
+        """Whether each node and all the nodes above it, including the root,
+        are observed (Node.check_path_observed)"""
+        unobserved_above = (~self.observed).astype(int) @ self.successor_counts
+        return self.observed & (unobserved_above == 0)
+
+    def get_positive_root_leaves(self):
+        leaves = self.depths == self.max_depth
+        positive_roots = self.observed & (self.get_values() > 0) & (self.depths == 1)
+        leaf_roots = positive_roots[:, self.first_level[leaves]]
+        unobserved_leaves = (leaf_roots & ~self.observed[:, leaves]).any(axis=1)
+        return np.where(~positive_roots.any(axis=1) | unobserved_leaves, -1, 0)
+
+    def get_single_path_completion(self):
+        leaves = self.depths == self.max_depth
+        unobserved_ancestors = (~self.observed).astype(int) @ self.ancestor_counts.T
+        complete_paths = self.observed & (unobserved_ancestors == 0) & leaves
+        return np.where(complete_paths.any(axis=1), 0, -1)
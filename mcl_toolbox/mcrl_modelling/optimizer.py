@@ -283,6 +283,8 @@ class ParameterOptimizer:
         self.env = env
         self.pipeline = self.env.pipeline
         self.compute_likelihood = False
+        # Whether the simulations are run at once (see Learner.run_multiple_simulations)
+        self.lockstep = False
         if self.learner in ["sdss"]:
             self.model = models[self.learner_attributes["learner"]]
         elif self.learner in ["hierarchical_learner"]:
@@ -326,6 +328,7 @@ class ParameterOptimizer:
             self.num_simulations,
             participant=ParticipantIterator(self.participant),
             compute_likelihood=self.compute_likelihood,
+            lockstep=self.lockstep,
         )
         relevant_data = get_relevant_data(simulations_data, self.objective)
         if self.objective in [
@@ -357,7 +360,7 @@ class ParameterOptimizer:
 
     def optimize(self, objective, num_simulations=1, optimizer="pyabc",
                  db_path="sqlite:///test.db", compute_likelihood=False,
-                 max_evals=100):
+                 max_evals=100, lockstep=False):
         """
         This function first gets the relevant participant data,
         creates a lambda function as required by fmin function
@@ -377,6 +380,8 @@ class ParameterOptimizer:
             db_path:
             compute_likelihood:
             max_evals:
+            lockstep: run the simulations of each evaluation at once in a
+                VectorMouselabEnv, for the learners that support it
 
         Returns: res: results
 
@@ -384,6 +389,7 @@ class ParameterOptimizer:
         self.objective = objective
         self.compute_likelihood = compute_likelihood
         self.num_simulations = num_simulations
+        self.lockstep = lockstep
         self.optimizer = optimizer
         prior = self.get_prior()
         p_data = construct_p_data(self.participant, self.pipeline)
@@ -402,23 +408,26 @@ class ParameterOptimizer:
         return res, prior, self.objective_fn
 
     def run_model(self, params, objective, num_simulations=1, optimizer="pyabc",
-                  db_path="sqlite:///test.db"):
+                  db_path="sqlite:///test.db", lockstep=False):
         self.objective = objective
         self.num_simulations = num_simulations
+        self.lockstep = lockstep
         p_data = construct_p_data(self.participant, self.pipeline)
         data = self.objective_fn(params)
         return data, p_data
 
-    def run_hp_model(self, params, objective, num_simulations=1):
+    def run_hp_model(self, params, objective, num_simulations=1, lockstep=False):
         self.objective = objective
         self.num_simulations = num_simulations
+        self.lockstep = lockstep
         p_data = construct_p_data(self.participant, self.pipeline)
         data = self.objective_fn(params, get_sim_data=True)
         return data, p_data
 
-    def run_hp_model_nop(self, params, objective, num_simulations=1):
+    def run_hp_model_nop(self, params, objective, num_simulations=1, lockstep=False):
         self.objective = objective
         self.num_simulations = num_simulations
+        self.lockstep = lockstep
         # p_data = construct_p_data(self.participant, self.pipeline)
         p_data = {"mer": []}
         data = self.objective_fn(params, get_sim_data=True)
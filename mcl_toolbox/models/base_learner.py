@@ -3,10 +3,22 @@ from collections import defaultdict
 
 import numpy as np
 
-from mcl_toolbox.env.modified_mouselab import get_termination_mers
+from mcl_toolbox.env.feature_plan import get_cached_feature_plan
+from mcl_toolbox.env.vector_mouselab import VectorMouselabEnv
 from mcl_toolbox.utils.learning_utils import get_normalized_feature_values
 
 
+def get_feature_plan(attributes):
+    """The FeaturePlan of the learner attributes, compiled from the features
+    if the attributes don't have one"""
+    feature_plan = attributes.get("feature_plan")
+    if feature_plan is None:
+        feature_plan = get_cached_feature_plan(
+            attributes["features"], attributes["normalized_features"]
+        )
+    return feature_plan
+
+
 class Learner(ABC):
     """Base class of RL models implemented for the Mouselab-MDP paradigm."""
 
@@ -24,6 +36,7 @@ class Learner(ABC):
         self.features = attributes["features"]
         self.num_features = len(self.features)
         self.normalized_features = attributes["normalized_features"]
+        self.feature_plan = get_feature_plan(attributes)
         self.use_pseudo_rewards = attributes["use_pseudo_rewards"]
         self.is_null = attributes["is_null"]
         self.path_learn = False
@@ -46,9 +59,7 @@ class Learner(ABC):
         """Get features of the termination action"""
         pres_node_map = env.present_trial.node_map
         term_features = get_normalized_feature_values(
-            pres_node_map[0].compute_termination_feature_values(
-                self.features, adaptive_satisficing={}
-            ),
+            self.feature_plan.compute_node_values(pres_node_map[0]),
             self.features,
             self.normalized_features,
         )
@@ -101,15 +112,38 @@ class Learner(ABC):
             pr = self.pr_weight * (mer - comp_value)
         return pr
 
+    def simulate_lockstep(self, env):
+        """Simulates the learner in all the environments of a VectorMouselabEnv
+        at once, returns the data of each simulation like run_multiple_simulations"""
+        raise ValueError(f"{type(self).__name__} doesn't support lockstep simulations")
+
     def run_multiple_simulations(
-        self, env, num_simulations, compute_likelihood=False, participant=None
+        self,
+        env,
+        num_simulations,
+        compute_likelihood=False,
+        participant=None,
+        lockstep=False,
     ):
-        env.attach_features(self.features, self.normalized_features)
-        env.reset()
+        """
+        Simulates the learner num_simulations times in the env. With lockstep,
+        the simulations are run at once in a VectorMouselabEnv copy of the env
+        (see simulate_lockstep).
+        """
         if compute_likelihood and not participant:
             raise ValueError(
                 "Likelihood can only be computed for a participant's actions"
             )
+        if lockstep:
+            if compute_likelihood:
+                raise ValueError(
+                    "Likelihood can't be computed in lockstep simulations"
+                )
+            vector_env = VectorMouselabEnv.from_env(env, num_simulations)
+            vector_env.attach_features(self.feature_plan)
+            return self.simulate_lockstep(vector_env)
+        env.attach_features(self.feature_plan)
+        env.reset()
         simulations_data = defaultdict(list)
         for _ in range(num_simulations):
             trials_data = self.simulate(
@@ -118,11 +152,10 @@ class Learner(ABC):
             for param in ["r", "w", "a", "loss", "decision_params", "s", "info"]:
                 if param in trials_data:
                     simulations_data[param].append(trials_data[param])
-        total_m_mers = []
-        for i in range(len(simulations_data["a"])):
-            m_mers = get_termination_mers(
-                env.ground_truth, simulations_data["a"][i], env.pipeline
-            )
-            total_m_mers.append(m_mers)
-        simulations_data["mer"] = total_m_mers
+            if "a" in trials_data:
+                simulations_data["mer"].append(
+                    env.get_termination_mers(trials_data["a"])
+                )
+        if "mer" not in simulations_data:
+            simulations_data["mer"] = []
         return simulations_data
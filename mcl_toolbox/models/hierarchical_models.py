@@ -4,7 +4,7 @@ import numpy as np
 import scipy as sp
 
 from mcl_toolbox.global_vars import hierarchical_params
-from mcl_toolbox.models.base_learner import Learner
+from mcl_toolbox.models.base_learner import Learner, get_feature_plan
 from mcl_toolbox.utils.learning_utils import (get_log_norm_cdf,
                                               get_log_norm_pdf, rows_mean,
                                               temp_sigmoid)
@@ -21,6 +21,7 @@ class HierarchicalAgent:
         self.params = params
         self.decision_rule = attributes["decision_rule"]
         self.features = attributes["features"]
+        self.feature_plan = get_feature_plan(attributes)
         self.max_payoff = 0
         self.avg_payoff = 0
         self.history = []
@@ -58,7 +59,7 @@ class HierarchicalAgent:
         decision_rule = self.decision_rule
         decision_params = self.params
         tau = self.tau
-        if len(env.get_available_actions()) == 1:
+        if len(env.get_available_action_array()) == 1:
             return 1.0
         if decision_rule == "threshold":
             max_return = env.present_trial.get_max_dist_value()
@@ -75,7 +76,7 @@ class HierarchicalAgent:
                 max_expected_return - np.exp(decision_params["theta"]) * avg_payoff, tau
             )
         elif decision_rule == "adaptive_satisficing":
-            num_clicks = env.num_actions - len(env.get_available_actions())
+            num_clicks = env.num_actions - len(env.get_available_action_array())
             p_stop = temp_sigmoid(
                 max_expected_return
                 - np.exp(decision_params["a"])
@@ -84,9 +85,9 @@ class HierarchicalAgent:
             )
         elif decision_rule == "feature":
             # Add adaptive satisficing
-            normalized_feature_values = env.present_trial.node_map[
-                0
-            ].compute_termination_feature_values(self.features, adaptive_satisficing={})
+            normalized_feature_values = self.feature_plan.compute_node_values(
+                env.present_trial.node_map[0]
+            )
             termination_feature_values = [
                 normalized_feature_values[i] for i in self.termination_features
             ]
@@ -191,6 +192,7 @@ class HierarchicalLearner(Learner):
         self.features = attributes["features"]
         self.num_features = len(self.features)
         self.normalized_features = attributes["normalized_features"]
+        self.feature_plan = get_feature_plan(attributes)
         self.no_term = attributes["no_term"]
         self.decision_agent = HierarchicalAgent(params, attributes)
         self.actor_agent = self.actor(params, attributes)
@@ -207,13 +209,13 @@ class HierarchicalLearner(Learner):
         self.actor_agent.init_model_params()
         self.decision_agent.init_model_params()
         env.reset()
-        self.actor_agent.num_actions = len(env.get_available_actions())
+        self.actor_agent.num_actions = len(env.get_available_action_array())
         for trial_num in range(num_trials):
             self.actor_agent.update_rewards = []
             self.actor_agent.update_features = []
             self.actor_agent.term_rewards = []
             self.actor_agent.previous_best_paths = []
-            self.actor_agent.num_actions = len(env.get_available_actions())
+            self.actor_agent.num_actions = len(env.get_available_action_array())
             actions = []
             rewards = []
             trials_data["w"].append(self.actor_agent.get_current_weights())
@@ -249,7 +249,7 @@ class LVOC(Learner):
             get_log_norm_cdf.cache_clear()
         for trial_num in range(num_trials):
             self.previous_best_paths = []
-            self.num_actions = len(env.get_available_actions())
+            self.num_actions = len(env.get_available_action_array())
             trials_data["w"].append(self.get_current_weights())
             self.update_rewards, self.update_features = [], []
             actions, rewards, self.term_rewards = [], [], []
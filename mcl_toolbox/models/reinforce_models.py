@@ -60,6 +60,34 @@ class ValuePolicy(nn.Module):
         return res
 
 
+class LockstepAdam:
+    """
+    Adam optimizer of the weights of many agents, the default algorithm of
+    torch.optim.Adam applied to each row of the weights separately
+    """
+
+    def __init__(self, shape, lr, betas=(0.9, 0.999), eps=1e-8):
+        self.lr = lr
+        self.betas = betas
+        self.eps = eps
+        self.exp_avg = np.zeros(shape)
+        self.exp_avg_sq = np.zeros(shape)
+        self.steps = np.zeros(shape[0], dtype=int)
+
+    def step(self, params, grads, rows):
+        """Updates the given rows of the params with their gradients"""
+        beta1, beta2 = self.betas
+        self.steps[rows] += 1
+        steps = self.steps[rows][:, None]
+        exp_avg = self.exp_avg[rows] + (grads - self.exp_avg[rows]) * (1 - beta1)
+        exp_avg_sq = self.exp_avg_sq[rows] * beta2 + (1 - beta2) * grads * grads
+        self.exp_avg[rows] = exp_avg
+        self.exp_avg_sq[rows] = exp_avg_sq
+        step_size = self.lr / (1 - beta1 ** steps)
+        denom = np.sqrt(exp_avg_sq) / np.sqrt(1 - beta2 ** steps) + self.eps
+        params[rows] -= step_size * exp_avg / denom
+
+
 class REINFORCE(Learner):
     """Base class of the REINFORCE model"""
 
@@ -270,6 +298,133 @@ class REINFORCE(Learner):
             trials_data["loss"] = None
         return dict(trials_data)
 
+    def get_lockstep_action_probs(self, env, weights):
+        """
+        Action probabilities of the policy in each environment of a
+        VectorMouselabEnv (num_envs x num_nodes), 0 in the environments that
+        completed their trials, and the features through which the action
+        scores depend on the weights
+        """
+        features = env.get_feature_state().copy()
+        scores = self.beta * np.einsum("enf,ef->en", features, weights)
+        replaced = np.zeros(env.num_envs, dtype=bool)
+        if self.termination_value_known:
+            # Like in Policy.forward, a termination reward of 0 isn't used
+            term_rewards = env.get_max_expected_returns()
+            replaced = term_rewards != 0
+            scores[replaced, 0] = self.beta * term_rewards[replaced]
+        if self.no_term:
+            replaced[:] = True
+            scores[:, 0] = -np.inf
+        features[replaced, 0] = 0
+        available = env.get_available_actions()
+        active = available.any(axis=1)
+        scores = np.where(available, scores, -np.inf)[active]
+        exp_scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        probs = np.zeros(available.shape)
+        probs[active] = exp_scores / exp_scores.sum(axis=1, keepdims=True)
+        return probs, features
+
+    def sample_lockstep_actions(self, probs):
+        """Samples an action from each row of the action probabilities"""
+        cdf = probs.cumsum(axis=1)
+        uniforms = np.random.random(len(probs)) * cdf[:, -1]
+        return (cdf > uniforms[:, None]).argmax(axis=1)
+
+    def get_lockstep_returns(self, rewards, pseudo_rewards):
+        """Discounted returns of a trial, as in get_end_episode_returns"""
+        returns = []
+        R = 0
+        for r, pr in zip(rewards[::-1], pseudo_rewards[::-1]):
+            R = (r + pr) + self.gamma * R
+            returns.insert(0, R)
+        # finish_episode converts the returns to a single precision tensor
+        return np.array(returns, dtype=np.float32).astype(float)
+
+    def simulate_lockstep(self, env):
+        """
+        Simulates an agent in each environment of a VectorMouselabEnv at once.
+        The weights of each agent are updated as in finish_episode at the end
+        of every trial, with NumPy gradients of the softmax policy and an Adam
+        optimizer per agent. Unlike in simulate, the state of the optimizer is
+        not carried over from one simulation to the next. Path learning isn't
+        supported.
+        """
+        if self.path_learn:
+            raise ValueError("Path learning isn't supported in lockstep simulations")
+        num_envs = env.num_envs
+        env.reset()
+        init_weights = np.array(self.init_weights * self.beta, dtype=float)
+        weights = np.tile(init_weights, (num_envs, 1))
+        optimizer = LockstepAdam(weights.shape, self.lr)
+        simulations_data = defaultdict(list)
+        simulations_data["r"] = [[] for _ in range(num_envs)]
+        simulations_data["w"] = [
+            [init_weights.tolist() + [self.beta]] for _ in range(num_envs)
+        ]
+        simulations_data["a"] = [[] for _ in range(num_envs)]
+        simulations_data["loss"] = [None] * num_envs
+        simulations_data["mer"] = [[] for _ in range(num_envs)]
+        # Actions, rewards, gradients of the log probabilities of the actions
+        # and pseudo rewards of the present trial of each agent
+        trials_data = [defaultdict(list) for _ in range(num_envs)]
+        env_nums = np.arange(num_envs)
+        while env.active.any():
+            active = env.active.copy()
+            probs, features = self.get_lockstep_action_probs(env, weights)
+            actions = np.where(active, self.sample_lockstep_actions(probs), 0)
+            log_prob_grads = self.beta * (
+                features[env_nums, actions] - np.einsum("en,enf->ef", probs, features)
+            )
+            if self.use_pseudo_rewards:
+                path_values = env.get_path_expected_values()
+                best_paths = path_values == path_values.max(axis=1, keepdims=True)
+            _, rewards, done, info = env.step(actions)
+            pseudo_rewards = np.zeros(num_envs)
+            if self.use_pseudo_rewards:
+                # The clicks don't change the trial, the termination actions
+                # don't change the path values
+                path_values = env.get_path_expected_values()
+                comp_values = np.where(best_paths, path_values, -np.inf).max(axis=1)
+                pseudo_rewards = np.where(
+                    done, 0, self.pr_weight * (path_values.max(axis=1) - comp_values)
+                )
+            for env_num in np.flatnonzero(active):
+                trial_data = trials_data[env_num]
+                trial_data["a"].append(int(actions[env_num]))
+                trial_data["r"].append(rewards[env_num])
+                trial_data["grads"].append(log_prob_grads[env_num])
+                trial_data["pr"].append(pseudo_rewards[env_num])
+                if done[env_num]:
+                    trial_data["learning_r"].append(rewards[env_num])
+                else:
+                    trial_data["learning_r"].append(
+                        rewards[env_num] - self.subjective_cost
+                    )
+            done_envs = np.flatnonzero(done)
+            if len(done_envs) == 0:
+                continue
+            grads = np.zeros((len(done_envs), weights.shape[1]))
+            for index, env_num in enumerate(done_envs):
+                trial_data = trials_data[env_num]
+                returns = self.get_lockstep_returns(
+                    trial_data["learning_r"], trial_data["pr"]
+                )
+                grads[index] = -returns @ np.array(trial_data["grads"])
+                simulations_data["r"][env_num].append(np.sum(trial_data["r"]))
+                simulations_data["a"][env_num].append(trial_data["a"])
+                simulations_data["mer"][env_num].append(
+                    info["termination_mers"][env_num]
+                )
+                trials_data[env_num] = defaultdict(list)
+            if not self.is_null:
+                optimizer.step(weights, grads, done_envs)
+            for env_num in done_envs[env.active[done_envs]]:
+                simulations_data["w"][env_num].append(
+                    weights[env_num].tolist() + [self.beta]
+                )
+        return simulations_data
+
 
 class BaselineREINFORCE(REINFORCE):
     """Baseline version of the REINFORCE model"""
@@ -285,6 +440,9 @@ class BaselineREINFORCE(REINFORCE):
             self.value_policy.parameters(), lr=self.value_lr
         )
 
+    # The value baseline isn't implemented in lockstep simulations
+    simulate_lockstep = Learner.simulate_lockstep
+
     def get_action_details(self, env):
         """Generates action probabilities in the current state.
 
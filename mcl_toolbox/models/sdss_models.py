@@ -63,9 +63,11 @@ class SDSS(Learner):
 
     def get_learner_details(self, env, strategy_num):
         """Select the best action and store the action features"""
-        env.reset_trial()
+        # The trial is fresh unless it has been clicked since get_next_trial
+        if env.observed_action_list or env.present_trial.observed_nodes:
+            env.reset_trial()
         learner = self.learners[strategy_num]
-        learner.num_actions = len(env.get_available_actions())
+        learner.num_actions = len(env.get_available_action_array())
         learner.update_features = []
         learner.update_rewards = []
         learner.term_rewards = []
@@ -83,13 +85,17 @@ class SDSS(Learner):
         strategy_weights = self.learners[strategy_num].get_weights()
         env.reset_trial()
         trial = env.present_trial
-        env.reset_trial()
+        token = trial.snapshot()
         actions = get_clicks(
-            trial, self.features, strategy_weights, self.normalized_features
+            trial,
+            self.features,
+            strategy_weights,
+            self.normalized_features,
+            reset=False,
         )
+        trial.restore(token)
         f_list = []
         r_list = []
-        env.reset_trial()
         for action in actions:
             f = env.get_feature_state(self.features, self.normalized_features)[action]
             _, r, _, _ = env.step(action)
@@ -1,15 +1,25 @@
 import itertools as it
+import pickle
 from collections import Counter
 from functools import lru_cache, total_ordering
+from pathlib import Path
 
 import numpy as np
-import scipy.stats
 from toolz import reduce
 
 LARGE_CACHE_SIZE = int(2 ** 20)
 CACHE_SIZE = int(2 ** 14)
 SMALL_CACHE_SIZE = int(2 ** 16)
 
+# SciPy is imported by the functions that need it, so that the distributions
+# (and the discretized normals of the table below) can be used without it.
+
+# Discretized normal distributions by (mu, sigma, n, max_sigma), see
+# Normal.to_discrete. The table in data/ is loaded when it is first needed,
+# missing entries are computed and can be added with save_discrete_normals.
+DISCRETE_NORMALS_PATH = Path(__file__).parents[1].joinpath("data/discrete_normals.pkl")
+discrete_normals = None
+
 
 class Distribution(object):
     """Represents a probability distribution."""
@@ -24,6 +34,50 @@ class Distribution(object):
         raise NotImplementedError()
 
 
+def get_discrete_normals():
+    """Table of the discretized normal distributions, loaded on first use"""
+    global discrete_normals
+    if discrete_normals is None:
+        discrete_normals = {}
+        if DISCRETE_NORMALS_PATH.exists():
+            with open(DISCRETE_NORMALS_PATH, "rb") as f:
+                discrete_normals.update(pickle.load(f))
+            for arrays in discrete_normals.values():
+                for array in arrays:
+                    array.flags.writeable = False
+    return discrete_normals
+
+
+def discretize_normal(mu, sigma, n=10, max_sigma=2):
+    """
+    Values and probabilities of a normal distribution discretized into n
+    equally spaced values within max_sigma standard deviations of the mean,
+    each with the probability of the bin around it (the outer bins are open).
+    The arrays are shared through the table and must not be modified.
+    """
+    key = (float(mu), float(sigma), int(n), float(max_sigma))
+    table = get_discrete_normals()
+    if key not in table:
+        import scipy.stats
+
+        d = scipy.stats.norm(mu, sigma)
+        vals = np.linspace(-max_sigma * sigma + mu, max_sigma * sigma + mu, n)
+        delta = vals[1] - vals[0]
+        bins = np.array((-np.inf, *(vals[1:] - delta / 2), np.inf))
+        probs = np.diff(d.cdf(bins))
+        for array in (vals, probs):
+            array.flags.writeable = False
+        table[key] = (vals, probs)
+    return table[key]
+
+
+def save_discrete_normals(file_path=DISCRETE_NORMALS_PATH):
+    """Saves the discretized normals of the table, including the ones computed
+    since it was loaded"""
+    with open(file_path, "wb") as f:
+        pickle.dump(dict(get_discrete_normals()), f)
+
+
 class Normal(Distribution):
     """Normal distribution."""
 
@@ -52,13 +106,7 @@ class Normal(Distribution):
         return d
 
     def to_discrete(self, n=10, max_sigma=2):
-        d = scipy.stats.norm(self.mu, self.sigma)
-        vals = np.linspace(
-            -max_sigma * self.sigma + self.mu, max_sigma * self.sigma + self.mu, n
-        )
-        delta = vals[1] - vals[0]
-        bins = np.array((-np.inf, *(vals[1:] - delta / 2), np.inf))
-        probs = np.diff(d.cdf(bins))
+        vals, probs = discretize_normal(self.mu, self.sigma, n, max_sigma)
         return Categorical(vals, probs)
 
     def expectation(self):
@@ -84,6 +132,8 @@ class Normal(Distribution):
 
     @classmethod
     def fit(cls, samples):
+        import scipy.stats
+
         return cls(*scipy.stats.norm.fit(samples))
 
 
@@ -96,6 +146,8 @@ class NormalMixture(Distribution):
         self.sigma = np.array(sigma)
         self.weights = np.array(weights)
         self.n_mix = len(weights)
+        import scipy.stats
+
         self._z = scipy.stats.multinomial(1, weights)
         self._norm = scipy.stats.norm(mu, sigma)
 
@@ -126,12 +178,19 @@ class NormalMixture(Distribution):
 
     @classmethod
     def fit(cls, samples):
+        import scipy.stats
+
         return cls(*scipy.stats.norm.fit(samples))
 
 
 @total_ordering
 class Categorical(Distribution):
-    """Categorical distribution."""
+    """Categorical distribution.
+
+    The values and probabilities are kept as tuples, which define equality
+    and the hash. NumPy arrays of them, the CDF used for sampling and the
+    moments are computed once per distribution when first needed.
+    """
 
     def __init__(self, vals, probs=None):
         super().__init__()
@@ -142,14 +201,58 @@ class Categorical(Distribution):
             self.probs = tuple(probs)
 
         self._hash = hash((self.vals, self.probs))
+        self._arrays = None
+        self._cache = {}
+
+    def __getstate__(self):
+        # The arrays and moments are computed again after unpickling
+        state = self.__dict__.copy()
+        state.pop("_arrays", None)
+        state.pop("_cache", None)
+        return state
+
+    def __setstate__(self, state):
+        # Also restores distributions pickled before the arrays were cached
+        self.__dict__.update(state)
+        self._arrays = None
+        self._cache = {}
+
+    def get_arrays(self):
+        """Arrays of the values and probabilities and the normalized CDF"""
+        if self._arrays is None:
+            vals = np.array(self.vals)
+            probs = np.array(self.probs, dtype=float)
+            cdf = np.cumsum(probs)
+            # Same CDF as np.random.choice, so samples are drawn identically
+            cdf /= cdf[-1]
+            for array in (vals, probs, cdf):
+                array.flags.writeable = False
+            self._arrays = (vals, probs, cdf)
+        return self._arrays
+
+    @property
+    def val_array(self):
+        return self.get_arrays()[0]
+
+    @property
+    def prob_array(self):
+        return self.get_arrays()[1]
+
+    @property
+    def cdf(self):
+        return self.get_arrays()[2]
 
-    @lru_cache(None)
     def var(self):
-        return sum(v ** 2 * p for v, p in self) - self.expectation() ** 2
+        if "var" not in self._cache:
+            self._cache["var"] = (
+                sum(v ** 2 * p for v, p in self) - self.expectation() ** 2
+            )
+        return self._cache["var"]
 
-    @lru_cache(None)
     def std(self):
-        return self.var() ** 0.5
+        if "std" not in self._cache:
+            self._cache["std"] = self.var() ** 0.5
+        return self._cache["std"]
 
     def __lt__(self, other):
         # This is for sorting belief states.
@@ -198,18 +301,28 @@ class Categorical(Distribution):
         vals = tuple(f(v) for v in self.vals)
         return Categorical(vals, self.probs)
 
-    @lru_cache(LARGE_CACHE_SIZE)
     def expectation(self):
-        return sum(p * v for p, v in zip(self.probs, self.vals))
+        if "expectation" not in self._cache:
+            self._cache["expectation"] = sum(
+                p * v for p, v in zip(self.probs, self.vals)
+            )
+        return self._cache["expectation"]
 
     def sample(self, n=None):
-        vals = np.array(self.vals)  # for use in sample()
-        if n is not None:
-            i = np.random.choice(len(self.vals), p=self.probs, size=n)
-            return vals[i]
-        else:
-            i = np.random.choice(len(self.vals), p=self.probs)
-            return vals[i]
+        """
+        Draws like np.random.choice(vals, p=probs, size=n): one uniform per
+        sample from the global random state, looked up in the CDF
+        """
+        vals, probs, cdf = self.get_arrays()
+        if "valid" not in self._cache:
+            self._cache["valid"] = (
+                probs.ndim == 1
+                and (probs >= 0).all()
+                and abs(probs.sum() - 1) <= np.sqrt(np.finfo(float).eps)
+            )
+        if not self._cache["valid"]:
+            raise ValueError("The probabilities must be non-negative and sum to 1")
+        return vals[cdf.searchsorted(np.random.random_sample(n), side="right")]
 
 
 class PointMass(Categorical):
@@ -256,6 +369,8 @@ class Beta(ScipyDistribution):
     def __init__(self, alpha, beta):
         self.alpha = alpha
         self.beta = beta
+        import scipy.stats
+
         self._dist = scipy.stats.beta(alpha, beta)
 
     def __repr__(self):
@@ -348,10 +463,88 @@ def cross(dists, f=None):
     return Categorical(outcomes.keys(), outcomes.values())
 
 
+def get_moments(dists):
+    """
+    Expectations, variances and standard deviations of many distributions (or
+    constants) at once. The sums over the values of the categorical
+    distributions are accumulated in the order of Categorical.expectation and
+    Categorical.var.
+
+    Returns:
+        Three arrays with one entry per distribution
+    """
+    dists = list(dists)
+    expectations = np.zeros(len(dists))
+    variances = np.zeros(len(dists))
+    stds = np.zeros(len(dists))
+    categorical = []
+    for i, dist in enumerate(dists):
+        if isinstance(dist, PointMass):
+            expectations[i] = dist.vals[0]
+        elif hasattr(dist, "probs"):
+            categorical.append(i)
+        elif hasattr(dist, "sigma"):
+            expectations[i] = dist.mu
+            variances[i] = dist.var()
+            stds[i] = dist.sigma
+        elif hasattr(dist, "sample"):
+            raise ValueError(f"The moments of {type(dist).__name__} are not supported")
+        else:
+            expectations[i] = dist
+    if categorical:
+        # Padded with zeros, which don't change the cumulative sums
+        vals = np.zeros((len(categorical), max(len(dists[i]) for i in categorical)))
+        probs = np.zeros(vals.shape)
+        for row, i in enumerate(categorical):
+            vals[row, : len(dists[i])] = dists[i].val_array
+            probs[row, : len(dists[i])] = dists[i].prob_array
+        categorical_expectations = np.cumsum(probs * vals, axis=1)[:, -1]
+        categorical_variances = (
+            np.cumsum(vals ** 2 * probs, axis=1)[:, -1] - categorical_expectations ** 2
+        )
+        expectations[categorical] = categorical_expectations
+        variances[categorical] = categorical_variances
+        stds[categorical] = categorical_variances ** 0.5
+    return expectations, variances, stds
+
+
+def distribution_key(dist):
+    """Key that orders categorical distributions and constants canonically"""
+    if hasattr(dist, "probs"):
+        return (1, dist.vals, dist.probs)
+    return (0, (dist,), ())
+
+
+@lru_cache(CACHE_SIZE)
+def categorical_max(dists):
+    """
+    Distribution of the maximum of independent categorical distributions (or
+    constants), the same as cross(dists, max): the values are in the order in
+    which they first occur in the product of the supports and their
+    probabilities are summed in that order. The product is enumerated with
+    NumPy outer operations instead of a Python loop.
+    """
+    vals, probs = None, None
+    for dist in dists:
+        if hasattr(dist, "probs"):
+            dist_vals, dist_probs = dist.val_array, dist.prob_array
+        else:
+            dist_vals, dist_probs = np.array([dist]), np.ones(1)
+        if vals is None:
+            vals, probs = dist_vals, dist_probs
+        else:
+            vals = np.maximum.outer(vals, dist_vals).ravel()
+            probs = np.multiply.outer(probs, dist_probs).ravel()
+    support, first, inverse = np.unique(vals, return_index=True, return_inverse=True)
+    # bincount adds the probabilities one after the other like the Counter
+    max_probs = np.bincount(inverse.ravel(), weights=probs, minlength=len(support))
+    order = np.argsort(first, kind="stable")
+    return Categorical(support[order].tolist(), max_probs[order].tolist())
+
+
 __no_default__ = 25
 
 
-# @lru_cache(maxsize=None)
 def cmax(dists, default=__no_default__):
     dists = tuple(dists)
     if len(dists) == 1:
@@ -361,6 +554,8 @@ def cmax(dists, default=__no_default__):
             return default
         else:
             raise ValueError("dmax() arg is an empty sequence")
+    elif all(hasattr(dist, "probs") or not hasattr(dist, "sample") for dist in dists):
+        return categorical_max(dists)
     else:
         return cross(dists, max)
 
@@ -403,6 +598,8 @@ def smax(dists, default=__no_default__):
 
 
 def normal_approximation(dist, samples=10000):
+    import scipy.stats
+
     return Normal(scipy.stats.norm.fit(dist.sample(samples)))
 
 
@@ -1,5 +1,11 @@
+import os
+import tempfile
+
+import numpy as np
 from toolz import memoize
 
+from mcl_toolbox.utils.distributions import distribution_key, expectation
+
 
 def sort_tree(env, state):
     """Breaks symmetry between belief states.
@@ -31,8 +37,417 @@ def hash_tree(env, state):
     return rec(0)
 
 
-def solve(env, hash_state=None, actions=None, blinkered=None):
-    """Returns Q, V, pi, and computation data for an mdp environment."""
+class StateEncoder:
+    """
+    Canonical integer encoding of the belief states of a tree environment.
+    The code of a node is 0 while it is unobserved and 1 + the index of its
+    observed value in the support of its initial distribution otherwise. The
+    codes of a subtree are packed into one integer with mixed radices, with
+    the codes of children that have identical subtrees (same shape and
+    initial distributions) sorted, so that states that only differ by a
+    permutation of such subtrees are encoded identically.
+    """
+
+    def __init__(self, env):
+        self.term_state = env.term_state
+        tree = env.tree
+        self.outcome_codes = []
+        self.num_codes = []
+        for dist in env.init:
+            vals = dist.vals if hasattr(dist, "vals") else (dist,)
+            outcome_codes = {}
+            for val in vals:
+                outcome_codes.setdefault(val, len(outcome_codes) + 1)
+            self.outcome_codes.append(outcome_codes)
+            self.num_codes.append(len(outcome_codes) + 1)
+
+        # Children before their parents
+        order = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(tree[node])
+        order.reverse()
+
+        # Identical subtrees have the same signature. The children of a node
+        # are packed in groups of identical subtrees, sorted within a group.
+        signatures = [distribution_key(dist) for dist in env.init]
+        # Number of codes of each subtree, without and with the action subset
+        subtree_sizes = [0] * len(tree)
+        masked_subtree_sizes = [0] * len(tree)
+        self.packing = []
+        self.masked_packing = []
+        for node in order:
+            children = sorted(tree[node], key=lambda child: signatures[child])
+            signatures[node] = (
+                signatures[node],
+                tuple(signatures[child] for child in children),
+            )
+            groups = []
+            for child in children:
+                if groups and signatures[child] == signatures[groups[-1][0]]:
+                    groups[-1].append(child)
+                else:
+                    groups.append([child])
+            subtree_size = self.num_codes[node]
+            masked_subtree_size = 2 * self.num_codes[node]
+            for child in children:
+                subtree_size *= subtree_sizes[child]
+                masked_subtree_size *= masked_subtree_sizes[child]
+            subtree_sizes[node] = subtree_size
+            masked_subtree_sizes[node] = masked_subtree_size
+            if children:
+                self.packing.append(
+                    (
+                        node,
+                        self.num_codes[node],
+                        [(tuple(group), subtree_sizes[group[0]]) for group in groups],
+                    )
+                )
+                self.masked_packing.append(
+                    (
+                        node,
+                        2 * self.num_codes[node],
+                        [
+                            (tuple(group), masked_subtree_sizes[group[0]])
+                            for group in groups
+                        ],
+                    )
+                )
+        # Number of possible codes of a state
+        self.num_state_codes = subtree_sizes[0]
+
+    def encode(self, state, action_subset=None):
+        """
+        Integer code of a state, the state itself for the terminal state.
+        With an action subset, whether each node is in the subset is encoded
+        as well, and the code is negative.
+        """
+        if state == self.term_state:
+            return state
+        codes = self.get_node_codes(state)
+        packing = self.packing
+        if action_subset is not None:
+            codes = [
+                2 * code + (node in action_subset) for node, code in enumerate(codes)
+            ]
+            packing = self.masked_packing
+        for node, radix, groups in packing:
+            code = codes[node]
+            for children, child_size in groups:
+                if len(children) == 1:
+                    code += radix * codes[children[0]]
+                    radix *= child_size
+                else:
+                    for child_code in sorted([codes[child] for child in children]):
+                        code += radix * child_code
+                        radix *= child_size
+            codes[node] = code
+        return codes[0] if action_subset is None else ~codes[0]
+
+    __call__ = encode
+
+    def get_node_codes(self, state):
+        """Code of each node of a (non terminal) state"""
+        try:
+            return [
+                0 if hasattr(value, "sample") else outcome_codes[value]
+                for value, outcome_codes in zip(state, self.outcome_codes)
+            ]
+        except KeyError as error:
+            raise ValueError(f"{error.args[0]} is not a possible node value") from None
+
+    def encode_array(self, node_codes):
+        """
+        Codes of many states at once, the same as the ones of encode
+
+        Args:
+            node_codes: Array of shape (num_states, num_nodes) with the code
+                of each node of each state
+
+        Returns:
+            Array of int64 codes
+        """
+        if self.num_state_codes > np.iinfo(np.int64).max:
+            raise ValueError("The states of the tree can't be encoded in 64 bits")
+        codes = node_codes.astype(np.int64)
+        for node, radix, groups in self.packing:
+            code = codes[:, node]
+            for children, child_size in groups:
+                if len(children) == 1:
+                    child_codes = codes[:, list(children)]
+                else:
+                    child_codes = np.sort(codes[:, list(children)], axis=1)
+                for column in range(len(children)):
+                    code += radix * child_codes[:, column]
+                    radix *= child_size
+        return codes[:, 0]
+
+
+class TreeSolver:
+    """
+    Bottom-up dynamic programming solver of a tree environment with
+    categorical node distributions, the array counterpart of solve_recursive.
+    The canonical belief states (see StateEncoder) are enumerated level by
+    level, by the number of observed nodes, and the state values and
+    Q values of each level are computed from the ones of the next level and
+    stored in NumPy arrays indexed like the sorted state codes of the level.
+    Arrays that don't fit in max_memory are memory mapped files in spill_dir.
+    """
+
+    def __init__(self, env, max_memory=None, spill_dir=None, chunk_size=100000):
+        """
+        :param env: MouselabEnv with only discrete distributions
+        :param max_memory: number of bytes of arrays kept in memory, None for no limit
+        :param spill_dir: directory of the arrays that exceed max_memory,
+                          a temporary directory by default
+        :param chunk_size: number of states expanded at once
+        """
+        self.encoder = StateEncoder(env)
+        if self.encoder.num_state_codes > np.iinfo(np.int64).max:
+            raise ValueError("The states of the tree can't be encoded in 64 bits")
+        self.term_state = env.term_state
+        self.term_action = env.term_action
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.chunk_size = chunk_size
+        self.table_bytes = 0
+        self.spilled_bytes = 0
+        self.num_arrays = 0
+
+        self.num_nodes = len(env.tree)
+        self.stochastic_nodes = [
+            node for node, dist in enumerate(env.init) if hasattr(dist, "sample")
+        ]
+        # (code, probability) of each outcome of an observation
+        self.outcomes = {
+            node: [
+                (self.encoder.outcome_codes[node][val], prob)
+                for val, prob in env.init[node]
+            ]
+            for node in self.stochastic_nodes
+        }
+        self.costs = {node: env.cost(node) for node in self.stochastic_nodes}
+        # Expected value of each node by code, the expectation of its
+        # distribution while it is unobserved
+        num_codes = max(self.encoder.num_codes)
+        self.state_dtype = np.uint8 if num_codes <= 256 else np.uint16
+        self.node_values = np.zeros((self.num_nodes, num_codes))
+        for node, dist in enumerate(env.init):
+            outcome_values = list(self.encoder.outcome_codes[node])
+            self.node_values[node, 0] = expectation(dist)
+            self.node_values[node, 1 : len(outcome_values) + 1] = outcome_values
+        self.paths = []
+        stack = [[0]]
+        while stack:
+            path = stack.pop()
+            if env.tree[path[-1]]:
+                stack.extend(path + [child] for child in env.tree[path[-1]])
+            else:
+                self.paths.append(path[1:])
+
+        self.codes = []
+        self.states = []
+        self.values = []
+        self.q_values = []
+        self.enumerate_states(env.init)
+        self.compute_values()
+
+    def allocate(self, shape, dtype):
+        """Empty array, memory mapped if the arrays exceed max_memory"""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.table_bytes += nbytes
+        if (
+            self.max_memory is None
+            or self.table_bytes <= self.max_memory
+            or nbytes == 0
+        ):
+            return np.empty(shape, dtype)
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="tree_solver_")
+        file_path = os.path.join(self.spill_dir, f"array_{self.num_arrays}.dat")
+        self.num_arrays += 1
+        self.spilled_bytes += nbytes
+        return np.memmap(file_path, dtype=dtype, mode="w+", shape=shape)
+
+    def store(self, array):
+        stored = self.allocate(array.shape, array.dtype)
+        stored[...] = array
+        return stored
+
+    def get_term_rewards(self, states):
+        """Expected return of terminating in each state (the best path value)"""
+        values = self.node_values[np.arange(self.num_nodes), states]
+        term_rewards = None
+        for path in self.paths:
+            path_value = 0
+            # Summed from the leaf up, as in MouselabEnv.node_value
+            for node in reversed(path):
+                path_value = path_value + values[:, node]
+            if term_rewards is None:
+                term_rewards = path_value
+            else:
+                term_rewards = np.maximum(term_rewards, path_value)
+        return term_rewards
+
+    def enumerate_states(self, init):
+        """Canonical states reachable from the initial state, by level"""
+        init_state = np.array(
+            [self.encoder.get_node_codes(init)], dtype=self.state_dtype
+        )
+        self.codes.append(self.store(self.encoder.encode_array(init_state)))
+        self.states.append(self.store(init_state))
+        for _ in self.stochastic_nodes:
+            level_codes = []
+            level_states = []
+            states = self.states[-1]
+            for start in range(0, len(states), self.chunk_size):
+                chunk = states[start : start + self.chunk_size]
+                next_states = []
+                for node in self.stochastic_nodes:
+                    unobserved = chunk[chunk[:, node] == 0]
+                    for code in {code for code, _ in self.outcomes[node]}:
+                        observed = unobserved.copy()
+                        observed[:, node] = code
+                        next_states.append(observed)
+                next_states = np.concatenate(next_states)
+                codes, indices = np.unique(
+                    self.encoder.encode_array(next_states), return_index=True
+                )
+                level_codes.append(codes)
+                level_states.append(next_states[indices])
+            codes, indices = np.unique(np.concatenate(level_codes), return_index=True)
+            self.codes.append(self.store(codes))
+            self.states.append(self.store(np.concatenate(level_states)[indices]))
+
+    def compute_values(self):
+        """Q values and values of the states, from the last level to the first"""
+        self.values = [None] * len(self.states)
+        self.q_values = [None] * len(self.states)
+        for level in range(len(self.states) - 1, -1, -1):
+            states = self.states[level]
+            q_values = self.allocate((len(states), self.num_nodes + 1), float)
+            for start in range(0, len(states), self.chunk_size):
+                chunk = states[start : start + self.chunk_size]
+                chunk_q_values = np.full((len(chunk), self.num_nodes + 1), np.nan)
+                for node in self.stochastic_nodes:
+                    unobserved = np.flatnonzero(chunk[:, node] == 0)
+                    if len(unobserved) == 0:
+                        continue
+                    q_value = 0
+                    for code, prob in self.outcomes[node]:
+                        observed = chunk[unobserved]
+                        observed[:, node] = code
+                        next_values = self.values[level + 1][
+                            self.codes[level + 1].searchsorted(
+                                self.encoder.encode_array(observed)
+                            )
+                        ]
+                        # Summed in the order of the outcomes, as in Q
+                        q_value = q_value + prob * (self.costs[node] + next_values)
+                    chunk_q_values[unobserved, node] = q_value
+                chunk_q_values[:, self.term_action] = self.get_term_rewards(chunk)
+                q_values[start : start + len(chunk)] = chunk_q_values
+            self.q_values[level] = q_values
+            self.values[level] = self.store(np.nanmax(q_values, axis=1))
+
+    def get_index(self, state):
+        """Level and index of the state in the arrays of the level"""
+        node_codes = self.encoder.get_node_codes(state)
+        level = sum(node_codes[node] != 0 for node in self.stochastic_nodes)
+        code = self.encoder.encode(state)
+        codes = self.codes[level]
+        index = int(codes.searchsorted(code))
+        if index == len(codes) or codes[index] != code:
+            raise ValueError("The state is not reachable from the initial state")
+        return level, index
+
+    def V(self, state, action_subset=None):
+        """Value of a state (action subsets are not supported)"""
+        if action_subset is not None:
+            raise ValueError("Action subsets are solved by solve_recursive")
+        if state is None or state == self.term_state:
+            return 0
+        level, index = self.get_index(state)
+        return float(self.values[level][index])
+
+    def Q(self, state, action):
+        """Q value of an action in a state, from the values of the next states"""
+        if action == self.term_action:
+            node_codes = np.array(
+                [self.encoder.get_node_codes(state)], dtype=self.state_dtype
+            )
+            return float(self.get_term_rewards(node_codes)[0])
+        if not hasattr(state[action], "sample"):
+            raise ValueError(f"Node {action} is already observed")
+        q_value = 0
+        for val, prob in state[action]:
+            next_state = list(state)
+            next_state[action] = val
+            q_value += prob * (self.costs[action] + self.V(tuple(next_state)))
+        return q_value
+
+    def get_info(self):
+        num_states = sum(len(codes) for codes in self.codes)
+        return {
+            "q": sum(
+                int(np.count_nonzero(~np.isnan(q_values))) for q_values in self.q_values
+            ),
+            "v": num_states,
+            "num_states": num_states,
+            "table_bytes": self.table_bytes,
+            "spilled_bytes": self.spilled_bytes,
+        }
+
+
+def can_solve_with_arrays(env):
+    return hasattr(env, "tree") and all(
+        hasattr(dist, "vals") or not hasattr(dist, "sample") for dist in env.init
+    )
+
+
+def solve(
+    env,
+    hash_state=None,
+    actions=None,
+    blinkered=None,
+    method="recursive",
+    max_memory=None,
+    spill_dir=None,
+):
+    """Returns Q, V, pi, and computation data for an mdp environment.
+    With method="recursive" the values are computed on demand by
+    solve_recursive. With method="arrays" all the states of a tree with
+    discrete distributions are solved up front by a TreeSolver, whose arrays
+    are limited by max_memory (the states of a level are enumerated in
+    memory); the states can't be hashed by a given function, the actions
+    can't be restricted and the approximation can't be blinkered."""
+    if method == "recursive":
+        return solve_recursive(env, hash_state, actions, blinkered)
+    if method != "arrays":
+        raise ValueError(f"Unknown solve method {method}")
+    if hash_state is not None or actions is not None or blinkered:
+        raise ValueError(
+            "The array solver doesn't support hash_state, actions or blinkered"
+        )
+    if not can_solve_with_arrays(env):
+        raise ValueError("The array solver needs a tree with discrete distributions")
+    solver = TreeSolver(env, max_memory=max_memory, spill_dir=spill_dir)
+
+    def pi(s):
+        return max(env.actions(s), key=lambda a: solver.Q(s, a))
+
+    return solver.Q, solver.V, pi, solver.get_info()
+
+
+def solve_recursive(
+    env, hash_state=None, actions=None, blinkered=None, cache=None
+):
+    """Returns Q, V, pi, and computation data for an mdp environment.
+    Q and V are computed recursively when they are called, the values of
+    the states are memoized in cache (a new dict by default, any mapping
+    such as a bounded LRUDict)."""
     info = {"q": 0, "v": 0}  # track number of times each function is called
 
     if hash_state is None:
@@ -40,7 +455,8 @@ def solve(env, hash_state=None, actions=None, blinkered=None):
             hash_state = lambda state: tuple(sorted(state))
         elif hasattr(env, "tree"):
             # hash_state = lambda state: sort_tree(env, state)
-            hash_state = lambda state: hash_tree(env, state)
+            # hash_state = lambda state: hash_tree(env, state)
+            hash_state = StateEncoder(env)
     if actions is None:
         actions = env.actions
     if blinkered == "recursive":
@@ -87,6 +503,8 @@ def solve(env, hash_state=None, actions=None, blinkered=None):
                     # best expected value
                     # Embed the action subset into the state.
                     action_subset = kwargs["action_subset"]
+                    if isinstance(hash_state, StateEncoder):
+                        return hash_state.encode(state, action_subset)
                     mask = [0] * len(state)
                     for a in action_subset:
                         mask[a] = 1
@@ -101,7 +519,10 @@ def solve(env, hash_state=None, actions=None, blinkered=None):
         action_subset = subset_actions(a)
         return sum(p * (r + V(s1, action_subset)) for p, s1, r in env.results(s, a))
 
-    @memoize(key=hash_key)
+    if cache is None:
+        cache = {}
+
+    @memoize(cache=cache, key=hash_key)
     def V(s, action_subset=None):
         if s is None:
             return 0
@@ -114,4 +535,7 @@ def solve(env, hash_state=None, actions=None, blinkered=None):
     def pi(s):
         return max(actions(s), key=lambda a: Q(s, a))
 
+    # Memo of the state values, by state key
+    V.cache = cache
+
     return Q, V, pi, info
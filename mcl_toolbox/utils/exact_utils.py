@@ -1,3 +1,8 @@
+import multiprocessing
+import os
+import pickle
+import sys
+
 from contexttimer import Timer
 
 from mcl_toolbox.utils.env_utils import (
@@ -6,30 +11,62 @@ from mcl_toolbox.utils.env_utils import (
 from mcl_toolbox.utils.exact import solve
 
 
-def timed_solve_env(env, verbose=True, save_q=False, ground_truths=None):
+def timed_solve_env(
+    env,
+    verbose=True,
+    save_q=False,
+    ground_truths=None,
+    store_dir=None,
+    num_workers=None,
+    method="recursive",
+):
     """
     Solves environment, saves elapsed time and optionally prints value and elapsed time
     :param env: MouselabEnv with only discrete distribution (must not be too big)
     :param verbose: Whether or not to print out solve information once done
+    :param ground_truths: Ground truths of the partial q dictionary
+    :param store_dir: Directory of the shards of the partial q dictionary, if it
+                      is built in parallel by build_partial_q_dictionary
+    :param num_workers: Number of processes building the shards
+    :param method: "recursive" or "arrays", see exact.solve
     :return: Q, V, pi, info
-             Q, V, pi are all recursive functions
-             info contains the number of times Q and V were called
-                as well as the elapsed time ("time")
+             Q, V, pi are all functions, recursive unless the environment
+                is solved bottom up by a TreeSolver (method="arrays")
+             info contains the number of Q values and states computed,
+                the elapsed time ("time"), the number of states
+                ("num_states") and the memory of their keys in the memo
+                of V ("state_key_bytes") or of the arrays of the TreeSolver
+                ("table_bytes")
     """
     with Timer() as t:
-        Q, V, pi, info = solve(env)
+        Q, V, pi, info = solve(env, method=method)
+        if verbose or save_q:
+            value = V(env.init)
         info["time"] = t.elapsed
-        if verbose:
-            print("optimal -> {:.2f} in {:.3f} sec".format(V(env.init), t.elapsed))
-        elif save_q:
-            V(env.init)  # call V to cache q_dictionary
-
-        #  Save Q function
-        if save_q is not None and ground_truths is not None:
-            # In some cases, it is too costly to save whole Q function
-            info["q_dictionary"] = construct_partial_q_dictionary(Q, env, ground_truths)
-        elif save_q is not None:
-            info["q_dictionary"] = construct_q_dictionary(Q, env, verbose)
+    if hasattr(V, "cache"):
+        info["num_states"] = len(V.cache)
+        info["state_key_bytes"] = sum(sys.getsizeof(key) for key in V.cache)
+    if verbose:
+        print(
+            "optimal -> {:.2f} in {:.3f} sec, {} states ({:.1f} MB of {})".format(
+                value,
+                info["time"],
+                info["num_states"],
+                info.get("table_bytes", info.get("state_key_bytes", 0)) / 1e6,
+                "tables" if "table_bytes" in info else "keys",
+            )
+        )
+
+    #  Save Q function
+    if save_q is not None and ground_truths is not None and store_dir is not None:
+        info["q_dictionary"] = build_partial_q_dictionary(
+            Q, env, ground_truths, store_dir, num_workers=num_workers
+        )
+    elif save_q is not None and ground_truths is not None:
+        # In some cases, it is too costly to save whole Q function
+        info["q_dictionary"] = construct_partial_q_dictionary(Q, env, ground_truths)
+    elif save_q is not None:
+        info["q_dictionary"] = construct_q_dictionary(Q, env, verbose)
 
     return Q, V, pi, info
 
@@ -54,3 +91,99 @@ def construct_partial_q_dictionary(Q, env, selected_ground_truths):
     sa = get_sa_pairs_from_states(all_possible_states)
     q_dictionary = {pair: Q(*pair) for pair in sa}
     return q_dictionary
+
+
+# Q function of the shard workers, inherited from the parent process
+shard_q_function = None
+
+
+def init_shard_worker(Q, env):
+    global shard_q_function
+    shard_q_function = (Q, env)
+
+
+def construct_q_dictionary_shard(shard_path, ground_truths):
+    """
+    Construct the partial q dictionary of a slice of ground truths and save
+    it to shard_path. The dictionary is written to a temporary file first,
+    so that an interrupted build doesn't leave an incomplete shard behind.
+    """
+    Q, env = shard_q_function
+    q_dictionary = construct_partial_q_dictionary(Q, env, ground_truths)
+    temporary_path = f"{shard_path}.tmp{os.getpid()}"
+    with open(temporary_path, "wb") as f:
+        pickle.dump(q_dictionary, f)
+    os.replace(temporary_path, shard_path)
+    return shard_path
+
+
+def build_partial_q_dictionary(
+    Q, env, selected_ground_truths, store_dir, num_workers=None, shard_size=10
+):
+    """
+    Construct q dictionary for only specified ground truth values in
+    parallel. The ground truths are deduplicated, sorted and split into
+    shards of shard_size ground truths, and the q dictionary of each shard is
+    saved in store_dir by a pool of worker processes. Each worker evaluates
+    Q with its own copy of the memo of the solver. Shards saved by a previous
+    (interrupted) build with the same ground truths are not built again, so
+    the result doesn't depend on the number of workers or interruptions.
+    :param Q: Q function of the solved environment
+    :param env: MouselabEnv the Q function was solved for
+    :param selected_ground_truths: Iterable of ground truths
+    :param store_dir: Directory of the shards
+    :param num_workers: Number of processes, all the CPUs by default,
+                        the shards are built in this process for 1 or where
+                        processes can't be forked
+    :param shard_size: Number of ground truths per shard
+    :return: q dictionary of the ground truths, merged in shard order
+    """
+    if shard_size < 1:
+        raise ValueError("The shard size must be positive")
+    ground_truths = sorted(
+        {tuple(ground_truth) for ground_truth in selected_ground_truths}
+    )
+    os.makedirs(store_dir, exist_ok=True)
+    manifest_path = os.path.join(store_dir, "manifest.pkl")
+    manifest = {"ground_truths": ground_truths, "shard_size": shard_size}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "rb") as f:
+            if pickle.load(f) != manifest:
+                raise ValueError(
+                    f"{store_dir} contains the shards of other ground truths"
+                )
+    else:
+        with open(manifest_path, "wb") as f:
+            pickle.dump(manifest, f)
+
+    shards = [
+        (
+            os.path.join(store_dir, f"shard_{shard_num:05d}.pkl"),
+            [
+                list(ground_truth)
+                for ground_truth in ground_truths[start : start + shard_size]
+            ],
+        )
+        for shard_num, start in enumerate(range(0, len(ground_truths), shard_size))
+    ]
+    missing_shards = [shard for shard in shards if not os.path.exists(shard[0])]
+    if num_workers is None:
+        num_workers = os.cpu_count()
+    num_workers = min(num_workers, len(missing_shards))
+    if num_workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        # Forked workers inherit the solver, which can't be pickled
+        context = multiprocessing.get_context("fork")
+        with context.Pool(
+            num_workers, initializer=init_shard_worker, initargs=(Q, env)
+        ) as pool:
+            pool.starmap(construct_q_dictionary_shard, missing_shards)
+    else:
+        init_shard_worker(Q, env)
+        for shard_path, shard_ground_truths in missing_shards:
+            construct_q_dictionary_shard(shard_path, shard_ground_truths)
+
+    q_dictionary = {}
+    for shard_path, _ in shards:
+        with open(shard_path, "rb") as f:
+            q_dictionary.update(pickle.load(f))
+    return q_dictionary
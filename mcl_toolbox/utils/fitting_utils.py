@@ -2,14 +2,19 @@ import os
 from pathlib import Path
 
 from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
-from mcl_toolbox.global_vars import features, model, pickle_load, strategies
+from mcl_toolbox.env.mouselab import get_click_cost
+from mcl_toolbox.global_vars import features, model, strategies
 from mcl_toolbox.utils.experiment_utils import Experiment
+from mcl_toolbox.utils.q_table import load_q_fn
 
 implemented_features = features.implemented
 microscope_features = features.microscope
 strategy_weights = strategies.strategy_weights
 model_attributes = model.model_attributes
 strategy_spaces = strategies.strategy_spaces
+# Q function of the meta feedback participants of each experiment and click
+# cost, loaded once
+q_fns = {}
 
 
 def construct_model(model_index, num_actions, normalized_features):
@@ -43,7 +48,9 @@ def construct_model(model_index, num_actions, normalized_features):
     return learner, learner_attributes
 
 
-def get_participant_context(exp_num, pid, pipeline, exp_attributes={}):
+def get_participant_context(
+    exp_num, pid, pipeline, exp_attributes={}, trial_backend="node", cost=1
+):
     E = Experiment(exp_num, **exp_attributes)
     E.attach_pipeline(pipeline)
     participant = E.participants[pid]
@@ -51,18 +58,26 @@ def get_participant_context(exp_num, pid, pipeline, exp_attributes={}):
     file_location = Path(__file__).parents[1]
     if "condition" in dir(participant):
         if participant.condition == "meta":
-            try:
-                q_path = os.path.join(file_location, f"data/{exp_num}_q.pkl")
-                q_fn = pickle_load(q_path)["q_dictionary"]
-            except FileNotFoundError:
-                print("Q-fn could not be loaded")
+            # Without a saved Q function, the Q values of the visited states
+            # are computed on demand
+            key = (exp_num, tuple(cost) if isinstance(cost, list) else cost)
+            if key not in q_fns:
+                q_fns[key] = load_q_fn(
+                    exp_num,
+                    os.path.join(file_location, "data"),
+                    lazy=True,
+                    cost=get_click_cost(cost),
+                )
+            q_fn = q_fns[key]
     else:
         participant.condition = "none"
     env = GenericMouselabEnv(
         len(participant.envs),
         pipeline=pipeline,
         ground_truth=participant.envs,
+        cost=cost,
         feedback=participant.condition,
         q_fn=q_fn,
+        trial_backend=trial_backend,
     )
     return participant, env
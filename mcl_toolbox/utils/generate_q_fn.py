@@ -26,9 +26,16 @@ if __name__ == "__main__":
         set([tuple(e) for p in E.participants.values() for e in p.envs])
     )
     ground_truths = [list(gt) for gt in ground_truths]
+    file_location = Path(__file__).parents[1]
+    # Rerunning the script resumes an interrupted build of the shards
+    store_dir = file_location.joinpath(f"data/{exp_num}_q_shards")
     Q, V, pi, info = timed_solve_env(
-        env, save_q=True, verbose=True, ground_truths=ground_truths
+        env,
+        save_q=True,
+        verbose=True,
+        ground_truths=ground_truths,
+        store_dir=store_dir,
+        method="arrays",
     )
-    file_location = Path(__file__).parents[1]
     path = file_location.joinpath(f"data/{exp_num}_q.pkl")
     pickle_save(info, path)
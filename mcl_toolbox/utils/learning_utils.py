@@ -1,6 +1,6 @@
 import os
 import pickle
-from collections import Counter, defaultdict
+from collections import Counter, OrderedDict, defaultdict
 from functools import lru_cache, partial
 from pathlib import Path
 
@@ -449,24 +449,87 @@ def get_excluded_participants(exp_num="F1", exclude_condition="MCFB"):
     return list(set(pdf.pid))
 
 
+# Normalization vectors of the (max, min) feature values used so far,
+# see get_normalization_vectors
+normalization_cache = OrderedDict()
+normalization_cache_size = 256
+
+
+def get_normalization_key(features_list, max_min_values):
+    """
+        Get the max and min values of the features of the list as a hashable
+        key, None if the features aren't normalized
+    """
+    if not max_min_values:
+        return None
+    max_feature_values, min_feature_values = max_min_values
+    return (
+        tuple(max_feature_values[feature] for feature in features_list),
+        tuple(min_feature_values[feature] for feature in features_list),
+    )
+
+
+def get_normalization_vectors(features_list, max_min_values):
+    """
+        Get the min values and the ranges of the features aligned with the
+        feature list, and a mask of the features with a range of 0. The
+        vectors are cached by the max and min values of the features, so
+        equal values given by different (or mutated) dictionaries are
+        looked up by value.
+    """
+    key = get_normalization_key(features_list, max_min_values)
+    vectors = normalization_cache.get(key)
+    if vectors is not None:
+        normalization_cache.move_to_end(key)
+        return vectors
+    max_values, min_values = key
+    min_values = np.array(min_values, dtype=float)
+    range_values = np.array(max_values, dtype=float) - min_values
+    vectors = (min_values, range_values, range_values == 0)
+    for vector in vectors:
+        vector.setflags(write=False)
+    normalization_cache[key] = vectors
+    while len(normalization_cache) > normalization_cache_size:
+        normalization_cache.popitem(last=False)
+    return vectors
+
+
+def normalize_feature_values(feature_values, normalization_vectors):
+    """
+        Normalize (in place) a float array of feature values, or a matrix
+        with the features in the last axis, with the vectors of
+        get_normalization_vectors
+    """
+    min_values, range_values, zero_range = normalization_vectors
+    np.divide(
+        feature_values - min_values,
+        range_values,
+        out=feature_values,
+        where=~zero_range,
+    )
+    feature_values[..., zero_range] = 0
+    return feature_values
+
+
 def get_normalized_feature_values(feature_values, features_list, max_min_values):
     """
-        Get the normalized feature values
-    """
-    normalized_features = np.array(feature_values)
-    if max_min_values:
-        max_feature_values, min_feature_values = max_min_values
-        for i, (feature, fv) in enumerate(zip(features_list, feature_values)):
-            max_min_diff = max_feature_values[feature] - min_feature_values[feature]
-            f_min_diff = fv - min_feature_values[feature]
-            #print(feature, f_min_diff, max_min_diff, max_min_diff - f_min_diff)
-            if max_min_diff == 0:
-                normalized_features[i] = 0
-            else:
-                normalized_features[i] = f_min_diff/max_min_diff
-    return normalized_features
-    
+        Get the normalized feature values of a feature vector or of a matrix
+        with one row per node
+    """
+    if not max_min_values:
+        return np.array(feature_values)
+    return normalize_feature_values(
+        np.array(feature_values, dtype=float),
+        get_normalization_vectors(features_list, max_min_values),
+    )
+
+
+@lru_cache(maxsize=None)
 def get_normalized_features(exp_num):
+    """
+        Get the (max, min) feature values of a reward structure. The values
+        are loaded once and shared, they must not be modified.
+    """
     max_feature_values = pickle_load(f"../data/normalized_values/{exp_num}/max.pkl")
     min_feature_values = pickle_load(f"../data/normalized_values/{exp_num}/min.pkl")
     return max_feature_values, min_feature_values
@@ -1,16 +1,18 @@
 import os
 from pathlib import Path
 
+from mcl_toolbox.env.feature_plan import FeaturePlan
 from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.env.mouselab import get_click_cost
 from mcl_toolbox.global_vars import features, model, strategies, structure
 from mcl_toolbox.mcrl_modelling.optimizer import ParameterOptimizer
 from mcl_toolbox.utils.experiment_utils import Experiment
 from mcl_toolbox.utils.learning_utils import (
     get_normalized_features,
     get_number_of_actions_from_branching,
-    pickle_load,
     pickle_save,
 )
+from mcl_toolbox.utils.q_table import PipelineQFunction, load_q_fn
 from mcl_toolbox.utils.sequence_utils import compute_log_likelihood
 
 implemented_features = features.implemented
@@ -38,7 +40,15 @@ def get_strategy_probs(env, participant, features, normalized_features, w):
 
 
 class ModelFitter:
-    def __init__(self, exp_name, exp_attributes=None, data_path=None):
+    def __init__(
+        self,
+        exp_name,
+        exp_attributes=None,
+        data_path=None,
+        feature_cache=None,
+        trial_backend="node",
+        cost=1,
+    ):
         """
         
         :param exp_name: name, or folder, where experiment data is saved
@@ -50,8 +60,19 @@ class ModelFitter:
             OR
             the experiment must be in the global_vars in the structure object
         :param data_path: path where data for experiment exp_name is saved
+        :param feature_cache: FeatureCache shared by the feature plans of the fitted
+            models, so that the feature matrices of the participants' trials are
+            only computed once across optimization iterations
+        :param trial_backend: Trial implementation of the participants' envs,
+            "node" or "array" (see GenericMouselabEnv)
+        :param cost: click cost of the participants' envs, a scalar or
+            [cost_weight, depth_weight] (see GenericMouselabEnv), also used
+            to solve the Q values of the meta feedback on demand
         """
         self.exp_name = exp_name
+        self.feature_cache = feature_cache
+        self.trial_backend = trial_backend
+        self.cost = cost
         if exp_attributes is None:
             exp_attributes = {
                 "exclude_trials": None,
@@ -82,6 +103,8 @@ class ModelFitter:
         self.participant = None
         self.env = None
         self.model_index = None
+        # Q function of the meta feedback participants, loaded once
+        self.q_fn = None
 
     def update_attributes(self, env):
         self.pipeline = env.pipeline
@@ -95,8 +118,10 @@ class ModelFitter:
             len(participant.envs),
             pipeline=self.pipeline,
             ground_truth=participant.envs,
+            cost=self.cost,
             feedback=participant.condition,
             q_fn=q_fn,
+            trial_backend=self.trial_backend,
         )
         return env
 
@@ -105,11 +130,16 @@ class ModelFitter:
         file_location = Path(__file__).parents[1]
         if hasattr(participant, "condition"):
             if participant.condition == "meta":
-                try:
-                    q_path = file_location.joinpath(f"data/{self.exp_name}_q.pkl")
-                    q_fn = pickle_load(q_path)["q_dictionary"]
-                except FileNotFoundError:
-                    print("Q-fn could not be loaded")
+                if self.q_fn is None:
+                    # Without a saved Q function, the Q values of the
+                    # visited states are computed on demand
+                    self.q_fn = load_q_fn(
+                        self.exp_name,
+                        file_location.joinpath("data"),
+                        lazy=True,
+                        cost=get_click_cost(self.cost),
+                    )
+                q_fn = self.q_fn
         else:
             participant.condition = "none"
         return q_fn, participant
@@ -142,6 +172,9 @@ class ModelFitter:
         learner_attributes = dict(
             features=feature_space,
             normalized_features=self.normalized_features,
+            feature_plan=FeaturePlan(
+                feature_space, self.normalized_features, cache=self.feature_cache
+            ),
             num_priors=num_priors,
             strategy_space=strategy_space,
             no_term=not learner_attributes["term"],
@@ -186,6 +219,13 @@ class ModelFitter:
         )
         losses = [trial["result"]["loss"] for trial in res[1]]
         print(f"Loss: {min(losses)}")
+        if isinstance(self.q_fn, PipelineQFunction):
+            q_fn_info = self.q_fn.info()
+            print(
+                f"Lazy Q function: {q_fn_info['misses']} of "
+                f"{q_fn_info['hits'] + q_fn_info['misses']} lookups solved "
+                f"in {q_fn_info['lookup_time']:.2f} s"
+            )
         if params_dir is not None:
             # save priors
             pickle_save(
@@ -211,6 +251,8 @@ class ModelFitter:
         if env is None and pid is None:
             raise ValueError("Either env or pid has to be specified")
         num_simulations = sim_params["num_simulations"]
+        # Runs the simulations at once in a VectorMouselabEnv
+        lockstep = sim_params.get("lockstep", False)
         participant = None
         if pid is not None:
             participant = self.E.participants[pid]
@@ -223,12 +265,12 @@ class ModelFitter:
         )
         if participant is None:
             (r_data, sim_data), p_data = optimizer.run_hp_model_nop(
-                params, "reward", num_simulations=num_simulations
+                params, "reward", num_simulations=num_simulations, lockstep=lockstep
             )
             plot_file = f"{model_index}_{num_simulations}.png"
         else:
             (r_data, sim_data), p_data = optimizer.run_hp_model(
-                params, "reward", num_simulations=num_simulations
+                params, "reward", num_simulations=num_simulations, lockstep=lockstep
             )
             plot_file = f"{participant.pid}_{model_index}_{num_simulations}.png"
         if plot_dir is not None:
@@ -0,0 +1,390 @@
+"""
+Compact Q tables for metacognitive feedback.
+A Q table stores the Q values of a q dictionary (see exact_utils) in a
+float32 array with one row per state and one column per action, NaN where the
+action isn't available. The states are encoded as integers: the digit of a node
+is 0 while it is unobserved and 1 + the index of its value in the sorted
+possible values of the node once it is observed. The rows are sorted by state
+code, so a state is found with a binary search. The arrays are saved as .npy
+files in a directory and memory mapped when loaded, so that the processes
+fitting models share one copy of the table.
+Convert the q dictionary of an experiment with
+python3 mcl_toolbox/utils/q_table.py <exp_num>
+Experiments without either are given a PipelineQFunction, which computes the
+Q values of the visited states on demand.
+"""
+
+import os
+import pickle
+import sys
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from mcl_toolbox.env.mouselab import MouselabEnv
+from mcl_toolbox.utils.exact import solve_recursive
+from mcl_toolbox.utils.learning_utils import pickle_load
+
+
+class QTable:
+    def __init__(self, node_values, state_codes, q_values):
+        """
+        :param node_values: Sorted tuple of the possible values of each node
+        :param state_codes: Sorted array of the int64 codes of the states
+        :param q_values: Array of shape (num_states, num_nodes + 1), the Q
+                         values of the states, the last column is termination
+        """
+        self.node_values = [tuple(values) for values in node_values]
+        self.num_nodes = len(self.node_values)
+        self.value_codes = [
+            {value: code for code, value in enumerate(values, 1)}
+            for values in self.node_values
+        ]
+        radices = [len(values) + 1 for values in self.node_values]
+        if np.prod(radices, dtype=float) > np.iinfo(np.int64).max:
+            raise ValueError("The states can't be encoded in 64 bits")
+        self.place_values = [
+            int(np.prod(radices[:node])) for node in range(len(radices))
+        ]
+        if q_values.shape != (len(state_codes), self.num_nodes + 1):
+            raise ValueError(
+                f"Q values of shape {q_values.shape} don't match "
+                f"{len(state_codes)} states of {self.num_nodes} nodes"
+            )
+        self.state_codes = state_codes
+        self.q_values = q_values
+
+    def encode(self, state):
+        """Code of a state, a tuple of the value or distribution of each node"""
+        code = 0
+        for node, entry in enumerate(state):
+            if not hasattr(entry, "sample"):
+                code += self.place_values[node] * self.value_codes[node][entry]
+        return code
+
+    def encode_trial(self, ground_truth, observed_bits):
+        """
+        Code of the state of a trial
+        :param ground_truth: Value of each node
+        :param observed_bits: Bitmask of the observed nodes, the root is
+                              always observed with value 0 (see
+                              GenericMouselabEnv.get_state)
+        """
+        code = self.place_values[0] * self.value_codes[0][0]
+        for node in range(1, self.num_nodes):
+            if observed_bits >> node & 1:
+                code += (
+                    self.place_values[node]
+                    * self.value_codes[node][ground_truth[node]]
+                )
+        return code
+
+    def get_index(self, code):
+        index = int(self.state_codes.searchsorted(code))
+        if index == len(self.state_codes) or self.state_codes[index] != code:
+            raise KeyError(f"No Q values of the state with code {code}")
+        return index
+
+    def get_q_values(self, code):
+        """Q values of all the actions in the state with the given code"""
+        return self.q_values[self.get_index(code)]
+
+    def __getitem__(self, pair):
+        """Q value of a (state, action) pair, like a q dictionary"""
+        state, action = pair
+        q_value = self.get_q_values(self.encode(state))[action]
+        if np.isnan(q_value):
+            raise KeyError(f"No Q value of action {action}")
+        return float(q_value)
+
+    def __contains__(self, pair):
+        try:
+            self[pair]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        return int(np.count_nonzero(~np.isnan(self.q_values)))
+
+    @classmethod
+    def from_q_dictionary(cls, q_dictionary):
+        """Q table of a dictionary of {(state, action): Q value}"""
+        num_nodes = len(next(iter(q_dictionary))[0])
+        node_values = [set() for _ in range(num_nodes)]
+        for state, _ in q_dictionary:
+            for node, entry in enumerate(state):
+                if hasattr(entry, "sample"):
+                    node_values[node].update(entry.vals)
+                else:
+                    node_values[node].add(entry)
+        table = cls(
+            [sorted(values) for values in node_values],
+            np.zeros(0, dtype=np.int64),
+            np.zeros((0, num_nodes + 1), dtype=np.float32),
+        )
+        codes = np.fromiter(
+            (table.encode(state) for state, _ in q_dictionary),
+            dtype=np.int64,
+            count=len(q_dictionary),
+        )
+        actions = np.fromiter(
+            (action for _, action in q_dictionary),
+            dtype=np.int64,
+            count=len(q_dictionary),
+        )
+        state_codes, rows = np.unique(codes, return_inverse=True)
+        q_values = np.full(
+            (len(state_codes), num_nodes + 1), np.nan, dtype=np.float32
+        )
+        q_values[rows, actions] = np.fromiter(
+            q_dictionary.values(), dtype=float, count=len(q_dictionary)
+        )
+        table.state_codes = state_codes
+        table.q_values = q_values
+        return table
+
+    def save(self, table_dir):
+        os.makedirs(table_dir, exist_ok=True)
+        np.save(os.path.join(table_dir, "state_codes.npy"), self.state_codes)
+        np.save(os.path.join(table_dir, "q_values.npy"), self.q_values)
+        with open(os.path.join(table_dir, "node_values.pkl"), "wb") as f:
+            pickle.dump(self.node_values, f)
+
+    @classmethod
+    def load(cls, table_dir, mmap_mode="r"):
+        """Load a saved table, memory mapped by default"""
+        with open(os.path.join(table_dir, "node_values.pkl"), "rb") as f:
+            node_values = pickle.load(f)
+        return cls(
+            node_values,
+            np.load(os.path.join(table_dir, "state_codes.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(table_dir, "q_values.npy"), mmap_mode=mmap_mode),
+        )
+
+
+class LRUDict(OrderedDict):
+    """Dictionary that keeps the maxsize most recently used items"""
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("The size of the cache must be positive")
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class LazyQFunction:
+    """
+    Q function of the trials of a pipeline entry that is evaluated when a
+    (state, action) pair is looked up, like a q dictionary, by the recursive
+    solver of exact.py. Only the states reachable from the looked up states
+    are solved, the values of the states are memoized by the solver and the
+    Q values are kept in a bounded LRU cache, which can be saved to and
+    loaded from cache_path.
+    """
+
+    def __init__(
+        self,
+        pipeline_entry,
+        cost=-1,
+        maxsize=100000,
+        memo_size=None,
+        cache_path=None,
+    ):
+        """
+        :param pipeline_entry: (branching, reward function) tuple of the trials
+        :param cost: Reward of a click, as in generate_q_fn, or a cost
+                     function of MouselabEnv
+        :param maxsize: Maximum number of Q values kept
+        :param memo_size: Maximum number of state values memoized by the
+                          solver, None for no limit
+        :param cache_path: Pickle of the Q values, loaded if it exists and
+                           written by save
+        """
+        self.pipeline_entry = pipeline_entry
+        self.cost = cost
+        self.memo_size = memo_size
+        branching, reward_function = pipeline_entry
+        self.env = MouselabEnv.new_symmetric(branching, reward_function, cost=cost)
+        self.memo = {} if memo_size is None else LRUDict(memo_size)
+        self.Q, _, _, _ = solve_recursive(self.env, cache=self.memo)
+        self.q_values = LRUDict(maxsize)
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        # Seconds spent solving the Q values of the misses
+        self.lookup_time = 0.0
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                self.q_values.update(pickle.load(f))
+
+    def __getstate__(self):
+        # The solver holds closures, it is rebuilt when unpickled
+        return {
+            "pipeline_entry": self.pipeline_entry,
+            "cost": self.cost,
+            "maxsize": self.q_values.maxsize,
+            "memo_size": self.memo_size,
+            "cache_path": self.cache_path,
+            "q_values": list(self.q_values.items()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "lookup_time": self.lookup_time,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(
+            state["pipeline_entry"],
+            cost=state["cost"],
+            maxsize=state["maxsize"],
+            memo_size=state["memo_size"],
+        )
+        self.cache_path = state["cache_path"]
+        self.q_values.update(state["q_values"])
+        self.hits = state["hits"]
+        self.misses = state["misses"]
+        self.lookup_time = state["lookup_time"]
+
+    @staticmethod
+    def get_key(state, action):
+        """Observed values of the state (None if unobserved) and the action"""
+        return (
+            tuple(None if hasattr(entry, "sample") else entry for entry in state),
+            action,
+        )
+
+    def __getitem__(self, pair):
+        state, action = pair
+        key = self.get_key(state, action)
+        try:
+            q_value = self.q_values[key]
+            self.hits += 1
+        except KeyError:
+            start = time.perf_counter()
+            q_value = self.Q(tuple(state), action)
+            self.lookup_time += time.perf_counter() - start
+            self.q_values[key] = q_value
+            self.misses += 1
+        return q_value
+
+    def __len__(self):
+        return len(self.q_values)
+
+    def save(self, cache_path=None):
+        """Save the cached Q values to cache_path"""
+        if cache_path is None:
+            cache_path = self.cache_path
+        if cache_path is None:
+            raise ValueError("There is no path to save the Q values to")
+        temporary_path = f"{cache_path}.tmp{os.getpid()}"
+        with open(temporary_path, "wb") as f:
+            pickle.dump(dict(self.q_values), f)
+        os.replace(temporary_path, cache_path)
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "lookup_time": self.lookup_time,
+            "size": len(self.q_values),
+            "maxsize": self.q_values.maxsize,
+            "memoized_states": len(self.memo),
+        }
+
+
+class PipelineQFunction:
+    """
+    Lazy Q functions of the trials of a pipeline, one LazyQFunction for each
+    (branching, reward function) entry, created when a trial of the entry is
+    first looked up, so that mixed and transfer pipelines are solved with
+    the rewards of each trial.
+    """
+
+    def __init__(self, cost=-1, **lazy_kwargs):
+        """
+        :param cost: Reward of a click or cost function of MouselabEnv, see
+                     mouselab.get_click_cost
+        :param lazy_kwargs: Keyword arguments of the LazyQFunctions
+        """
+        if "cache_path" in lazy_kwargs:
+            raise ValueError("The Q functions of a pipeline can't share a cache path")
+        self.cost = cost
+        self.lazy_kwargs = lazy_kwargs
+        self.q_fns = {}
+
+    def get_q_fn(self, pipeline_entry):
+        """LazyQFunction of the trials of a (branching, reward function) entry"""
+        branching, reward_function = pipeline_entry
+        key = (tuple(branching), reward_function)
+        if key not in self.q_fns:
+            self.q_fns[key] = LazyQFunction(
+                pipeline_entry, cost=self.cost, **self.lazy_kwargs
+            )
+        return self.q_fns[key]
+
+    def info(self):
+        """Lookup statistics summed over the Q functions of the entries"""
+        info = {
+            "num_q_functions": len(self.q_fns),
+            "hits": 0,
+            "misses": 0,
+            "lookup_time": 0.0,
+            "size": 0,
+            "memoized_states": 0,
+        }
+        for q_fn in self.q_fns.values():
+            for key, value in q_fn.info().items():
+                if key in info:
+                    info[key] += value
+        return info
+
+
+def convert_q_dictionary(q_path, table_dir):
+    """Save the q dictionary of a pickle saved by generate_q_fn as a Q table"""
+    table = QTable.from_q_dictionary(pickle_load(q_path)["q_dictionary"])
+    table.save(table_dir)
+    return table
+
+
+def load_q_fn(exp_num, data_dir=None, lazy=False, cost=-1, **lazy_kwargs):
+    """
+    Load the Q function of an experiment, its Q table if it has been
+    converted and its q dictionary otherwise
+    :param lazy: Whether a PipelineQFunction is returned when there is no
+                 saved Q function
+    :param cost: Reward of a click or cost function of the PipelineQFunction,
+                 see mouselab.get_click_cost
+    :param lazy_kwargs: Keyword arguments of its LazyQFunctions
+    :raises FileNotFoundError: if there is neither and lazy is False
+    """
+    if data_dir is None:
+        data_dir = Path(__file__).parents[1].joinpath("data")
+    table_dir = os.path.join(data_dir, f"{exp_num}_q_table")
+    q_path = os.path.join(data_dir, f"{exp_num}_q.pkl")
+    if os.path.isdir(table_dir):
+        return QTable.load(table_dir)
+    if lazy and not os.path.exists(q_path):
+        return PipelineQFunction(cost=cost, **lazy_kwargs)
+    return pickle_load(q_path)["q_dictionary"]
+
+
+if __name__ == "__main__":
+    exp_num = sys.argv[1]
+    data_dir = Path(__file__).parents[1].joinpath("data")
+    table = convert_q_dictionary(
+        data_dir.joinpath(f"{exp_num}_q.pkl"), data_dir.joinpath(f"{exp_num}_q_table")
+    )
+    print(f"{len(table.state_codes)} states, {table.q_values.nbytes / 1e6:.1f} MB")
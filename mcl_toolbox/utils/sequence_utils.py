@@ -3,6 +3,8 @@ import operator
 import numpy as np
 from scipy.special import logsumexp, softmax
 
+from mcl_toolbox.env.array_mouselab import ArrayTrial, get_trial_class
+from mcl_toolbox.env.feature_plan import get_cached_feature_plan
 from mcl_toolbox.env.modified_mouselab import TrialSequence
 from mcl_toolbox.utils.learning_utils import (get_counts,
                                               get_normalized_feature_values)
@@ -15,6 +17,7 @@ def get_accuracy_position(
     num_features = len(features)
     env = TrialSequence(1, pipeline, ground_truth=[ground_truth])
     trial = env.trial_sequence[0]
+    feature_plan = get_cached_feature_plan(features)
     beta = 1
     acc = []
     total_neg_click_likelihood = 0
@@ -24,11 +27,10 @@ def get_accuracy_position(
         click_index = unobserved_node_labels.index(click)
         feature_values = np.zeros((len(unobserved_nodes), num_features))
         for i, node in enumerate(unobserved_nodes):
-            feature_values[i] = node.compute_termination_feature_values(features)
-            if normalized_features:
-                feature_values[i] = get_normalized_feature_values(
-                    feature_values[i], features, normalized_features
-                )
+            feature_values[i] = feature_plan.compute_node_values(node)
+        feature_values = get_normalized_feature_values(
+            feature_values, features, normalized_features
+        )
         dot_product = beta * np.dot(W, feature_values.T)
         softmax_dot = softmax(dot_product)
         neg_log_likelihood = -np.log(softmax_dot[click_index])
@@ -190,12 +192,11 @@ def compute_log_likelihood(
         if w != 0:
             ws.append(w)
             fs.append(f)
+    feature_plan = get_cached_feature_plan(fs, normalized_features)
     for click in click_sequence:
         unobserved_nodes = trial.get_unobserved_nodes()
         unobserved_node_labels = [node.label for node in unobserved_nodes]
-        feature_values = trial.get_node_feature_values(
-            unobserved_nodes, fs, normalized_features
-        )
+        feature_values = trial.get_node_feature_values(unobserved_nodes, feature_plan)
         dot_product = beta * np.dot(ws, feature_values.T)
         click_index = unobserved_node_labels.index(click)
         trial.node_map[click].observe()
@@ -205,9 +206,11 @@ def compute_log_likelihood(
 
 
 def compute_trial_feature_log_likelihood(
-    trial, trial_features, click_sequence, weights, inv_t=False
+    trial, trial_features, click_sequence, weights, inv_t=False, reset=True
 ):
-    trial.reset_observations()
+    # Without reset the clicks are replayed from the current observations
+    if reset:
+        trial.reset_observations()
     log_likelihoods = []
     feature_len = weights.shape[0]
     beta = 1
@@ -229,8 +232,11 @@ def compute_trial_feature_log_likelihood(
     return np.sum(log_likelihoods)
 
 
-def get_clicks(trial, features, weights, normalized_features, inv_t=False):
-    trial.reset_observations()
+def get_clicks(
+    trial, features, weights, normalized_features, inv_t=False, reset=True
+):
+    if reset:
+        trial.reset_observations()
     actions = []
     feature_len = weights.shape[0]
     beta = 1
@@ -240,12 +246,11 @@ def get_clicks(trial, features, weights, normalized_features, inv_t=False):
         beta = weights[-1]
         W = weights[:-1]
     unobserved_nodes = trial.get_unobserved_nodes()
+    feature_plan = get_cached_feature_plan(features, normalized_features)
     click = -1
     while click != 0:
         unobserved_node_labels = [node.label for node in unobserved_nodes]
-        feature_values = trial.get_node_feature_values(
-            unobserved_nodes, features, normalized_features
-        )
+        feature_values = trial.get_node_feature_values(unobserved_nodes, feature_plan)
         dot_product = beta * np.dot(W, feature_values.T)
         softmax_dot = softmax(dot_product)
         click = np.random.choice(unobserved_node_labels, p=softmax_dot)
@@ -256,9 +261,20 @@ def get_clicks(trial, features, weights, normalized_features, inv_t=False):
 
 
 def generate_clicks(
-    pipeline, num_trials, weights, features, normalized_features, envs=None
+    pipeline,
+    num_trials,
+    weights,
+    features,
+    normalized_features,
+    envs=None,
+    trial_backend="node",
 ):
-    trials = TrialSequence(num_trials, pipeline, ground_truth=envs)
+    trials = TrialSequence(
+        num_trials,
+        pipeline,
+        ground_truth=envs,
+        trial_class=get_trial_class(trial_backend),
+    )
     clicks = []
     for trial in trials.trial_sequence:
         clicks.append(get_clicks(trial, features, weights, normalized_features))
@@ -278,7 +294,9 @@ def generate_algorithm_data(env, strategy_num, num_simulations=1000):
 
 def compute_action_features(trial, action, features, normalized_features):
     node = trial.node_map[action]
-    action_feature_values = node.compute_termination_feature_values(features)
+    action_feature_values = get_cached_feature_plan(features).compute_node_values(
+        node
+    )
     if normalized_features:
         action_feature_values = get_normalized_feature_values(
             action_feature_values, features, normalized_features
@@ -287,37 +305,29 @@ def compute_action_features(trial, action, features, normalized_features):
 
 
 def compute_current_features(trial, features, normalized_features):
-    num_nodes = trial.num_nodes
-    num_features = len(features)
-    action_feature_values = np.zeros((num_nodes, num_features))
-    for node_num in range(num_nodes):
-        node = trial.node_map[node_num]
-        action_feature_values[node_num] = node.compute_termination_feature_values(
-            features
-        )
-        if normalized_features:
-            action_feature_values[node_num] = get_normalized_feature_values(
-                action_feature_values[node_num], features, normalized_features
-            )
-    return action_feature_values
+    feature_plan = get_cached_feature_plan(features, normalized_features)
+    return feature_plan.evaluate(trial)
 
 
 def compute_trial_features(
     pipeline, ground_truth, trial_actions, features_list, normalized_features
 ):
-    num_features = len(features_list)
-    env = TrialSequence(num_trials=1, pipeline=pipeline, ground_truth=[ground_truth])
+    # The features can be given as a FeaturePlan, e.g. one with a FeatureCache
+    feature_plan = get_cached_feature_plan(features_list, normalized_features)
+    num_features = feature_plan.num_features
+    env = TrialSequence(
+        num_trials=1,
+        pipeline=pipeline,
+        ground_truth=[ground_truth],
+        trial_class=ArrayTrial,
+    )
     trial = env.trial_sequence[0]
     num_actions = len(trial_actions)
     num_nodes = trial.num_nodes
     action_feature_values = np.zeros((num_actions, num_nodes, num_features))
     for i, action in enumerate(trial_actions):
         node_map = trial.node_map
-        trial_feature_values = compute_current_features(
-            trial, features_list, normalized_features
-        )
-        for node_num in range(num_nodes):
-            action_feature_values[i][node_num] = trial_feature_values[node_num]
+        action_feature_values[i] = feature_plan.evaluate(trial)
         node_map[action].observe()
     return action_feature_values
 
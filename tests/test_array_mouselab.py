@@ -0,0 +1,372 @@
+import random
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from mcl_toolbox.env.array_mouselab import ArrayTrial, get_trial_class
+from mcl_toolbox.env.feature_plan import FeaturePlan
+from mcl_toolbox.env.modified_mouselab import TrialSequence, reward_val
+from mcl_toolbox.global_vars import features
+from mcl_toolbox.utils.planning_strategies import strategy_dict
+from mcl_toolbox.utils.sequence_utils import (
+    compute_current_features,
+    compute_trial_feature_log_likelihood,
+    compute_trial_features,
+    generate_clicks,
+)
+
+"""
+Tests that the array backed trials behave like the Node based trials
+python3 -m unittest tests.test_array_mouselab
+"""
+
+parameters = [
+    # branching, seed
+    [[3, 1, 2], 0],
+    [[3, 1, 2], 1],
+    [[2, 2, 2], 2],
+]
+
+
+def construct_sequences(branching, seed, num_trials=3):
+    pipeline = [(branching, reward_val)] * num_trials
+    np.random.seed(seed)
+    node_sequence = TrialSequence(num_trials, pipeline)
+    ground_truth = [list(gt) for gt in node_sequence.ground_truth]
+    array_sequence = TrialSequence(
+        num_trials, pipeline, ground_truth=ground_truth, trial_class=ArrayTrial
+    )
+    return node_sequence, array_sequence
+
+
+class TestArrayMouselab(unittest.TestCase):
+    @parameterized.expand(parameters)
+    def test_feature_values(self, branching, seed):
+        feature_list = features.implemented + [
+            "num_clicks",
+            "return_if_terminating",
+            "hp_0",
+            "hs_24",
+        ]
+        node_sequence, array_sequence = construct_sequences(branching, seed)
+        rng = random.Random(seed)
+        for node_trial, array_trial in zip(
+            node_sequence.trial_sequence, array_sequence.trial_sequence
+        ):
+            clicks = list(range(1, node_trial.num_nodes))
+            rng.shuffle(clicks)
+            for click in clicks:
+                node_features = compute_current_features(node_trial, feature_list, None)
+                array_features = compute_current_features(
+                    array_trial, feature_list, None
+                )
+                self.assertTrue(np.array_equal(node_features, array_features))
+                node_trial.node_map[click].observe()
+                array_trial.node_map[click].observe()
+            self.assertEqual(
+                node_trial.get_path_expected_values(),
+                array_trial.get_path_expected_values(),
+            )
+
+    @parameterized.expand(parameters)
+    def test_compiled_node_values(self, branching, seed):
+        feature_list = sorted(
+            set(features.implemented + features.microscope)
+            | {"num_clicks", "num_clicks_adaptive", "hp_0", "hs_24"}
+        )
+        feature_plan = FeaturePlan(feature_list)
+        rng = random.Random(seed)
+        for sequence in construct_sequences(branching, seed):
+            trial = sequence.trial_sequence[0]
+            clicks = list(range(1, trial.num_nodes))
+            rng.shuffle(clicks)
+            for click in clicks:
+                for node in trial.node_map.values():
+                    self.assertEqual(
+                        feature_plan.compute_node_values(node),
+                        node.compute_termination_feature_values(feature_list),
+                    )
+                trial.node_map[click].observe()
+
+    def test_sequence_statistics(self):
+        # More than 100 nodes
+        branching = [5, 5, 4]
+        node_sequence, array_sequence = construct_sequences(branching, 0, num_trials=2)
+        rng = random.Random(0)
+        for sequence in [node_sequence, array_sequence]:
+            observed_values = {depth: [] for depth in range(1, len(branching) + 1)}
+            for trial in sequence.trial_sequence:
+                clicks = rng.sample(range(1, trial.num_nodes), 40)
+                for click in clicks:
+                    trial.node_map[click].observe()
+                    observed_values[trial.node_map[click].depth].append(
+                        trial.node_map[click].value
+                    )
+                trial.unobserve(clicks[0])
+                observed_values[trial.node_map[clicks[0]].depth].remove(
+                    trial.node_map[clicks[0]].value
+                )
+            self.assertEqual(sequence.node_click_count.shape, (trial.num_nodes,))
+            for depth, values in observed_values.items():
+                self.assertAlmostEqual(
+                    sequence.get_level_std(depth), np.std(values), delta=1e-9
+                )
+            click_counts = sequence.node_click_count
+            for node in list(trial.node_map.values())[1:]:
+                self.assertEqual(
+                    node.get_level_count(),
+                    sum(click_counts[other.label] for other in trial.level_map[node.depth]),
+                )
+                self.assertEqual(
+                    node.get_branch_count(),
+                    max(
+                        sum(click_counts[label] for label in trial.branch_map[branch])
+                        for branch in trial.reverse_branch_map[node.label]
+                    ),
+                )
+
+    @parameterized.expand(parameters)
+    def test_observed_node_order(self, branching, seed):
+        rng = random.Random(seed)
+        for sequence in construct_sequences(branching, seed):
+            trial = sequence.trial_sequence[0]
+            observed = []
+            unobserved = list(trial.node_map.values())
+            clicks = rng.sample(range(1, trial.num_nodes), 6)
+            for click in clicks:
+                trial.node_map[click].observe()
+                observed.append(trial.node_map[click])
+                unobserved.remove(trial.node_map[click])
+            for click in clicks[1:3]:
+                trial.unobserve(click)
+                observed.remove(trial.node_map[click])
+                unobserved.append(trial.node_map[click])
+            self.assertEqual(trial.observed_nodes, observed)
+            self.assertEqual(trial.unobserved_nodes, unobserved)
+            self.assertIs(trial.previous_observed, observed[-1])
+            self.assertIn(observed[0], trial.observed_nodes)
+            self.assertNotIn(observed[0], trial.unobserved_nodes)
+            labels = trial.unobserved_nodes.get_labels()
+            self.assertEqual(labels.tolist(), [node.label for node in unobserved])
+            self.assertIs(trial.unobserved_nodes.get_labels(), labels)
+            trial.node_map[labels[-1]].observe()
+            self.assertEqual(
+                trial.unobserved_nodes.get_labels().tolist(), labels[:-1].tolist()
+            )
+            with self.assertRaises(ValueError):
+                trial.observed_nodes.remove(trial.root)
+
+    @parameterized.expand(parameters)
+    def test_observation_bookkeeping(self, branching, seed):
+        _, array_sequence = construct_sequences(branching, seed)
+        trial = array_sequence.trial_sequence[0]
+        trial.node_map[1].observe()
+        trial.node_map[2].observe()
+        self.assertEqual(list(np.flatnonzero(trial.observed_mask)), [1, 2])
+        self.assertEqual(trial.get_observed_node_count(), 2)
+        trial.unobserve(2)
+        self.assertFalse(trial.node_map[2].observed)
+        self.assertIs(trial.previous_observed, trial.node_map[1])
+        trial.reset_observations()
+        self.assertFalse(trial.observed_mask.any())
+        self.assertEqual(trial.get_unobserved_node_count(), trial.num_nodes)
+
+    def test_planning_strategies(self):
+        node_sequence, array_sequence = construct_sequences([3, 1, 2], 0, 1)
+        for strategy_num in [1, 5, 10, 30, 60]:
+            node_trial = node_sequence.trial_sequence[0]
+            array_trial = array_sequence.trial_sequence[0]
+            node_trial.reset_observations()
+            array_trial.reset_observations()
+            random.seed(strategy_num)
+            node_clicks = strategy_dict[strategy_num](node_trial)
+            random.seed(strategy_num)
+            array_clicks = strategy_dict[strategy_num](array_trial)
+            self.assertEqual(node_clicks, array_clicks)
+
+    def test_trial_backend(self):
+        # The backend switch of the functions that construct their own trials
+        pipeline = [([3, 1, 2], reward_val)] * 2
+        weights = np.random.default_rng(0).normal(size=len(features.microscope))
+        clicks = []
+        for trial_backend in ["node", "array"]:
+            np.random.seed(0)
+            clicks.append(
+                generate_clicks(
+                    pipeline,
+                    2,
+                    weights,
+                    features.microscope,
+                    None,
+                    trial_backend=trial_backend,
+                )
+            )
+        self.assertEqual(clicks[0], clicks[1])
+        with self.assertRaises(ValueError):
+            get_trial_class("graph")
+
+    @parameterized.expand(parameters)
+    def test_path_expected_values(self, branching, seed):
+        # The incrementally updated path values and summary match a full
+        # recomputation after every observation
+        node_sequence, array_sequence = construct_sequences(branching, seed)
+        rng = random.Random(seed)
+        for node_trial, array_trial in zip(
+            node_sequence.trial_sequence, array_sequence.trial_sequence
+        ):
+            clicks = list(range(1, node_trial.num_nodes))
+            rng.shuffle(clicks)
+            steps = [(click, True) for click in clicks]
+            steps[5:5] = [(click, False) for click in clicks[:3]]
+            steps[9:9] = [(click, True) for click in clicks[:3]]
+            for click, observe in steps:
+                for trial in [node_trial, array_trial]:
+                    if observe:
+                        trial.node_map[click].observe()
+                    else:
+                        trial.unobserve(click)
+                    expected_path_values = {
+                        path_num: trial.get_path_expected_value(path_num)
+                        for path_num in trial.branch_map
+                    }
+                    self.assertEqual(
+                        trial.get_path_expected_values(), expected_path_values
+                    )
+                    sorted_values = sorted(
+                        set(expected_path_values.values()), reverse=True
+                    )
+                    best_value = sorted_values[0]
+                    self.assertEqual(
+                        trial.get_path_value_summary(),
+                        (
+                            best_value,
+                            sorted_values[1] if len(sorted_values) > 1 else None,
+                            {
+                                path_num
+                                for path_num, value in expected_path_values.items()
+                                if value == best_value
+                            },
+                        ),
+                    )
+
+    def test_level_std_offset(self):
+        # The running statistics don't lose the spread of values far from 0
+        sequence = construct_sequences([2, 2], 0, num_trials=1)[0]
+        rng = np.random.default_rng(0)
+        values = list(1e9 + rng.standard_normal(50))
+        for value in values:
+            sequence.add_observed_value(1, value)
+        for value in values[:10]:
+            sequence.remove_observed_value(1, value)
+        self.assertAlmostEqual(
+            sequence.get_level_std(1), np.std(values[10:]), delta=1e-6
+        )
+        self.assertEqual(sequence.get_level_stds()[1], sequence.get_level_std(1))
+        for value in values[10:]:
+            sequence.remove_observed_value(1, value)
+        self.assertEqual(sequence.get_level_std(1), 0)
+
+    def test_statistics_key(self):
+        # The key depends on the observed values, not the order of the updates
+        sequence = construct_sequences([2, 2], 0, num_trials=1)[0]
+        other = sequence.fork_statistics()
+        values = [0.1, 0.2, 0.7, 1e9, -3.0]
+        for value in values:
+            sequence.add_observed_value(1, value)
+        for value in [5.5] + values[::-1]:
+            other.add_observed_value(1, value)
+        other.remove_observed_value(1, 5.5)
+        self.assertEqual(sequence.get_statistics_key(7), other.get_statistics_key(7))
+        other.remove_observed_value(1, 0.1)
+        other.add_observed_value(1, 0.1 + 1e-12)
+        self.assertNotEqual(
+            sequence.get_statistics_key(7), other.get_statistics_key(7)
+        )
+        other.add_observed_value(2, 0.1)
+        other.remove_observed_value(1, 0.1 + 1e-12)
+        self.assertNotEqual(
+            sequence.get_statistics_key(7), other.get_statistics_key(7)
+        )
+        sequence.reset_observed_values()
+        forked = sequence.fork_statistics()
+        self.assertEqual(sequence.get_statistics_key(7), forked.get_statistics_key(7))
+        self.assertEqual(sequence.get_statistics_key(7)[1], (frozenset(),) * 3)
+
+    @parameterized.expand(parameters)
+    def test_snapshot_restore(self, branching, seed):
+        feature_list = features.implemented + ["num_clicks"]
+        for sequence in construct_sequences(branching, seed):
+            trial = sequence.trial_sequence[1]
+            rng = random.Random(seed)
+            clicks = list(range(1, trial.num_nodes))
+            rng.shuffle(clicks)
+            for click in clicks[:3]:
+                trial.node_map[click].observe()
+            token = trial.snapshot()
+            snapshot_features = compute_current_features(trial, feature_list, None)
+            statistics_key = sequence.get_statistics_key(trial.num_nodes)
+            trial.unobserve(clicks[1])
+            for click in clicks[3:6]:
+                trial.node_map[click].observe()
+            trial.restore(token)
+            self.assertEqual(trial.observed_nodes, list(token.observed_nodes))
+            self.assertEqual(trial.unobserved_nodes, list(token.unobserved_nodes))
+            self.assertEqual(
+                sequence.get_statistics_key(trial.num_nodes), statistics_key
+            )
+            self.assertTrue(
+                np.array_equal(
+                    compute_current_features(trial, feature_list, None),
+                    snapshot_features,
+                )
+            )
+
+            fork = trial.fork()
+            fork.node_map[clicks[6]].observe()
+            self.assertFalse(trial.node_map[clicks[6]].observed)
+            self.assertEqual(
+                sequence.get_statistics_key(trial.num_nodes), statistics_key
+            )
+            trial.node_map[clicks[6]].observe()
+            self.assertTrue(
+                np.array_equal(
+                    compute_current_features(fork, feature_list, None),
+                    compute_current_features(trial, feature_list, None),
+                )
+            )
+
+    @parameterized.expand(parameters)
+    def test_restored_log_likelihood(self, branching, seed):
+        # Replaying the clicks from a restored trial gives the likelihood of a
+        # reset trial and leaves the click statistics of the sequence unchanged
+        feature_list = features.implemented + ["num_clicks"]
+        rng = np.random.default_rng(seed)
+        for sequence in construct_sequences(branching, seed):
+            trial = sequence.trial_sequence[0]
+            clicks = list(rng.permutation(range(1, trial.num_nodes))[:4]) + [0]
+            trial_features = compute_trial_features(
+                sequence.pipeline, trial.ground_truth, clicks, feature_list, None
+            )
+            weights = [rng.standard_normal(len(feature_list)) for _ in range(3)]
+            log_likelihoods = [
+                compute_trial_feature_log_likelihood(
+                    trial, trial_features, clicks, w
+                )
+                for w in weights
+            ]
+            trial.reset_observations()
+            token = trial.snapshot()
+            statistics_key = sequence.get_statistics_key(trial.num_nodes)
+            for w, log_likelihood in zip(weights, log_likelihoods):
+                self.assertAlmostEqual(
+                    compute_trial_feature_log_likelihood(
+                        trial, trial_features, clicks, w, reset=False
+                    ),
+                    log_likelihood,
+                )
+                trial.restore(token)
+                self.assertEqual(trial.observed_nodes, [])
+                self.assertEqual(
+                    sequence.get_statistics_key(trial.num_nodes), statistics_key
+                )
@@ -0,0 +1,135 @@
+import pickle
+import subprocess
+import sys
+import unittest
+
+import numpy as np
+import scipy.stats
+from parameterized import parameterized
+
+from mcl_toolbox.env.modified_mouselab import normal_reward_val, reward_val
+from mcl_toolbox.utils.distributions import (
+    Categorical,
+    Normal,
+    PointMass,
+    cmax,
+    cross,
+    get_discrete_normals,
+    get_moments,
+)
+
+"""
+Tests the NumPy backed Categorical distribution
+python3 -m unittest tests.test_distributions
+"""
+
+categorical_tests_parameters = [
+    # distribution
+    [Categorical([-10, -5, 5, 10])],
+    [Categorical([-48, -24, 24, 48], [0.1, 0.2, 0.3, 0.4])],
+    [reward_val(3)],
+    [normal_reward_val(2)],
+]
+
+
+max_tests_parameters = [
+    # distributions
+    [[reward_val(1), reward_val(2), reward_val(3)]],
+    [[reward_val(3), reward_val(3) + reward_val(1), PointMass(4)]],
+    [[Categorical([-100, -50, -20, -10, -5, 0, 5, 10, 20, 50, 100])] * 4],
+    [[Categorical([3, 1, 3, 2], [0.1, 0.2, 0.3, 0.4]), normal_reward_val(1)]],
+]
+
+
+class TestCategorical(unittest.TestCase):
+    @parameterized.expand(categorical_tests_parameters)
+    def test_sample(self, dist):
+        # Draws the same values as np.random.choice with the global state
+        for n in [None, 1, 1000]:
+            np.random.seed(0)
+            samples = dist.sample(n)
+            np.random.seed(0)
+            expected = np.array(dist.vals)[
+                np.random.choice(len(dist.vals), p=dist.probs, size=n)
+            ]
+            self.assertTrue(np.array_equal(samples, expected))
+            self.assertEqual(np.shape(samples), np.shape(expected))
+        with self.assertRaises(ValueError):
+            Categorical([1, 2], [0.5, 0.6]).sample()
+
+    @parameterized.expand(categorical_tests_parameters)
+    def test_moments(self, dist):
+        expectation = sum(p * v for p, v in zip(dist.probs, dist.vals))
+        var = sum(v ** 2 * p for v, p in dist) - expectation ** 2
+        self.assertEqual(dist.expectation(), expectation)
+        self.assertEqual(dist.var(), var)
+        self.assertEqual(dist.std(), var ** 0.5)
+        self.assertTrue(np.array_equal(dist.val_array, dist.vals))
+        self.assertAlmostEqual(dist.cdf[-1], 1)
+
+    @parameterized.expand(categorical_tests_parameters)
+    def test_hash(self, dist):
+        copy = Categorical(list(dist.vals), np.array(dist.probs))
+        self.assertEqual(copy, dist)
+        self.assertEqual(hash(copy), hash(dist))
+        self.assertEqual(hash(dist), hash((dist.vals, dist.probs)))
+        dist.expectation()
+        dist.sample()
+        unpickled = pickle.loads(pickle.dumps(dist))
+        self.assertEqual(unpickled, dist)
+        self.assertEqual(hash(unpickled), hash(dist))
+        self.assertEqual(unpickled.var(), dist.var())
+
+    @parameterized.expand(max_tests_parameters)
+    def test_max(self, dists):
+        # Same distribution as the maximum over the product of the supports
+        dist = cmax(dists)
+        self.assertEqual(dist, cross(dists, max))
+        self.assertEqual(dist.vals, cross(dists, max).vals)
+        self.assertIs(cmax(dists), dist)
+        self.assertEqual(cmax(dists[::-1]), cross(dists[::-1], max))
+
+    def test_max_zero_probabilities(self):
+        # Values with zero probability are kept like in the product
+        dists = [Categorical([1, 5], [1, 0]), Categorical([3, 2], [0.5, 0.5])]
+        dist = cmax(dists)
+        self.assertEqual(dist.vals, (3, 2, 5))
+        self.assertEqual(dist.probs, (0.5, 0.5, 0))
+        self.assertEqual(dist, cross(dists, max))
+
+    @parameterized.expand([[0, 8, 257, 4], [0, 32, 257, 4], [1.5, 3, 10, 2]])
+    def test_discrete_normal(self, mu, sigma, n, max_sigma):
+        # Same discretization with and without the table
+        dist = Normal(mu, sigma).to_discrete(n=n, max_sigma=max_sigma)
+        self.assertIn((mu, sigma, n, max_sigma), get_discrete_normals())
+        vals = np.linspace(-max_sigma * sigma + mu, max_sigma * sigma + mu, n)
+        delta = vals[1] - vals[0]
+        bins = np.array((-np.inf, *(vals[1:] - delta / 2), np.inf))
+        probs = np.diff(scipy.stats.norm(mu, sigma).cdf(bins))
+        self.assertEqual(dist, Categorical(vals, probs))
+
+    def test_vectorized_moments(self):
+        dists = [dist for dist, in categorical_tests_parameters]
+        dists += [Normal(1, 3), PointMass(4), 2.5]
+        expectations, variances, stds = get_moments(dists)
+        for i, dist in enumerate(dists[:-1]):
+            self.assertEqual(expectations[i], dist.expectation())
+            self.assertEqual(variances[i], dist.var())
+            self.assertEqual(stds[i], dist.std())
+        self.assertEqual(
+            (expectations[-1], variances[-1], stds[-1]), (2.5, 0, 0)
+        )
+
+    def test_import_without_scipy(self):
+        # SciPy is only imported when a distribution needs it
+        code = (
+            "import sys; sys.modules['scipy'] = None; "
+            "sys.modules['scipy.stats'] = None; "
+            "from mcl_toolbox.utils.distributions import Categorical; "
+            "print(Categorical([-4, 4]).expectation())"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "0.0")
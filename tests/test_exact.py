@@ -0,0 +1,169 @@
+import os
+import tempfile
+import unittest
+from itertools import product
+
+from parameterized import parameterized
+
+from mcl_toolbox.env.mouselab import MouselabEnv
+from mcl_toolbox.utils.distributions import Categorical
+from mcl_toolbox.utils.exact_utils import (
+    build_partial_q_dictionary,
+    construct_partial_q_dictionary,
+)
+from mcl_toolbox.utils.exact import StateEncoder, hash_tree, solve, solve_recursive
+
+"""
+Tests the state encoding and the solvers of the exact module
+python3 -m unittest tests.test_exact
+"""
+
+
+def reward(depth):
+    if depth == 1:
+        return Categorical([-4, 4])
+    elif depth == 2:
+        return Categorical([-8, -4, 4, 8], [0.1, 0.2, 0.3, 0.4])
+
+
+exact_tests_parameters = [
+    # branching
+    [[2, 1]],
+    [[2, 2]],
+    [[3, 1]],
+]
+
+
+class TestExact(unittest.TestCase):
+    @parameterized.expand(exact_tests_parameters)
+    def test_state_encoding(self, branching):
+        env = MouselabEnv.new_symmetric(branching, reward, seed=0, cost=-1)
+        encoder = StateEncoder(env)
+        # A state is the value or the distribution of each node
+        node_states = [
+            (dist,) if not hasattr(dist, "vals") else (dist, *dist.vals)
+            for dist in env.init
+        ]
+        codes = {}
+        for state in product(*node_states):
+            code = encoder.encode(state)
+            self.assertGreaterEqual(code, 0)
+            # The subtrees of the children of a node are identical, so states
+            # that are the same with sorted children are the same
+            def canonical_state(node):
+                children = sorted(canonical_state(child) for child in env.tree[node])
+                return str(state[node]), tuple(children)
+
+            self.assertEqual(
+                codes.setdefault(code, canonical_state(0)), canonical_state(0)
+            )
+        self.assertEqual(len(set(codes.values())), len(codes))
+        self.assertEqual(encoder.encode(env.term_state), env.term_state)
+        self.assertLess(encoder.encode(env.init, (1, 2)), 0)
+        self.assertNotEqual(
+            encoder.encode(env.init, (1, 2)), encoder.encode(env.init, (1,))
+        )
+        with self.assertRaises(ValueError):
+            encoder.encode((0, 3, *env.init[2:]))
+
+    @parameterized.expand(exact_tests_parameters)
+    def test_solve(self, branching):
+        # Same values as with the hash of the tree
+        env = MouselabEnv.new_symmetric(branching, reward, seed=0, cost=-1)
+        Q, V, _, info = solve_recursive(env)
+        hashed_Q, hashed_V, _, hashed_info = solve(
+            env, hash_state=lambda state: hash_tree(env, state)
+        )
+        self.assertEqual(V(env.init), hashed_V(env.init))
+        self.assertEqual(info, hashed_info)
+        self.assertEqual(len(V.cache), info["v"])
+        for action in env.actions(env.init):
+            self.assertEqual(Q(env.init, action), hashed_Q(env.init, action))
+
+    @parameterized.expand(exact_tests_parameters)
+    def test_tree_solver(self, branching):
+        # Same values as the recursive solver, with the arrays in memory
+        # or in files
+        env = MouselabEnv.new_symmetric(branching, reward, seed=0, cost=-1)
+        recursive_Q, recursive_V, recursive_pi, _ = solve_recursive(env)
+        with tempfile.TemporaryDirectory() as spill_dir:
+            for max_memory in [None, 0]:
+                Q, V, pi, info = solve(
+                    env, method="arrays", max_memory=max_memory, spill_dir=spill_dir
+                )
+                self.assertEqual(info["spilled_bytes"] > 0, max_memory == 0)
+                self.assertAlmostEqual(V(env.init), recursive_V(env.init))
+                states = [env.init, (0, 4, *env.init[2:])]
+                for state in states:
+                    self.assertAlmostEqual(V(state), recursive_V(state))
+                    self.assertEqual(pi(state), recursive_pi(state))
+                    for action in env.actions(state):
+                        self.assertAlmostEqual(
+                            Q(state, action), recursive_Q(state, action)
+                        )
+                self.assertEqual(V(env.term_state), 0)
+        with self.assertRaises(ValueError):
+            V((0, 3, *env.init[2:]))
+
+    def test_asymmetric_tree_solver(self):
+        # Sibling subtrees with different shapes and distributions
+        tree = [[1, 4, 6], [2, 3], [], [], [5], [], []]
+        init = [
+            0,
+            Categorical([-4, 4]),
+            Categorical([-8, 8]),
+            Categorical([-8, -4, 4, 8], [0.1, 0.2, 0.3, 0.4]),
+            Categorical([-4, 4], [0.3, 0.7]),
+            Categorical([-24, 24]),
+            Categorical([-2, 2]),
+        ]
+        env = MouselabEnv(tree, init, cost=-1)
+        recursive_Q, recursive_V, recursive_pi, _ = solve_recursive(env)
+        Q, V, pi, _ = solve(env, method="arrays")
+        states = [
+            env.init,
+            (0, 4, *env.init[2:]),
+            (0, env.init[1], 8, env.init[3], -4, *env.init[5:]),
+            (0, env.init[1], env.init[2], -8, *env.init[4:6], 2),
+        ]
+        for state in states:
+            self.assertAlmostEqual(V(state), recursive_V(state))
+            self.assertEqual(pi(state), recursive_pi(state))
+            for action in env.actions(state):
+                self.assertAlmostEqual(Q(state, action), recursive_Q(state, action))
+        with self.assertRaises(ValueError):
+            solve(env, method="tables")
+        with self.assertRaises(ValueError):
+            solve(env, hash_state=lambda state: state, method="arrays")
+
+    def test_parallel_q_dictionary(self):
+        env = MouselabEnv.new_symmetric([2, 2], reward, seed=0, cost=-1)
+        Q, _, _, _ = solve(env)
+        ground_truths = [
+            [0, *values]
+            for values in product([-4, 4], [-8, 8], [4], [-4, 4], [8], [-8])
+        ]
+        q_dictionary = construct_partial_q_dictionary(Q, env, ground_truths)
+        with tempfile.TemporaryDirectory() as store_dir:
+            shards_q_dictionary = build_partial_q_dictionary(
+                Q, env, ground_truths, store_dir, num_workers=2, shard_size=3
+            )
+            self.assertEqual(shards_q_dictionary, q_dictionary)
+            # An interrupted build only builds the missing shards
+            os.remove(os.path.join(store_dir, "shard_00001.pkl"))
+            calls = []
+
+            def counted_Q(state, action):
+                calls.append(state)
+                return Q(state, action)
+
+            resumed_q_dictionary = build_partial_q_dictionary(
+                counted_Q, env, ground_truths, store_dir, num_workers=1, shard_size=3
+            )
+            self.assertEqual(resumed_q_dictionary, q_dictionary)
+            num_calls = len(calls)
+            # The shards are slices of the sorted ground truths
+            construct_partial_q_dictionary(counted_Q, env, sorted(ground_truths)[3:6])
+            self.assertEqual(num_calls, len(calls) - num_calls)
+            with self.assertRaises(ValueError):
+                build_partial_q_dictionary(Q, env, ground_truths[:3], store_dir)
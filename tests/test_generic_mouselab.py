@@ -1,13 +1,28 @@
+import random
 import unittest
 
+import numpy as np
 from mouselab.envs.registry import registry
 from parameterized import parameterized
 
+from mcl_toolbox.env.feature_plan import (
+    FeatureCache,
+    FeaturePlan,
+    get_cached_feature_plan,
+)
 from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
-from mcl_toolbox.utils.learning_utils import construct_repeated_pipeline, create_mcrl_reward_distribution
+from mcl_toolbox.env.modified_mouselab import TrialSequence, get_termination_mers
+from mcl_toolbox.global_vars import features
+from mcl_toolbox.utils.learning_utils import (
+    construct_repeated_pipeline,
+    create_mcrl_reward_distribution,
+    get_normalization_vectors,
+    get_normalized_feature_values,
+)
+from mcl_toolbox.utils.sequence_utils import compute_current_features
 
 """
-Currently only tests costs to make sure they are being experienced
+Tests costs to make sure they are being experienced and the feature state
 python3 -m unittest tests.test_generic_mouselab
 """
 
@@ -25,6 +40,20 @@ click_cost_tests_parameters = [
     ["high_increasing", 30, 0, 2, [-2, -4, -6, -6, -2, -4, -6, -6, -2, -4, -6, -6]],
 ]
 
+feature_state_tests_parameters = [
+    # experiment setting, trial backend, seed
+    ["high_increasing", "node", 0],
+    ["high_increasing", "array", 1],
+]
+
+reset_tests_parameters = [
+    # experiment setting, trial backend, reset mode
+    ["high_increasing", "node", "reuse"],
+    ["high_increasing", "array", "reuse"],
+    ["high_increasing", "node", "rebuild"],
+    ["high_increasing", "node", "resample"],
+]
+
 
 class TestGenericMouselab(unittest.TestCase):
     @parameterized.expand(click_cost_tests_parameters)
@@ -47,3 +76,247 @@ class TestGenericMouselab(unittest.TestCase):
             costs.append(cost)
 
         self.assertTrue(costs == resulting_costs)
+
+    @parameterized.expand(feature_state_tests_parameters)
+    def test_incremental_feature_state(self, exp_setting, trial_backend, seed):
+        feature_list = sorted(
+            set(features.implemented + features.microscope)
+            | {"num_clicks", "return_if_terminating", "hp_0", "hs_24"}
+        )
+        num_trials = 3
+        branching = registry(exp_setting).branching
+        reward_distributions = create_mcrl_reward_distribution(exp_setting)
+        pipeline = construct_repeated_pipeline(
+            branching, reward_distributions, num_trials
+        )
+        np.random.seed(seed)
+        env = GenericMouselabEnv(
+            num_trials,
+            pipeline=pipeline,
+            trial_backend=trial_backend,
+            check_feature_state=True,
+        )
+        env.attach_features(feature_list, None)
+        env.reset()
+        rng = random.Random(seed)
+        for _ in range(num_trials):
+            actions = list(range(1, env.num_nodes))
+            rng.shuffle(actions)
+            for action in actions[: rng.randint(1, len(actions))] + [0]:
+                env.step(action)
+                self.assertTrue(
+                    np.array_equal(
+                        env.get_feature_state(),
+                        compute_current_features(env.present_trial, feature_list, None),
+                    )
+                )
+            env.get_next_trial()
+
+    @parameterized.expand(reset_tests_parameters)
+    def test_reset(self, exp_setting, trial_backend, reset_mode):
+        num_trials = 3
+        branching = registry(exp_setting).branching
+        reward_distributions = create_mcrl_reward_distribution(exp_setting)
+        pipeline = construct_repeated_pipeline(
+            branching, reward_distributions, num_trials
+        )
+        np.random.seed(0)
+        env = GenericMouselabEnv(
+            num_trials,
+            pipeline=pipeline,
+            trial_backend=trial_backend,
+            reset_mode=reset_mode,
+        )
+        ground_truth = [list(trial_values) for trial_values in env.ground_truth]
+        trials = env.trial_sequence.trial_sequence
+        first_state = list(env.reset())
+        for _ in range(num_trials - 1):
+            for action in [3, 1, 4, 0]:
+                env.step(action)
+        state = env.reset()
+        self.assertEqual(env.present_trial_num, 0)
+        self.assertEqual(state, first_state)
+        self.assertEqual(env.present_trial.observed_nodes, [])
+        self.assertEqual(env.trial_sequence.get_click_count(3), 0)
+        self.assertEqual(
+            [node.label for node in env.present_trial.level_map[3]],
+            [3, 4, 7, 8, 11, 12],
+        )
+        self.assertEqual(
+            env.present_trial.get_path_expected_values(),
+            {path_num: 0 for path_num in env.present_trial.branch_map},
+        )
+        self.assertEqual(
+            env.trial_sequence.trial_sequence is trials, reset_mode == "reuse"
+        )
+        if reset_mode == "resample":
+            self.assertNotEqual(env.ground_truth, ground_truth)
+        else:
+            self.assertEqual(
+                [list(trial_values) for trial_values in env.ground_truth],
+                ground_truth,
+            )
+
+    @parameterized.expand(feature_state_tests_parameters)
+    def test_termination_mers(self, exp_setting, trial_backend, seed):
+        num_trials = 4
+        branching = registry(exp_setting).branching
+        reward_distributions = create_mcrl_reward_distribution(exp_setting)
+        pipeline = construct_repeated_pipeline(
+            branching, reward_distributions, num_trials
+        )
+        np.random.seed(seed)
+        env = GenericMouselabEnv(num_trials, pipeline, trial_backend=trial_backend)
+        rng = random.Random(seed)
+        trial_actions = []
+        for _ in range(num_trials):
+            clicks = list(range(1, env.num_nodes))
+            rng.shuffle(clicks)
+            actions = clicks[: rng.randint(0, len(clicks))] + [0]
+            for action in actions:
+                env.step(action)
+            trial_actions.append(actions)
+            env.get_next_trial()
+        replayed_mers = []
+        for trial_num, actions in enumerate(trial_actions):
+            trial = TrialSequence(
+                1,
+                [pipeline[trial_num]],
+                ground_truth=[list(env.ground_truth[trial_num])],
+            ).trial_sequence[0]
+            for action in actions[:-1]:
+                trial.node_map[action].observe()
+            replayed_mers.append(trial.get_path_value_summary()[0])
+        self.assertEqual(env.get_termination_mers(trial_actions), replayed_mers)
+        self.assertEqual(
+            get_termination_mers(env.ground_truth, trial_actions, pipeline),
+            replayed_mers,
+        )
+        # Clicks that differ from the recorded ones are computed from the clicks
+        trial_actions[0] = [0]
+        self.assertEqual(
+            env.get_termination_mers(trial_actions)[0],
+            get_termination_mers(env.ground_truth[:1], [[0]], pipeline)[0],
+        )
+
+    @parameterized.expand(feature_state_tests_parameters)
+    def test_feature_cache(self, exp_setting, trial_backend, seed):
+        feature_list = sorted(
+            set(features.implemented + features.microscope)
+            | {"num_clicks", "return_if_terminating", "hp_0", "hs_24"}
+        )
+        num_trials = 3
+        branching = registry(exp_setting).branching
+        reward_distributions = create_mcrl_reward_distribution(exp_setting)
+        pipeline = construct_repeated_pipeline(
+            branching, reward_distributions, num_trials
+        )
+        np.random.seed(seed)
+        env = GenericMouselabEnv(num_trials, pipeline, trial_backend=trial_backend)
+        feature_cache = FeatureCache(maxsize=1000)
+        env.attach_features(FeaturePlan(feature_list, None, cache=feature_cache), None)
+        rng = random.Random(seed)
+        trial_actions = []
+        for _ in range(num_trials):
+            clicks = list(range(1, env.num_nodes))
+            rng.shuffle(clicks)
+            trial_actions.append(clicks[: rng.randint(1, len(clicks))] + [0])
+        # The second simulation revisits the states of the first one
+        for simulation in range(2):
+            env.reset()
+            for actions in trial_actions:
+                for action in actions:
+                    env.step(action)
+                    self.assertTrue(
+                        np.array_equal(
+                            env.get_feature_state(),
+                            compute_current_features(
+                                env.present_trial, feature_list, None
+                            ),
+                        )
+                    )
+                env.get_next_trial()
+            if simulation == 0:
+                first_info = feature_cache.info()
+        info = feature_cache.info()
+        self.assertEqual(info["misses"], first_info["misses"])
+        self.assertGreaterEqual(info["hits"] - first_info["hits"], info["misses"])
+        self.assertEqual(info["size"], info["misses"])
+        feature_cache.maxsize = 2
+        feature_cache.put("key", np.zeros(1))
+        self.assertEqual(len(feature_cache), 2)
+        with self.assertRaises(ValueError):
+            FeatureCache(maxsize=0)
+
+    @parameterized.expand(feature_state_tests_parameters)
+    def test_normalization(self, exp_setting, trial_backend, seed):
+        feature_list = features.microscope
+        rng = np.random.default_rng(seed)
+        min_values = dict(zip(feature_list, rng.integers(-10, 10, len(feature_list))))
+        max_values = {
+            feature: value + rng.integers(0, 3) for feature, value in min_values.items()
+        }
+        normalized_features = (max_values, min_values)
+        branching = registry(exp_setting).branching
+        pipeline = construct_repeated_pipeline(
+            branching, create_mcrl_reward_distribution(exp_setting), 1
+        )
+        np.random.seed(seed)
+        env = GenericMouselabEnv(1, pipeline, trial_backend=trial_backend)
+        for action in rng.permutation(np.arange(1, env.num_nodes))[:5]:
+            env.step(action)
+        trial = env.present_trial
+        raw_values = compute_current_features(trial, feature_list, None)
+        feature_values = compute_current_features(
+            trial, feature_list, normalized_features
+        )
+        for node_num in range(trial.num_nodes):
+            for index, feature in enumerate(feature_list):
+                max_min_diff = max_values[feature] - min_values[feature]
+                expected = 0
+                if max_min_diff != 0:
+                    expected = (
+                        raw_values[node_num, index] - min_values[feature]
+                    ) / max_min_diff
+                self.assertEqual(feature_values[node_num, index], expected)
+        self.assertTrue(
+            np.array_equal(
+                get_normalized_feature_values(
+                    raw_values, feature_list, normalized_features
+                ),
+                feature_values,
+            )
+        )
+        # The vectors are computed once per feature list and normalization,
+        # looked up by the values of the features
+        vectors = get_normalization_vectors(feature_list, normalized_features)
+        self.assertIs(
+            vectors,
+            get_normalization_vectors(list(feature_list), normalized_features),
+        )
+        max_values, min_values = normalized_features
+        self.assertIs(
+            vectors,
+            get_normalization_vectors(
+                feature_list, (dict(max_values), dict(min_values))
+            ),
+        )
+        changed_max_values = dict(max_values)
+        changed_max_values[feature_list[0]] = max_values[feature_list[0]] + 1
+        changed_vectors = get_normalization_vectors(
+            feature_list, (changed_max_values, min_values)
+        )
+        self.assertEqual(changed_vectors[1][0], vectors[1][0] + 1)
+        # The plans are compiled once per feature list and normalization
+        feature_plan = get_cached_feature_plan(feature_list, normalized_features)
+        self.assertIs(
+            feature_plan,
+            get_cached_feature_plan(
+                list(feature_list), (dict(max_values), dict(min_values))
+            ),
+        )
+        self.assertIs(get_cached_feature_plan(feature_plan), feature_plan)
+        self.assertIsNot(
+            get_cached_feature_plan(feature_list, (changed_max_values, min_values)),
+            feature_plan,
+        )
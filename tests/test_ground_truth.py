@@ -0,0 +1,86 @@
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from mcl_toolbox.env.ground_truth import (
+    iter_ground_truths,
+    sample_ground_truths,
+    sample_pipeline_ground_truths,
+)
+from mcl_toolbox.env.modified_mouselab import reward_val
+from mcl_toolbox.env.tree_template import get_tree_template
+from mcl_toolbox.utils.learning_utils import (
+    construct_repeated_pipeline,
+    construct_reward_function,
+)
+
+"""
+Tests the batched sampling of ground truths
+python3 -m unittest tests.test_ground_truth
+"""
+
+
+class Uniform:
+    """Distribution without batched sampling"""
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def sample(self):
+        return np.random.uniform(self.low, self.high)
+
+
+def uniform_reward(depth):
+    return Uniform(-depth, depth)
+
+
+ground_truth_tests_parameters = [
+    # pipeline
+    [[([3, 1, 2], reward_val)] * 4],
+    [[([3, 1, 2], reward_val)] * 2 + [([2, 2], reward_val)] * 3],
+    [
+        construct_repeated_pipeline(
+            [2, 2], construct_reward_function([(0, 5), (0, 10)], "normal"), 3
+        )
+    ],
+    [[([3, 1, 2], uniform_reward)] * 3],
+]
+
+
+class TestGroundTruth(unittest.TestCase):
+    @parameterized.expand(ground_truth_tests_parameters)
+    def test_same_as_node_sampling(self, pipeline):
+        # Draws the same values as sampling node by node with the global state
+        np.random.seed(0)
+        ground_truths = sample_pipeline_ground_truths(pipeline)
+        next_value = np.random.random()
+        np.random.seed(0)
+        for trial_num, (branching, reward_function) in enumerate(pipeline):
+            depths = get_tree_template(tuple(branching)).depths
+            self.assertEqual(ground_truths[trial_num][0], 0)
+            for node_num in range(1, len(depths)):
+                self.assertEqual(
+                    ground_truths[trial_num][node_num],
+                    reward_function(depths[node_num]).sample(),
+                )
+        self.assertEqual(np.random.random(), next_value)
+
+    def test_random_state(self):
+        pipeline_entry = ([3, 1, 2], reward_val)
+        ground_truths = sample_ground_truths(pipeline_entry, 25, random_state=3)
+        self.assertEqual(ground_truths.shape, (25, 13))
+        self.assertTrue((ground_truths[:, 0] == 0).all())
+        np.testing.assert_array_equal(
+            ground_truths,
+            sample_ground_truths(
+                pipeline_entry, 25, random_state=np.random.default_rng(3)
+            ),
+        )
+        chunks = list(iter_ground_truths(pipeline_entry, 25, 10, random_state=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        np.testing.assert_array_equal(np.concatenate(chunks), ground_truths)
+        with self.assertRaises(ValueError):
+            next(iter_ground_truths(pipeline_entry, 25, 0))
+
@@ -0,0 +1,150 @@
+import unittest
+
+import numpy as np
+import torch
+from parameterized import parameterized
+
+from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.env.modified_mouselab import reward_val
+from mcl_toolbox.global_vars import features
+from mcl_toolbox.models.reinforce_models import REINFORCE, BaselineREINFORCE
+
+"""
+Tests the lockstep simulations of the learners against the sequential ones
+python3 -m unittest tests.test_lockstep_simulations
+"""
+
+lockstep_tests_parameters = [
+    # use pseudo rewards, termination value known, is null
+    [False, False, False],
+    [True, False, False],
+    [True, True, False],
+    [True, False, True],
+]
+
+
+def get_scripted_actions(num_trials, num_nodes, seed):
+    # Observing all the nodes before terminating, so that the taken paths
+    # don't depend on how ties are broken
+    rng = np.random.default_rng(seed)
+    actions = []
+    for _ in range(num_trials):
+        actions.extend(rng.permutation(np.arange(1, num_nodes)).tolist() + [0])
+    return actions
+
+
+class ScriptedREINFORCE(REINFORCE):
+    """REINFORCE that takes the actions of a script"""
+
+    def __init__(self, params, attributes, actions):
+        super().__init__(params, attributes)
+        self.actions = list(actions)
+        self.action_num = 0
+
+    def get_action(self, env):
+        m = self.get_action_details(env)
+        action = self.actions[self.action_num]
+        self.action_num += 1
+        self.policy.saved_log_probs.append(m.log_prob(torch.tensor(action)))
+        return action
+
+    def sample_lockstep_actions(self, probs):
+        action = self.actions[self.action_num]
+        self.action_num += 1
+        return np.full(len(probs), action)
+
+
+def get_learner_arguments(use_pseudo_rewards, termination_value_known, is_null):
+    # A low inverse temperature, so that the scripted actions stay likely
+    # enough for the single precision probabilities of the PyTorch policy
+    rng = np.random.default_rng(0)
+    feature_list = features.implemented
+    params = {
+        "lr": np.log(0.05),
+        "gamma": np.log(0.9),
+        "inverse_temperature": np.log(0.1),
+        "pr_weight": 0.5,
+        "subjective_cost": 0.3,
+        "priors": rng.standard_normal(len(feature_list)),
+    }
+    attributes = {
+        "features": feature_list,
+        "normalized_features": None,
+        "use_pseudo_rewards": use_pseudo_rewards,
+        "is_null": is_null,
+        "num_actions": 13,
+        "no_term": False,
+        "vicarious_learning": False,
+        "termination_value_known": termination_value_known,
+    }
+    return params, attributes
+
+
+class TestLockstepSimulations(unittest.TestCase):
+    @parameterized.expand(lockstep_tests_parameters)
+    def test_same_as_sequential(self, *learner_options):
+        num_trials = 4
+        params, attributes = get_learner_arguments(*learner_options)
+        actions = get_scripted_actions(num_trials, 13, 0)
+        pipeline = [([3, 1, 2], reward_val)] * num_trials
+        np.random.seed(0)
+        env = GenericMouselabEnv(num_trials, pipeline)
+        learner = ScriptedREINFORCE(params, attributes, actions)
+        expected = learner.run_multiple_simulations(env, 1)
+        learner = ScriptedREINFORCE(params, attributes, actions)
+        data = learner.run_multiple_simulations(env, 3, lockstep=True)
+        for key in ["r", "w", "a", "mer"]:
+            self.assertEqual(len(data[key]), 3)
+        for sim_num in range(3):
+            self.assertEqual(data["a"][sim_num], expected["a"][0])
+            np.testing.assert_allclose(data["r"][sim_num], expected["r"][0])
+            np.testing.assert_allclose(data["mer"][sim_num], expected["mer"][0])
+            # The PyTorch policy computes the action probabilities in single
+            # precision
+            np.testing.assert_allclose(
+                data["w"][sim_num], expected["w"][0], rtol=1e-5, atol=1e-5
+            )
+        if learner_options[-1]:
+            self.assertEqual(data["w"][0][0], data["w"][0][-1])
+        else:
+            self.assertNotEqual(data["w"][0][0], data["w"][0][-1])
+
+    def test_sampled_simulations(self):
+        params, attributes = get_learner_arguments(True, False, False)
+        num_trials = 3
+        pipeline = [([3, 1, 2], reward_val)] * num_trials
+        for reset_mode in ["reuse", "resample"]:
+            np.random.seed(1)
+            env = GenericMouselabEnv(num_trials, pipeline, reset_mode=reset_mode)
+            learner = REINFORCE(params, attributes)
+            data = learner.run_multiple_simulations(env, 20, lockstep=True)
+            for sim_num in range(20):
+                self.assertEqual(len(data["a"][sim_num]), num_trials)
+                self.assertEqual(len(data["w"][sim_num]), num_trials)
+                for trial_actions in data["a"][sim_num]:
+                    self.assertEqual(trial_actions[-1], 0)
+                    self.assertNotIn(0, trial_actions[:-1])
+                    self.assertEqual(len(set(trial_actions)), len(trial_actions))
+            # The agents act independently
+            self.assertGreater(len({str(actions) for actions in data["a"]}), 1)
+
+    def test_unsupported_simulations(self):
+        params, attributes = get_learner_arguments(False, False, False)
+        pipeline = [([3, 1, 2], reward_val)] * 2
+        env = GenericMouselabEnv(2, pipeline)
+        learner = REINFORCE(params, attributes)
+        with self.assertRaises(ValueError):
+            learner.run_multiple_simulations(
+                env, 2, compute_likelihood=True, participant=object(), lockstep=True
+            )
+        with self.assertRaises(ValueError):
+            learner.run_multiple_simulations(
+                GenericMouselabEnv(2, pipeline, feedback="action"), 2, lockstep=True
+            )
+        learner.path_learn = True
+        with self.assertRaises(ValueError):
+            learner.run_multiple_simulations(env, 2, lockstep=True)
+        params["value_lr"] = np.log(0.01)
+        learner = BaselineREINFORCE(params, attributes)
+        with self.assertRaises(ValueError):
+            learner.run_multiple_simulations(env, 2, lockstep=True)
@@ -0,0 +1,243 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.env.mouselab import MouselabEnv
+from mcl_toolbox.utils.distributions import Categorical
+from mcl_toolbox.utils.exact import solve, solve_recursive
+from mcl_toolbox.utils.exact_utils import construct_partial_q_dictionary
+from mcl_toolbox.utils.learning_utils import pickle_save
+from mcl_toolbox.utils.q_table import (
+    LazyQFunction,
+    PipelineQFunction,
+    QTable,
+    convert_q_dictionary,
+    load_q_fn,
+)
+
+"""
+Tests the Q tables and lazy Q functions of the metacognitive feedback
+python3 -m unittest tests.test_q_table
+"""
+
+
+def reward(depth):
+    if depth == 1:
+        return Categorical([-4, 4])
+    elif depth == 2:
+        return Categorical([-8, -4, 4, 8], [0.1, 0.2, 0.3, 0.4])
+
+
+def transfer_reward(depth):
+    if depth == 1:
+        return Categorical([-2, 2])
+    elif depth == 2:
+        return Categorical([-24, 24])
+
+
+q_table_tests_parameters = [
+    # branching, trial backend
+    [[2, 1], "node"],
+    [[2, 2], "node"],
+    [[2, 2], "array"],
+]
+
+
+class TestQTable(unittest.TestCase):
+    @parameterized.expand(q_table_tests_parameters)
+    def test_metacognitive_feedback(self, branching, trial_backend):
+        # Same feedback with the Q table as with the q dictionary
+        num_trials = 3
+        np.random.seed(0)
+        pipeline = [(branching, reward)] * num_trials
+        mouselab_env = MouselabEnv.new_symmetric(branching, reward, seed=0, cost=-1)
+        Q, _, _, _ = solve(mouselab_env)
+        ground_truths = GenericMouselabEnv(num_trials, pipeline).ground_truth
+        q_dictionary = construct_partial_q_dictionary(Q, mouselab_env, ground_truths)
+
+        with tempfile.TemporaryDirectory() as data_dir:
+            pickle_save(
+                {"q_dictionary": q_dictionary}, os.path.join(data_dir, "test_q.pkl")
+            )
+            self.assertIs(type(load_q_fn("test", data_dir)), dict)
+            convert_q_dictionary(
+                os.path.join(data_dir, "test_q.pkl"),
+                os.path.join(data_dir, "test_q_table"),
+            )
+            q_table = load_q_fn("test", data_dir)
+            self.assertIsInstance(q_table.q_values, np.memmap)
+            self.assertEqual(q_table.q_values.dtype, np.float32)
+            self.assertEqual(len(q_table), len(q_dictionary))
+            for pair, q_value in q_dictionary.items():
+                self.assertAlmostEqual(q_table[pair], q_value, places=4)
+
+            envs = [
+                GenericMouselabEnv(
+                    num_trials,
+                    pipeline,
+                    ground_truth=ground_truths,
+                    feedback="meta",
+                    q_fn=q_fn,
+                    trial_backend=trial_backend,
+                )
+                for q_fn in [q_dictionary, q_table]
+            ]
+            rng = np.random.default_rng(0)
+            for _ in range(num_trials):
+                done = False
+                while not done:
+                    actions = envs[0].get_available_actions()
+                    for action in actions:
+                        self.assertAlmostEqual(
+                            envs[0].get_metacognitive_feedback(action),
+                            envs[1].get_metacognitive_feedback(action),
+                            places=4,
+                        )
+                    action = actions[rng.integers(len(actions))]
+                    for env in envs:
+                        _, _, done, _ = env.step(action)
+                for env in envs:
+                    env.get_next_trial()
+
+    def test_encoding(self):
+        q_table = QTable(
+            [(0,), (-4, 4), (-8, 8)],
+            np.zeros(0, dtype=np.int64),
+            np.zeros((0, 4), dtype=np.float32),
+        )
+        states = [
+            (0, dist_1, dist_2)
+            for dist_1 in [Categorical([-4, 4]), -4, 4]
+            for dist_2 in [Categorical([-8, 8]), -8, 8]
+        ]
+        codes = [q_table.encode(state) for state in states]
+        self.assertEqual(len(set(codes)), len(states))
+        self.assertEqual(
+            q_table.encode_trial([0, 4, -8], 0b110), q_table.encode(states[-2])
+        )
+        self.assertEqual(
+            q_table.encode_trial([0, 4, -8], 0b010), q_table.encode(states[-3])
+        )
+        with self.assertRaises(KeyError):
+            q_table[(states[0], 1)]
+        with self.assertRaises(ValueError):
+            QTable([(0,)], np.zeros(1, dtype=np.int64), np.zeros((0, 2)))
+
+    @parameterized.expand(q_table_tests_parameters)
+    def test_lazy_q_function(self, branching, trial_backend):
+        # Same Q values and feedback as the q dictionary of the recursive solver
+        num_trials = 3
+        np.random.seed(0)
+        pipeline = [(branching, reward)] * num_trials
+        mouselab_env = MouselabEnv.new_symmetric(branching, reward, seed=0, cost=-1)
+        Q, _, _, _ = solve_recursive(mouselab_env)
+        ground_truths = GenericMouselabEnv(num_trials, pipeline).ground_truth
+        q_dictionary = construct_partial_q_dictionary(Q, mouselab_env, ground_truths)
+        with tempfile.TemporaryDirectory() as data_dir:
+            self.assertIsInstance(
+                load_q_fn("test", data_dir, lazy=True), PipelineQFunction
+            )
+            cache_path = os.path.join(data_dir, "test_q_cache.pkl")
+            lazy_q_fn = LazyQFunction(
+                pipeline[0], maxsize=10, memo_size=1000, cache_path=cache_path
+            )
+            for pair, q_value in q_dictionary.items():
+                self.assertEqual(lazy_q_fn[pair], q_value)
+            self.assertEqual(len(lazy_q_fn), 10)
+            self.assertLessEqual(lazy_q_fn.info()["memoized_states"], 1000)
+            lazy_q_fn.save()
+            saved_q_fn = LazyQFunction(pipeline[0], cache_path=cache_path)
+            self.assertEqual(len(saved_q_fn), 10)
+            for pair in list(q_dictionary)[-10:]:
+                self.assertEqual(saved_q_fn[pair], q_dictionary[pair])
+            self.assertEqual(saved_q_fn.info()["misses"], 0)
+            self.assertGreater(lazy_q_fn.info()["lookup_time"], 0)
+            unpickled_q_fn = pickle.loads(pickle.dumps(lazy_q_fn))
+            self.assertEqual(len(unpickled_q_fn), 10)
+            for pair in list(q_dictionary)[-20:]:
+                self.assertEqual(unpickled_q_fn[pair], q_dictionary[pair])
+
+        envs = [
+            GenericMouselabEnv(
+                num_trials,
+                pipeline,
+                ground_truth=ground_truths,
+                feedback="meta",
+                q_fn=q_fn,
+                trial_backend=trial_backend,
+            )
+            for q_fn in [q_dictionary, "lazy"]
+        ]
+        self.assertIsInstance(envs[1].q_fn, PipelineQFunction)
+        # The Q values are solved with the click costs of the env, which
+        # can depend on the depth
+        cost_env = GenericMouselabEnv(
+            num_trials,
+            pipeline,
+            ground_truth=ground_truths,
+            feedback="meta",
+            q_fn="lazy",
+            cost=[1, 2],
+        )
+        mouselab_cost_env = MouselabEnv.new_symmetric(
+            branching,
+            reward,
+            cost=lambda node, last_action, graph: -(
+                1 + 2 * graph.nodes[node]["depth"]
+            ),
+        )
+        cost_Q, _, _, _ = solve_recursive(mouselab_cost_env)
+        # The env and its Q function can be pickled
+        cost_env = pickle.loads(pickle.dumps(cost_env))
+        cost_q_fn = cost_env.q_fn.get_q_fn(pipeline[0])
+        for action in mouselab_cost_env.actions(mouselab_cost_env.init):
+            self.assertEqual(
+                cost_q_fn[(mouselab_cost_env.init, action)],
+                cost_Q(mouselab_cost_env.init, action),
+            )
+        rng = np.random.default_rng(0)
+        for _ in range(num_trials):
+            done = False
+            while not done:
+                actions = envs[0].get_available_actions()
+                for action in actions:
+                    self.assertEqual(
+                        envs[0].get_metacognitive_feedback(action),
+                        envs[1].get_metacognitive_feedback(action),
+                    )
+                action = actions[rng.integers(len(actions))]
+                for env in envs:
+                    _, _, done, _ = env.step(action)
+            for env in envs:
+                env.get_next_trial()
+
+    def test_pipeline_q_function(self):
+        # Each trial of a mixed pipeline gets the Q values of its own entry
+        pipeline = [([2, 2], reward), ([2, 1], transfer_reward), ([2, 2], reward)]
+        np.random.seed(0)
+        env = GenericMouselabEnv(3, pipeline, feedback="meta", q_fn="lazy")
+        solvers = [
+            solve_recursive(MouselabEnv.new_symmetric(*entry, cost=-1))[0]
+            for entry in pipeline
+        ]
+        self.assertIs(env.q_fn.get_q_fn(pipeline[0]), env.q_fn.get_q_fn(pipeline[2]))
+        for Q in solvers:
+            state = env.get_state()
+            actions = env.get_available_actions()
+            qs = {a: Q(state, env.env_action(a)) for a in actions}
+            for action in actions:
+                mcfb_delay = 2 + max(qs.values()) - qs[action]
+                self.assertEqual(
+                    env.get_metacognitive_feedback(action),
+                    0 if mcfb_delay == 2 else mcfb_delay,
+                )
+            env.step(actions[1])
+            env.get_next_trial()
+        self.assertEqual(env.q_fn.info()["num_q_functions"], 2)
+        with self.assertRaises(ValueError):
+            PipelineQFunction(cache_path="q_cache.pkl")
@@ -0,0 +1,85 @@
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from mcl_toolbox.env.array_mouselab import ArrayTrial
+from mcl_toolbox.env.modified_mouselab import TrialSequence, reward_val
+from mcl_toolbox.env.tree_template import construct_structure_map, get_tree_template
+
+"""
+Tests the tree templates shared by trials with the same branching
+python3 -m unittest tests.test_tree_template
+"""
+
+parameters = [
+    # branching, branch map
+    [[3, 1, 2], {1: (0, 1, 2, 3), 2: (0, 1, 2, 4), 3: (0, 5, 6, 7)}],
+    [[2, 2], {1: (0, 1, 2), 2: (0, 1, 3), 3: (0, 4, 5), 4: (0, 4, 6)}],
+]
+
+
+class TestTreeTemplate(unittest.TestCase):
+    @parameterized.expand(parameters)
+    def test_template(self, branching, branch_map):
+        template = get_tree_template(tuple(branching))
+        self.assertIs(template, get_tree_template(tuple(branching)))
+        self.assertEqual(template.structure_map, construct_structure_map(branching))
+        self.assertEqual(template.max_depth, len(branching))
+        for path_num, path in branch_map.items():
+            self.assertEqual(template.branch_map[path_num], path)
+            for node_num in path:
+                self.assertIn(path_num, template.reverse_branch_map[node_num])
+        leaf = branch_map[1][-1]
+        self.assertEqual(
+            list(np.flatnonzero(template.ancestor_matrix[leaf])),
+            list(branch_map[1][1:-1]),
+        )
+        self.assertEqual(
+            list(np.flatnonzero(template.successor_matrix[0])),
+            list(range(1, template.num_nodes)),
+        )
+        self.assertEqual(
+            template.successor_labels[0], tuple(range(1, template.num_nodes))
+        )
+        self.assertEqual(
+            template.ancestor_labels[leaf], tuple(reversed(branch_map[1][1:-1]))
+        )
+        for relation, matrix in [
+            (template.successor_bits, template.successor_matrix),
+            (template.ancestor_bits, template.ancestor_matrix),
+            (template.children_bits, template.children_matrix),
+            (template.sibling_bits, template.sibling_matrix),
+        ]:
+            for node_num in range(template.num_nodes):
+                self.assertEqual(
+                    relation[node_num],
+                    sum(1 << int(label) for label in np.flatnonzero(matrix[node_num])),
+                )
+
+    def test_observed_bits(self):
+        pipeline = [([3, 1, 2], reward_val)] * 2
+        for trial_class in [None, ArrayTrial]:
+            trial = TrialSequence(2, pipeline, trial_class=trial_class).trial_sequence[0]
+            for click in [1, 4, 3]:
+                trial.node_map[click].observe()
+            trial.unobserve(4)
+            self.assertEqual(trial.observed_bits, (1 << 1) | (1 << 3))
+            self.assertEqual(trial.node_map[1].get_observed_successor_count(), 1)
+            self.assertEqual(trial.node_map[4].get_observed_siblings_count(), 1)
+            self.assertEqual(trial.node_map[7].get_observed_same_depth_count(), 1)
+            trial.reset_observations()
+            self.assertEqual(trial.observed_bits, 0)
+
+    def test_shared_between_trials(self):
+        pipeline = [([3, 1, 2], reward_val)] * 3
+        trials = TrialSequence(3, pipeline).trial_sequence
+        self.assertIs(trials[0].template, trials[2].template)
+        self.assertIs(trials[0].branch_map, trials[1].branch_map)
+        self.assertIsNot(trials[0].node_map, trials[1].node_map)
+        for trial in trials:
+            for node_num, node in trial.node_map.items():
+                self.assertEqual(node.depth, trial.template.depths[node_num])
+            self.assertEqual(
+                [node.label for node in trial.level_map[3]], [3, 4, 7, 8, 11, 12]
+            )
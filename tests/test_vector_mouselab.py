@@ -0,0 +1,150 @@
+import random
+import unittest
+
+import numpy as np
+from mouselab.envs.registry import registry
+from parameterized import parameterized
+
+from mcl_toolbox.env.generic_mouselab import GenericMouselabEnv
+from mcl_toolbox.env.modified_mouselab import TrialSequence
+from mcl_toolbox.env.vector_mouselab import VectorMouselabEnv
+from mcl_toolbox.global_vars import features
+from mcl_toolbox.utils.learning_utils import construct_repeated_pipeline, create_mcrl_reward_distribution
+
+"""
+Tests the lockstep environment against GenericMouselabEnv
+python3 -m unittest tests.test_vector_mouselab
+"""
+
+feature_list = sorted(
+    set(features.implemented + features.microscope)
+    | {
+        "num_clicks",
+        "return_if_terminating",
+        "first_observed",
+        "immediate_termination",
+        "is_observed",
+        "value",
+        "planning",
+    }
+)
+
+vector_env_tests_parameters = [
+    # experiment setting, number of environments, shared ground truth, seed
+    ["high_increasing", 4, True, 0],
+    ["high_increasing", 5, False, 1],
+]
+
+
+class TestVectorMouselab(unittest.TestCase):
+    @parameterized.expand(vector_env_tests_parameters)
+    def test_lockstep_steps(self, exp_setting, num_envs, shared_ground_truth, seed):
+        num_trials = 3
+        branching = registry(exp_setting).branching
+        reward_distributions = create_mcrl_reward_distribution(exp_setting)
+        pipeline = construct_repeated_pipeline(
+            branching, reward_distributions, num_trials
+        )
+        np.random.seed(seed)
+        vector_env = VectorMouselabEnv(
+            num_envs,
+            num_trials,
+            pipeline,
+            cost=[1, 1],
+            shared_ground_truth=shared_ground_truth,
+        )
+        vector_env.attach_features(feature_list, None)
+        if shared_ground_truth:
+            ground_truths = [vector_env.ground_truth] * num_envs
+        else:
+            ground_truths = vector_env.ground_truth
+        envs = []
+        for ground_truth in ground_truths:
+            env = GenericMouselabEnv(
+                num_trials,
+                pipeline,
+                ground_truth=[list(trial_values) for trial_values in ground_truth],
+                cost=[1, 1],
+                trial_backend="array",
+            )
+            env.attach_features(feature_list, None)
+            envs.append(env)
+
+        rng = random.Random(seed)
+        num_nodes = vector_env.num_nodes
+        plans = [[] for _ in range(num_envs)]
+        while vector_env.active.any():
+            actions = []
+            for env_num in range(num_envs):
+                if not plans[env_num]:
+                    clicks = list(range(1, num_nodes))
+                    rng.shuffle(clicks)
+                    # Repeated clicks are penalized and do not change the state
+                    plans[env_num] = clicks[: rng.randint(0, num_nodes - 1)] + [
+                        clicks[0],
+                        0,
+                    ]
+                actions.append(plans[env_num].pop(0))
+            active = vector_env.active.copy()
+            feature_state, rewards, dones, info = vector_env.step(actions)
+            for env_num, env in enumerate(envs):
+                if not active[env_num]:
+                    self.assertEqual(rewards[env_num], 0)
+                    continue
+                _, reward, done, _ = env.step(actions[env_num])
+                self.assertEqual(dones[env_num], done)
+                if done:
+                    taken_path = info["taken_paths"][env_num]
+                    path_values = {
+                        path: sum(
+                            env.present_trial.node_map[node].value
+                            if env.present_trial.node_map[node].observed
+                            else 0
+                            for node in path
+                        )
+                        for path in env.present_trial.branch_map.values()
+                    }
+                    self.assertEqual(
+                        path_values[tuple(taken_path)], max(path_values.values())
+                    )
+                    self.assertEqual(
+                        rewards[env_num],
+                        sum(env.present_trial.node_map[node].value for node in taken_path),
+                    )
+                    if env.get_next_trial() == -1:
+                        self.assertFalse(vector_env.active[env_num])
+                        continue
+                else:
+                    self.assertEqual(rewards[env_num], reward)
+                np.testing.assert_allclose(
+                    feature_state[env_num], env.get_feature_state(), atol=1e-9
+                )
+
+    @parameterized.expand(vector_env_tests_parameters)
+    def test_ground_truth(self, exp_setting, num_envs, shared_ground_truth, seed):
+        # Same values as a sequence of trials per environment
+        pipeline = construct_repeated_pipeline(
+            registry(exp_setting).branching,
+            create_mcrl_reward_distribution(exp_setting),
+            3,
+        )
+        np.random.seed(seed)
+        vector_env = VectorMouselabEnv(
+            num_envs, 3, pipeline, shared_ground_truth=shared_ground_truth
+        )
+        np.random.seed(seed)
+        ground_truths = [
+            TrialSequence(3, pipeline).ground_truth
+            for _ in range(1 if shared_ground_truth else num_envs)
+        ]
+        if shared_ground_truth:
+            ground_truths = ground_truths[0]
+        np.testing.assert_array_equal(
+            np.array(vector_env.ground_truth, dtype=float),
+            np.array(ground_truths, dtype=float),
+        )
+
+    def test_unsupported_feature(self):
+        vector_env = VectorMouselabEnv(2)
+        with self.assertRaises(ValueError):
+            vector_env.attach_features(["unknown_feature"], None)